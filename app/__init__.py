@@ -7,10 +7,13 @@ import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from config import config
+from app.db_routing import RoutingSession
 
-# 创建数据库实例
-db = SQLAlchemy()
+# 创建数据库实例（会话按视图将只读查询发往副本，见 app/db_routing.py）
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # 创建登录管理器实例
 login_manager = LoginManager()
@@ -20,6 +23,16 @@ login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
 
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    """SQLite默认不检查外键，开启后 ON DELETE CASCADE 才会生效"""
+    import sqlite3
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
+
+
 def create_app(config_name=None):
     """
     创建Flask应用实例的工厂函数
@@ -42,13 +55,31 @@ def create_app(config_name=None):
     
     # 从配置对象加载配置
     app.config.from_object(config[config_name])
+    # 记录配置名称（静态导出等子进程按同一配置创建应用）
+    app.config['CONFIG_NAME'] = config_name
+    
+    # 图片和静态文件请求跳过会话Cookie的解码和写回
+    from app.sessions import LightweightSessionInterface
+    app.session_interface = LightweightSessionInterface()
+    
+    # 文本响应按 Accept-Encoding 压缩（最先注册，因此在所有 after_request 钩子之后执行）
+    from app import compression
+    compression.init_app(app)
     
     # 确保上传文件夹存在
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     
+    # 按流量类型隔离的连接池（需要在创建引擎之前配置）
+    from app import db_pools
+    db_pools.init_app(app)
+    
     # 初始化数据库
     db.init_app(app)
     
+    # 只读副本路由（配置了 DATABASE_REPLICA_URLS 时生效）
+    from app import db_routing
+    db_routing.init_app(app)
+    
     # 初始化登录管理器
     login_manager.init_app(app)
     
@@ -65,6 +96,30 @@ def create_app(config_name=None):
     from app.admin import admin_bp as admin_blueprint
     app.register_blueprint(admin_blueprint, url_prefix='/admin')
     
+    # 注册静态资源路由和 asset_url() 模板函数
+    from app import asset_pipeline
+    asset_pipeline.init_app(app)
+    
+    # 注册 {% cache %} 模板片段缓存标签和模板字节码缓存
+    from app import fragment_cache
+    fragment_cache.init_app(app)
+    
+    # 页面数据快照的进程内缓存
+    from app import snapshots
+    snapshots.init_app(app)
+    
+    # 前台产品目录的进程内只读模型（数据变化后在后台重新生成）
+    from app import catalog
+    catalog.init_app(app)
+    
+    # 按需的请求采样分析
+    from app import profiler
+    profiler.init_app(app)
+    
+    # 跨工作进程的缓存失效消息监听
+    from app import invalidation
+    invalidation.init_app(app)
+    
     # 注册模板过滤器：JSON解析
     @app.template_filter('from_json')
     def from_json_filter(value):
@@ -110,6 +165,24 @@ def create_app(config_name=None):
             # 旧数据（UTC）会显示错误，但用户说旧数据不用管
             return dt.strftime(format_str)
     
+    # 图片请求的限流和防盗链检查（挂载的图片服务和前台蓝图中的图片路由共用）
+    from app import rate_limit
+    rate_limit.init_app(app)
+    
+    # 图片请求交给轻量图片服务处理，不经过完整的 Flask 请求流程
+    if app.config.get('IMAGE_APP_ENABLED'):
+        from app.image_server import mount
+        mount(app)
+    
+    # 按地址分组的并发限制和降载（包装在最外层，包括图片服务）
+    from app import load_shedding
+    load_shedding.init_app(app)
+    
+    # 启动统计计数器的定时核对线程
+    if app.config.get('STATS_RECONCILE_INTERVAL') and not app.testing:
+        from app.stats import start_reconciler
+        start_reconciler(app, app.config['STATS_RECONCILE_INTERVAL'])
+    
     # 注册CLI命令
     register_cli_commands(app)
     
@@ -118,6 +191,7 @@ def create_app(config_name=None):
 
 def register_cli_commands(app):
     """注册Flask CLI命令"""
+    import click
     from werkzeug.security import generate_password_hash
     from app.models import User, Category, Product, ProductImage
     import os
@@ -278,12 +352,132 @@ def register_cli_commands(app):
     @app.cli.command('db-migrate')
     def db_migrate():
         """数据库迁移命令"""
+        from app.migrations import upgrade
         try:
             # 只创建不存在的表，不删除现有表
             db.create_all()
+            # 执行尚未执行的版本化迁移（索引等 create_all 无法处理的变更）
+            executed = upgrade()
+            for version in executed:
+                print(f'已执行迁移: {version}')
             print('数据库表结构更新完成。')
         except Exception as e:
             print(f'数据库迁移失败: {str(e)}')
+    
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        """编译并压缩样式和脚本，生成带内容哈希的文件和预压缩文件"""
+        import sys
+        from app.asset_pipeline import build_assets, output_dir, brotli, AssetBuildError
+        
+        try:
+            bundles = build_assets()
+        except AssetBuildError as e:
+            print(f'资源构建失败: {str(e)}')
+            sys.exit(1)
+        for name, filename in bundles.items():
+            print(f'{name} -> {filename}')
+        if brotli is None:
+            print('未安装 brotli，只生成了 .gz 预压缩文件（pip install brotli 后重新构建可生成 .br）')
+        print(f'资源构建完成，输出目录: {output_dir()}')
+    
+    @app.cli.command('export-static')
+    @click.option('--workers', type=int, default=None, help='渲染进程数，默认为CPU核数')
+    @click.option('--full', is_flag=True, help='忽略上次导出的状态，全部重新渲染')
+    def export_static_command(workers, full):
+        """将前台页面和图片导出为静态文件（增量），供 Nginx 直接提供"""
+        from app.static_export import export_site, export_dir
+        
+        result = export_site(workers=workers, full=full)
+        for url in result['rendered']:
+            print(f'已导出: {url}')
+        for url in result['removed']:
+            print(f'已删除: {url}')
+        for url, status in result['failed']:
+            print(f'导出失败: {url} (HTTP {status})')
+        print(f"静态导出完成：渲染 {len(result['rendered'])} 个，删除 {len(result['removed'])} 个，"
+              f"未变化 {result['skipped']} 个，输出目录: {export_dir()}")
+    
+    @app.cli.command('reconcile-stats')
+    def reconcile_stats_command():
+        """核对仪表盘统计计数器（可配置为定时任务）"""
+        from app.stats import reconcile, get_counters
+        
+        drift = reconcile()
+        if drift:
+            print(f'已修正计数器偏差: {drift}')
+        print(f'当前计数器: {get_counters()}')
+    
+    @app.cli.command('refresh-related')
+    @click.option('--full', is_flag=True, help='重新计算所有产品（默认只计算还没有推荐列表的产品）')
+    def refresh_related_command(full):
+        """计算相关产品推荐"""
+        from app.recommendations import refresh, missing_product_ids, wait_for_refresh
+        
+        wait_for_refresh()
+        count = refresh() if full else refresh(missing_product_ids())
+        print(f'相关产品推荐计算完成，共 {count} 个产品。')
+    
+    @app.cli.command('sign-image-url')
+    @click.argument('kind', type=click.Choice(['product', 'gallery', 'page-content']))
+    @click.argument('object_id', type=int)
+    @click.option('--days', type=int, default=None, help='有效天数（默认 IMAGE_URL_SIGNATURE_TTL）')
+    def sign_image_url_command(kind, object_id, days):
+        """生成供外部站点嵌入的签名图片地址"""
+        from app.rate_limit import signed_image_url
+        
+        with app.test_request_context(base_url=app.config['SITE_URL']):
+            print(signed_image_url(kind, object_id, days * 86400 if days else None))
+    
+    @app.cli.command('gc-blobs')
+    def gc_blobs_command():
+        """全量回收外部图片存储中已删除记录对应的文件"""
+        from app.blob_store import sweep, wait_for_gc
+        
+        wait_for_gc()
+        removed = sweep()
+        print(f'外部图片存储回收完成，共删除 {removed} 个文件或目录。')
+    
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """检查热点查询的执行计划，发现全表扫描时以非零状态码退出"""
+        import sys
+        from app.query_plans import check_query_plans
+        
+        report = check_query_plans()
+        failed = False
+        for name, result in report.items():
+            status = '❌' if result['problems'] else '✅'
+            print(f'{status} {name}')
+            for line in result['plan']:
+                print(f'    {line}')
+            for problem in result['problems']:
+                print(f'    -> {problem}')
+            failed = failed or bool(result['problems'])
+        
+        if failed:
+            print('存在退化为全表扫描的热点查询，请执行 flask db-migrate 或检查索引定义。')
+            sys.exit(1)
+        print('所有热点查询均使用索引。')
+    
+    @app.cli.command('warm-cache')
+    @click.option('--url', 'urls', multiple=True, help='预热的地址（可多次指定），默认按 CACHE_WARM_URLS 或访问日志确定')
+    @click.option('--workers', type=int, default=None, help='并发线程数，默认 CACHE_WARM_WORKERS')
+    @click.option('--limit', type=int, default=None, help='最多预热的地址数，默认 CACHE_WARM_LIMIT')
+    def warm_cache_command(urls, workers, limit):
+        """部署后预热热门页面和图片（数据库缓冲区、快照表、外部图片存储）"""
+        import sys
+        from app.warmup import warm, summarize
+        
+        report = warm(app, list(urls), workers=workers, limit=limit)
+        for url, status, duration, size in sorted(report['results'], key=lambda result: -result[2]):
+            print(f'{status}  {duration * 1000:8.1f}ms  {size:>9}B  {url}')
+        stats = summarize(report)
+        print(f"缓存预热完成（{report['source']}）：{stats['count']} 个地址，失败 {stats['failed']} 个，"
+              f"总耗时 {stats['elapsed']:.2f}s，p50 {stats['p50'] * 1000:.0f}ms，"
+              f"p95 {stats['p95'] * 1000:.0f}ms，最慢 {stats['max'] * 1000:.0f}ms")
+        if stats['failed']:
+            sys.exit(1)
 
 
 def init_db():
@@ -337,6 +531,8 @@ def load_user(user_id):
     
     Returns:
         User: 用户对象，如果不存在返回None
+    
+    注意：用户数据在进程内缓存 USER_CACHE_TTL 秒，修改密码、权限或激活状态时立即失效
     """
-    from app.models import User
-    return User.query.get(int(user_id))
\ No newline at end of file
+    from app.user_cache import load_cached_user
+    return load_cached_user(int(user_id))
\ No newline at end of file
@@ -3,7 +3,8 @@
 后台管理模块
 实现管理员对产品、分类等内容的管理功能
 """
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, abort, \
+    send_from_directory
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 import os
@@ -14,6 +15,7 @@ from app import db
 from app.models import Category, Product, ProductImage, Contact, PageContent
 from app.forms import CategoryForm, ProductForm, ProductEditForm, ProductImageForm
 from app.auth import admin_required
+from app import stats, bulk_actions, blob_store, recommendations, snapshots, catalog, db_pools, profiler, single_flight, sitemap
 
 # 创建后台管理蓝图
 admin_bp = Blueprint('admin', __name__, template_folder='templates/admin')
@@ -26,13 +28,8 @@ def admin_dashboard():
     后台管理仪表盘
     显示概览信息，包括产品数量、分类数量等统计数据
     """
-    # 获取产品和分类的统计信息
-    product_count = Product.query.count()
-    active_product_count = Product.query.filter_by(status=True).count()  # 已上架产品数量
-    category_count = Category.query.count()
-    
-    # 获取未读联系表单数量
-    unread_contact_count = Contact.query.filter_by(is_read=False).count()
+    # 获取统计计数器（产品数量、已上架产品数量、分类数量、未读联系表单数量）
+    counters = stats.get_counters()
     
     # 获取最近添加的5个产品
     recent_products = Product.query.order_by(Product.created_at.desc()).limit(5).all()
@@ -41,14 +38,74 @@ def admin_dashboard():
     recent_unread_contacts = Contact.query.filter_by(is_read=False).order_by(Contact.created_at.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html', 
-                           product_count=product_count,
-                           active_product_count=active_product_count,
-                           category_count=category_count,
-                           unread_contact_count=unread_contact_count,
+                           product_count=counters['product_count'],
+                           active_product_count=counters['active_product_count'],
+                           category_count=counters['category_count'],
+                           unread_contact_count=counters['unread_contact_count'],
                            recent_products=recent_products,
                            recent_unread_contacts=recent_unread_contacts)
 
 
+@admin_bp.route('/stats.json')
+@admin_required
+def stats_json():
+    """
+    统计计数器接口（供仪表盘轮询）
+    只读取计数器表，不扫描业务表
+    """
+    return jsonify(stats.get_counters())
+
+
+@admin_bp.route('/db-pools.json')
+@admin_required
+def db_pools_json():
+    """
+    数据库连接池使用情况（本进程）
+    各流量类型的借出连接数、峰值、等待次数和时间、超时次数
+    """
+    return jsonify(db_pools.snapshot())
+
+
+@admin_bp.route('/concurrency.json')
+@admin_required
+def concurrency_json():
+    """
+    各请求分组的并发上限和降载情况（本进程）
+    """
+    middleware = current_app.extensions.get('load_shedding')
+    return jsonify(middleware.snapshot() if middleware is not None else {})
+
+
+@admin_bp.route('/single-flight.json')
+@admin_required
+def single_flight_json():
+    """
+    请求合并情况（本进程）
+    各缓存层执行生成的次数、共享结果和返回旧值的次数、等待超时次数、正在生成的键数量
+    """
+    return jsonify(single_flight.stats())
+
+
+@admin_bp.route('/profiles')
+@admin_required
+def list_profiles():
+    """
+    最近的请求分析结果
+    在任意页面地址后加 ?_profile=1 即可分析该请求
+    """
+    profiles = profiler.list_profiles(profiler.profile_dir())
+    return render_template('admin/profiles.html', profiles=profiles)
+
+
+@admin_bp.route('/profiles/<name>')
+@admin_required
+def download_profile(name):
+    """下载 collapsed stack 格式的分析结果"""
+    if not profiler.FILE_PATTERN.match(name):
+        abort(404)
+    return send_from_directory(profiler.profile_dir(), name, mimetype='text/plain', as_attachment=True)
+
+
 @admin_bp.route('/categories', methods=['GET', 'POST'])
 @admin_required
 def manage_categories():
@@ -62,6 +119,9 @@ def manage_categories():
     
     # 获取所有分类
     categories = Category.query.all()
+    # 每个分类的产品数量（一条分组查询）
+    product_counts = dict(db.session.query(Product.category_id, db.func.count(Product.id))
+                          .group_by(Product.category_id).all())
     
     # 处理表单提交（添加分类）
     # 只处理添加分类的请求，编辑和删除请求由其他路由处理
@@ -74,6 +134,7 @@ def manage_categories():
             # 创建新分类
             new_category = Category(name=add_form.name.data)
             db.session.add(new_category)
+            stats.bump(category_count=1)
             db.session.commit()
             flash('分类添加成功！', 'success')
             return redirect(url_for('admin.manage_categories'))
@@ -82,7 +143,8 @@ def manage_categories():
                            form=add_form,
                            add_form=add_form,
                            edit_form=edit_form,
-                           categories=categories)
+                           categories=categories,
+                           product_counts=product_counts)
 
 
 @admin_bp.route('/categories/<int:category_id>/edit', methods=['GET', 'POST'])
@@ -137,14 +199,17 @@ def delete_category(category_id):
     """
     category = Category.query.get_or_404(category_id)
     
-    # 检查是否有产品属于该分类
-    products_in_category = Product.query.filter_by(category_id=category_id).count()
-    if products_in_category > 0:
+    # 检查是否有产品属于该分类（EXISTS 查询，命中第一条即返回）
+    products_query = Product.query.filter_by(category_id=category_id)
+    if db.session.query(products_query.exists()).scalar():
+        # 仅在无法删除时统计数量用于提示，走 category_id 开头的索引
+        products_in_category = products_query.with_entities(db.func.count(Product.id)).scalar()
         flash(f'无法删除该分类，因为有 {products_in_category} 个产品属于此分类。请先移动或删除这些产品。', 'error')
         return redirect(url_for('admin.manage_categories'))
     
     # 删除分类
     db.session.delete(category)
+    stats.bump(category_count=-1)
     db.session.commit()
     flash('分类删除成功！', 'success')
     return redirect(url_for('admin.manage_categories'))
@@ -273,6 +338,7 @@ def add_product():
         
         db.session.add(new_product)
         db.session.flush()  # 获取产品ID，但不提交事务
+        stats.bump(product_count=1, active_product_count=1 if new_product.status else 0)
         
         # 处理附加图片上传（如果有）
         if 'gallery_images' in request.files and request.files.getlist('gallery_images')[0].filename:
@@ -313,7 +379,10 @@ def edit_product(product_id):
     if request.method == 'POST' and 'status' in request.form:
         status_value = request.form.get('status')
         if status_value in ['true', 'false']:
-            product.status = (status_value == 'true')
+            new_status = (status_value == 'true')
+            if new_status != bool(product.status):
+                stats.bump(active_product_count=1 if new_status else -1)
+            product.status = new_status
             db.session.commit()
             flash('产品状态更新成功！', 'success')
             return redirect(url_for('admin.manage_products'))
@@ -345,6 +414,8 @@ def edit_product(product_id):
         product.price_max = form.price_max.data
         product.price_note = form.price_note.data
         product.stock = form.stock.data or 0
+        if bool(form.status.data) != bool(product.status):
+            stats.bump(active_product_count=1 if form.status.data else -1)
         product.status = form.status.data
         product.is_featured = form.is_featured.data if hasattr(form, 'is_featured') else False
         product.rating = form.rating.data
@@ -392,10 +463,11 @@ def toggle_featured(product_id):
     product = Product.query.get_or_404(product_id)
     
     if not product.is_featured:
-        # 检查是否已有6个推荐产品
+        # 检查推荐产品是否已达到上限（先加锁，避免并发请求一起超过上限）
+        bulk_actions.lock_featured()
         featured_count = Product.query.filter_by(is_featured=True, status=True).count()
-        if featured_count >= 6:
-            flash('首页推荐产品已达到上限（6个），请先取消其他产品的推荐状态', 'warning')
+        if featured_count >= bulk_actions.FEATURED_LIMIT:
+            flash(f'首页推荐产品已达到上限（{bulk_actions.FEATURED_LIMIT}个），请先取消其他产品的推荐状态', 'warning')
             return redirect(url_for('admin.manage_products'))
         product.is_featured = True
         flash('产品已设置为首页推荐', 'success')
@@ -412,17 +484,75 @@ def toggle_featured(product_id):
 def delete_product(product_id):
     """
     删除产品
-    同时删除关联的产品图片
+    只执行一条 DELETE 语句，关联的图库图片由数据库外键级联删除，
+    不加载产品和图片数据；外部存储中的文件由后台线程异步回收
     """
-    product = Product.query.get_or_404(product_id)
+    if not bulk_actions.delete_products([product_id]):
+        abort(404)
+    db.session.commit()
+    blob_store.schedule_gc(blob_store.KIND_PRODUCT, [product_id])
+    recommendations.schedule_refresh([product_id])
+    snapshots.invalidate(snapshots.product_key(product_id))
+    catalog.invalidate()
+    sitemap.invalidate_products([product_id])
+    flash('产品及其关联图片已删除！', 'success')
+    return redirect(url_for('admin.manage_products'))
+
+
+@admin_bp.route('/products/bulk', methods=['POST'])
+@admin_required
+def bulk_products():
+    """
+    产品批量操作
+    支持批量上架、下架、修改分类、设为推荐、取消推荐和删除
+    每个操作只执行一条基于集合的 UPDATE / DELETE 语句
+    """
+    action = request.form.get('action')
+    product_ids = request.form.getlist('ids', type=int)
     
-    # 删除关联的产品图片
-    ProductImage.query.filter_by(product_id=product_id).delete()
+    if not product_ids:
+        flash('请先选择要操作的产品', 'warning')
+        return redirect(url_for('admin.manage_products'))
+    
+    if action == 'publish':
+        count = bulk_actions.publish_products(product_ids)
+        message = f'已上架 {count} 个产品'
+    elif action == 'unpublish':
+        count = bulk_actions.unpublish_products(product_ids)
+        message = f'已下架 {count} 个产品'
+    elif action == 'set_category':
+        category_id = request.form.get('category_id', type=int)
+        if not category_id or db.session.get(Category, category_id) is None:
+            flash('请选择有效的目标分类', 'warning')
+            return redirect(url_for('admin.manage_products'))
+        count = bulk_actions.set_products_category(product_ids, category_id)
+        message = f'已修改 {count} 个产品的分类'
+    elif action == 'feature':
+        count = bulk_actions.feature_products(product_ids)
+        message = f'已将 {count} 个产品设为首页推荐'
+        if count < len(product_ids):
+            message += f'，{len(product_ids) - count} 个产品因已推荐、未上架或超过推荐上限（{bulk_actions.FEATURED_LIMIT}个）而跳过'
+    elif action == 'unfeature':
+        count = bulk_actions.unfeature_products(product_ids)
+        message = f'已取消 {count} 个产品的首页推荐'
+    elif action == 'delete':
+        count = bulk_actions.delete_products(product_ids)
+        message = f'已删除 {count} 个产品及其关联图片'
+    else:
+        flash('未知的批量操作', 'error')
+        return redirect(url_for('admin.manage_products'))
     
-    # 删除产品
-    db.session.delete(product)
     db.session.commit()
-    flash('产品及其关联图片已删除！', 'success')
+    if action == 'delete':
+        blob_store.schedule_gc(blob_store.KIND_PRODUCT, product_ids)
+    # 批量语句不触发ORM事件，需要手动刷新相关产品推荐并使页面快照、产品目录和站点地图失效
+    if action in ('publish', 'unpublish', 'set_category', 'delete'):
+        recommendations.schedule_refresh(product_ids)
+        snapshots.invalidate(*(snapshots.product_key(product_id) for product_id in product_ids))
+    if action in ('publish', 'unpublish', 'delete'):
+        sitemap.invalidate_products(product_ids)
+    catalog.invalidate()
+    flash(message, 'success')
     return redirect(url_for('admin.manage_products'))
 
 
@@ -436,8 +566,8 @@ def list_contacts():
     # 获取联系表单列表，按创建时间倒序排列
     contacts = Contact.query.order_by(Contact.created_at.desc()).all()
     
-    # 获取未读消息数量
-    unread_count = Contact.query.filter_by(is_read=False).count()
+    # 获取未读消息数量（读取统计计数器）
+    unread_count = stats.get_counters()['unread_contact_count']
     
     return render_template('admin/contacts.html', contacts=contacts, unread_count=unread_count)
 
@@ -454,6 +584,7 @@ def view_contact(contact_id):
     # 更新为已读状态
     if not contact.is_read:
         contact.is_read = True
+        stats.bump(unread_contact_count=-1)
         db.session.commit()
     
     return render_template('admin/view_contact.html', contact=contact)
@@ -468,6 +599,8 @@ def delete_contact(contact_id):
     contact = Contact.query.get_or_404(contact_id)
     
     db.session.delete(contact)
+    if not contact.is_read:
+        stats.bump(unread_contact_count=-1)
     db.session.commit()
     flash('联系信息已删除！', 'success')
     
@@ -480,9 +613,8 @@ def mark_all_read():
     """
     将所有未读消息标记为已读
     """
-    unread_contacts = Contact.query.filter_by(is_read=False).all()
-    for contact in unread_contacts:
-        contact.is_read = True
+    # 一条 UPDATE 语句完成，不加载联系表单对象
+    bulk_actions.mark_contacts_read()
     
     db.session.commit()
     flash('所有消息已标记为已读！', 'success')
@@ -490,6 +622,35 @@ def mark_all_read():
     return redirect(url_for('admin.list_contacts'))
 
 
+@admin_bp.route('/contacts/bulk', methods=['POST'])
+@admin_required
+def bulk_contacts():
+    """
+    联系表单批量操作
+    支持批量标记为已读和批量删除
+    """
+    action = request.form.get('action')
+    contact_ids = request.form.getlist('ids', type=int)
+    
+    if not contact_ids:
+        flash('请先选择要操作的消息', 'warning')
+        return redirect(url_for('admin.list_contacts'))
+    
+    if action == 'mark_read':
+        count = bulk_actions.mark_contacts_read(contact_ids)
+        message = f'已将 {count} 条消息标记为已读'
+    elif action == 'delete':
+        count = bulk_actions.delete_contacts(contact_ids)
+        message = f'已删除 {count} 条消息'
+    else:
+        flash('未知的批量操作', 'error')
+        return redirect(url_for('admin.list_contacts'))
+    
+    db.session.commit()
+    flash(message, 'success')
+    return redirect(url_for('admin.list_contacts'))
+
+
 @admin_bp.route('/products/<int:product_id>/images', methods=['GET', 'POST'])
 @admin_required
 def manage_product_images(product_id):
@@ -558,16 +719,22 @@ def manage_product_images(product_id):
 def delete_product_image(product_id, image_id):
     """
     删除产品的单个附加图片
+    只查询图片所属的产品ID，不加载图片数据
     """
-    image = ProductImage.query.get_or_404(image_id)
+    image_product_id = db.session.query(ProductImage.product_id).filter_by(id=image_id).scalar()
+    if image_product_id is None:
+        abort(404)
     
     # 验证图片是否属于该产品
-    if image.product_id != product_id:
+    if image_product_id != product_id:
         flash('操作不合法！', 'error')
         return redirect(url_for('admin.manage_product_images', product_id=product_id))
     
-    db.session.delete(image)
+    ProductImage.query.filter_by(id=image_id).delete(synchronize_session=False)
     db.session.commit()
+    blob_store.schedule_gc(blob_store.KIND_GALLERY, [image_id], product_id=product_id)
+    snapshots.invalidate(snapshots.product_key(product_id))
+    sitemap.invalidate(sitemap.shard_name(product_id))
     flash('图片删除成功！', 'success')
     return redirect(url_for('admin.manage_product_images', product_id=product_id))
 
@@ -579,7 +746,8 @@ def get_product_gallery_images(product_id):
     获取产品的图库图片（用于AJAX请求）
     返回图片数据的JSON格式
     """
-    images = ProductImage.query.filter_by(product_id=product_id).all()
+    # 图片数据在同一条查询中读取（延迟加载的列逐个访问会每张图片查询一次）
+    images = ProductImage.query.options(db.undefer(ProductImage.image_data)).filter_by(product_id=product_id).all()
     
     # 将图片数据转换为base64格式以便前端显示
     image_data = []
@@ -704,7 +872,7 @@ def get_page_content_image(content_id):
     from flask import send_file
     from io import BytesIO
     
-    content = PageContent.query.get_or_404(content_id)
+    content = PageContent.query.options(db.undefer(PageContent.image_data)).get_or_404(content_id)
     
     if content.image_data:
         return send_file(
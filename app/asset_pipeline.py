@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""
+静态资源构建模块
+页面原先在浏览器中通过 cdn.tailwindcss.com 的 JIT 脚本实时编译样式，并从 jsdelivr 加载 Font Awesome，
+每次访问都要下载并执行数百KB的脚本，且依赖第三方CDN的可用性
+
+flask build-assets 在部署时完成这些工作：
+- 调用 Tailwind CLI 按模板内容编译、压缩样式（前台 site.css / 后台 admin.css）
+- 合并本地的 Font Awesome（app/assets/vendor），字体文件同样改为本地地址
+- 文件名带内容哈希（如 site.3f9a0c1d2e4b.css），同时生成 .gz（以及安装 brotli 时的 .br）预压缩文件
+- 写入 manifest.json，模板通过 asset_url() 取得带哈希的地址
+
+/assets/<文件名> 对带哈希的文件返回一年有效期的 immutable 缓存头，并按 Accept-Encoding 直接返回预压缩文件
+尚未构建时页面回退到原来的CDN方式，开发环境不受影响
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+
+from flask import abort, current_app, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只生成 .gz
+    brotli = None
+
+# 资源源文件目录
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+FONT_AWESOME_CSS = 'vendor/font-awesome/css/font-awesome.min.css'
+
+# 资源包定义：tailwind 为需要编译的样式入口，content 为 Tailwind 扫描的模板，files 为直接合并的文件
+BUNDLES = {
+    'site.css': {
+        'files': [FONT_AWESOME_CSS],
+        'tailwind': 'css/site.css',
+        'content': 'app/templates/frontend/**/*.html',
+    },
+    'admin.css': {
+        'files': [FONT_AWESOME_CSS],
+        'tailwind': 'css/admin.css',
+        'content': 'app/templates/admin/**/*.html',
+    },
+    'site.js': {
+        'files': ['js/site.js'],
+    },
+}
+
+MANIFEST_NAME = 'manifest.json'
+# 需要生成预压缩文件的扩展名（woff/woff2 本身已压缩）
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json')
+# 带哈希文件的缓存头
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+# 已加载的清单缓存：{输出目录: (修改时间, 清单内容)}
+_manifest_cache = {}
+
+
+class AssetBuildError(RuntimeError):
+    """资源构建失败（如找不到 Tailwind CLI）"""
+
+
+def project_root(app=None):
+    """项目根目录（app 包的上一级）"""
+    app = app or current_app
+    return os.path.dirname(app.root_path)
+
+
+def output_dir(app=None):
+    """构建输出目录（绝对路径），相对路径按项目根目录解析"""
+    app = app or current_app
+    path = app.config['ASSET_OUTPUT_DIR']
+    if not os.path.isabs(path):
+        path = os.path.join(project_root(app), path)
+    return path
+
+
+def minify_css(text):
+    """去掉注释（保留 /*! 开头的许可证注释）和多余空白"""
+    text = re.sub(r'/\*(?!!).*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,])\s*', r'\1', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    """保守的脚本压缩：去掉整行注释、缩进和空行，不改写代码本身"""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def hashed_name(name, content):
+    """生成带内容哈希的文件名：site.css -> site.<hash>.css"""
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest}{ext}'
+
+
+def _write_output(directory, name, content):
+    """
+    写入带哈希的文件及其预压缩文件，同名文件已存在时跳过（内容相同）
+
+    Returns:
+        list: 写入目录中的文件名列表
+    """
+    filename = hashed_name(name, content)
+    written = [filename]
+    path = os.path.join(directory, filename)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+        variants = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        for suffix, compress in variants:
+            compressed = compress(content)
+            # 压缩后没有变小的文件不生成预压缩版本
+            if len(compressed) >= len(content):
+                continue
+            written.append(filename + suffix)
+            if not os.path.exists(path + suffix):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+    return written
+
+
+def _rewrite_css_urls(text, source_path, directory, files):
+    """
+    将样式中引用的本地文件（如字体）复制为带哈希的文件，并改写 url() 地址
+    找不到的文件（如未随项目提供的 eot/svg 字体）保持原样，只有老旧浏览器才会请求
+    """
+    base = os.path.dirname(source_path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r'^(data:|https?:|//|#|/)', url):
+            return match.group(0)
+        path, fragment = url, ''
+        if '#' in path:
+            path, fragment = path.split('#', 1)
+            fragment = '#' + fragment
+        path = path.split('?', 1)[0]
+        target = os.path.normpath(os.path.join(base, path))
+        if not os.path.isfile(target):
+            return match.group(0)
+        with open(target, 'rb') as f:
+            written = _write_output(directory, os.path.basename(target), f.read())
+        files.update(written)
+        return f'url({quote}{written[0]}{fragment}{quote})'
+
+    return _CSS_URL_PATTERN.sub(replace, text)
+
+
+def tailwind_command(app=None):
+    """解析 Tailwind CLI 命令（TAILWIND_CLI 配置，默认使用 PATH 中的 tailwindcss）"""
+    app = app or current_app
+    command = shlex.split(app.config.get('TAILWIND_CLI') or 'tailwindcss')
+    if not command or shutil.which(command[0]) is None:
+        raise AssetBuildError(
+            f'找不到 Tailwind CLI（{" ".join(command)}）。请安装独立版 tailwindcss 可执行文件，'
+            f'或设置 TAILWIND_CLI，例如 TAILWIND_CLI="npx tailwindcss@3"'
+        )
+    return command
+
+
+def _compile_tailwind(app, command, entry, content):
+    """调用 Tailwind CLI 编译并压缩样式入口，返回编译结果"""
+    fd, output = tempfile.mkstemp(suffix='.css')
+    os.close(fd)
+    try:
+        args = command + [
+            '--config', os.path.join(SOURCE_DIR, 'tailwind.config.js'),
+            '--input', os.path.join(SOURCE_DIR, entry),
+            '--output', output,
+            '--content', content,
+            '--minify',
+        ]
+        result = subprocess.run(args, cwd=project_root(app), capture_output=True, text=True)
+        if result.returncode != 0:
+            raise AssetBuildError(f'Tailwind 编译 {entry} 失败: {result.stderr.strip()}')
+        with open(output, encoding='utf-8') as f:
+            return f.read()
+    finally:
+        os.remove(output)
+
+
+def _read_bundle_sources(name, bundle, directory=None, files=None):
+    """读取并合并资源包中直接合并的文件（样式会改写其中的 url() 地址）"""
+    parts = []
+    for source in bundle.get('files', []):
+        path = os.path.join(SOURCE_DIR, source)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        if name.endswith('.css') and directory is not None:
+            text = _rewrite_css_urls(text, path, directory, files)
+        parts.append(text)
+    return parts
+
+
+def load_manifest(app=None):
+    """
+    读取构建清单，文件修改时间不变时使用进程内缓存
+
+    Returns:
+        dict: {'bundles': {资源包名: 带哈希的文件名}, 'current': 本次构建的文件集合,
+               'files': 可对外提供的文件集合（本次和上一次构建的文件）}，尚未构建时返回 None
+    """
+    directory = output_dir(app)
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _manifest_cache.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['current'] = set(manifest.get('files', []))
+    manifest['files'] = manifest['current'] | set(manifest.get('previous', []))
+    _manifest_cache[directory] = (mtime, manifest)
+    return manifest
+
+
+def build_assets(app=None, tailwind=None):
+    """
+    构建所有资源包
+
+    Args:
+        app: Flask应用实例
+        tailwind: Tailwind CLI 命令列表，默认按 TAILWIND_CLI 配置解析
+
+    Returns:
+        dict: {资源包名: 带哈希的文件名}
+    """
+    app = app or current_app
+    command = tailwind or tailwind_command(app)
+    directory = output_dir(app)
+    os.makedirs(directory, exist_ok=True)
+
+    bundles = {}
+    files = set()
+    for name, bundle in BUNDLES.items():
+        parts = _read_bundle_sources(name, bundle, directory, files)
+        if bundle.get('tailwind'):
+            parts.append(_compile_tailwind(app, command, bundle['tailwind'], bundle['content']))
+        if name.endswith('.css'):
+            content = '\n'.join(minify_css(part) for part in parts)
+        else:
+            content = ''.join(minify_js(part) for part in parts)
+        written = _write_output(directory, name, content.encode('utf-8'))
+        bundles[name] = written[0]
+        files.update(written)
+
+    # 保留并继续提供上一次构建的文件：滚动发布期间旧页面（以及缓存了旧页面的浏览器、CDN）仍会引用它们；
+    # 更早的构建在本次删除
+    previous = load_manifest(app)
+    previous_files = (previous['current'] if previous else set()) - files
+    keep = files | previous_files
+    for entry in os.listdir(directory):
+        if entry != MANIFEST_NAME and entry not in keep:
+            os.remove(os.path.join(directory, entry))
+
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'bundles': bundles, 'files': sorted(files), 'previous': sorted(previous_files)}, f,
+                  ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return bundles
+
+
+def assets_built():
+    """模板函数：是否已有构建好的资源（未构建时页面回退到CDN）"""
+    return load_manifest() is not None
+
+
+def asset_url(name):
+    """
+    模板函数：获取资源包的地址
+    已构建时返回带哈希的地址；未构建时返回未压缩的源文件地址（仅限不需要编译的资源包）
+    """
+    manifest = load_manifest()
+    if manifest is not None and name in manifest['bundles']:
+        return url_for('assets', filename=manifest['bundles'][name])
+    return url_for('assets', filename=name)
+
+
+def serve_asset(filename):
+    """
+    提供构建后的资源文件
+    带哈希的文件永久缓存，客户端支持时直接返回 .br / .gz 预压缩文件
+    """
+    manifest = load_manifest()
+    if manifest is None or filename not in manifest['files']:
+        return _serve_source_bundle(filename)
+
+    directory = output_dir()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    path, encoding = filename, None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if filename + suffix in manifest['files'] and candidate in request.accept_encodings:
+            path, encoding = filename + suffix, candidate
+            break
+
+    response = send_from_directory(directory, path, mimetype=mimetype, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.endswith(COMPRESSIBLE_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+def _serve_source_bundle(filename):
+    """尚未构建时直接合并源文件返回（开发环境），不缓存"""
+    bundle = BUNDLES.get(filename)
+    if bundle is None or bundle.get('tailwind'):
+        abort(404)
+    response = current_app.response_class(
+        ''.join(_read_bundle_sources(filename, bundle)),
+        mimetype=mimetypes.guess_type(filename)[0],
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def init_app(app):
+    """注册资源路由和模板函数"""
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.jinja_env.globals['assets_built'] = assets_built
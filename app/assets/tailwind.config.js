@@ -0,0 +1,21 @@
+/**
+ * Tailwind 配置（由 flask build-assets 调用 Tailwind CLI 编译，替代页面中的 cdn.tailwindcss.com）
+ * 主题与原模板中的 tailwind.config 保持一致
+ */
+module.exports = {
+    content: ['./app/templates/**/*.html'],
+    theme: {
+        extend: {
+            colors: {
+                primary: '#0A3D62',    // 主色：深蓝（专业稳重）
+                secondary: '#3C6382',  // 辅助色：中蓝
+                accent: '#38ADA9',     // 强调色：科技蓝绿
+                dark: '#2C3E50',       // 深色文本
+                light: '#ECF0F1',      // 浅色背景
+            },
+            fontFamily: {
+                sans: ['Inter', 'PingFang SC', 'Microsoft YaHei', 'sans-serif'],
+            },
+        }
+    }
+}
@@ -4,7 +4,7 @@
 处理用户登录、登出和管理员权限验证
 """
 from functools import wraps
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session
 from flask_login import login_user, logout_user, login_required, current_user
 # from werkzeug.urls import url_parse
 from urllib.parse import urlparse as url_parse
@@ -19,6 +19,7 @@ def china_now():
 
 from app import db
 from app.models import User
+from app.rate_limit import SESSION_EXEMPT_KEY
 from app.forms import LoginForm
 
 # 创建认证蓝图
@@ -54,6 +55,8 @@ def login():
         
         # 登录用户
         login_user(user, remember=form.remember.data)
+        # 管理员页面包含大量缩略图，图片请求不限流（见 app/rate_limit.py）
+        session[SESSION_EXEMPT_KEY] = bool(user.is_admin)
         
         # 更新最后登录时间
         user.last_login_at = china_now()
@@ -82,6 +85,7 @@ def logout():
     用户登出视图
     """
     logout_user()
+    session.pop(SESSION_EXEMPT_KEY, None)
     flash('已成功登出', 'info')
     return redirect(url_for('main.index'))
 
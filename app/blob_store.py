@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+外部图片存储模块
+图片数据的权威来源仍是数据库（BYTEA），这里管理落盘到本地目录（BLOB_STORE_PATH）的副本，
+目录结构：
+    product/<product_id>                  产品主图
+    gallery/<product_id>/<image_id>       图库图片（按产品分目录，删除产品时整目录清理）
+    page-content/<content_id>             页面内容图片
+    .locks/                               多个工作进程同时写入副本时使用的文件锁
+
+删除数据库记录后不在请求中清理文件，而是交给后台线程异步回收（schedule_gc），
+flask gc-blobs 执行一次全量回收，清理数据库中已不存在的记录对应的文件
+"""
+import logging
+import os
+import queue
+import shutil
+import threading
+
+from flask import current_app
+
+from app import db
+
+# 存储类型与目录名
+KIND_PRODUCT = 'product'
+KIND_GALLERY = 'gallery'
+KIND_PAGE_CONTENT = 'page-content'
+
+# 待回收的文件队列：(存储根目录, 相对路径)
+_gc_queue = queue.Queue()
+_gc_thread = None
+_gc_lock = threading.Lock()
+
+
+def store_root(app=None):
+    """获取外部存储的根目录（绝对路径）"""
+    app = app or current_app
+    return os.path.abspath(app.config['BLOB_STORE_PATH'])
+
+
+def relative_path(kind, object_id, product_id=None):
+    """
+    获取对象在存储中的相对路径
+
+    Args:
+        kind: 存储类型（product / gallery / page-content）
+        object_id: 产品ID、图库图片ID或页面内容ID
+        product_id: 图库图片所属的产品ID（kind 为 gallery 时必填）
+    """
+    if kind == KIND_GALLERY:
+        return os.path.join(KIND_GALLERY, str(int(product_id)), str(int(object_id)))
+    return os.path.join(kind, str(int(object_id)))
+
+
+def _remove(root, rel_path):
+    """删除文件或目录（同时删除同名前缀的派生文件，如 <id>.webp）"""
+    path = os.path.join(root, rel_path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    directory, name = os.path.split(path)
+    if not os.path.isdir(directory):
+        return
+    for entry in os.listdir(directory):
+        if entry == name or entry.startswith(name + '.'):
+            try:
+                os.remove(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
+
+
+def variant_path(rel_path, version):
+    """带版本号的副本路径，如 product/5.<版本>（图片更新后版本变化，旧副本不会被误用）"""
+    return f'{rel_path}.{version}'
+
+
+def find_variant(root, rel_path, version):
+    """
+    查找指定版本的副本
+
+    Returns:
+        str: 副本的绝对路径，不存在时返回None
+    """
+    path = os.path.join(root, variant_path(rel_path, version))
+    return path if os.path.isfile(path) else None
+
+
+def lock_path(root, rel_path):
+    """
+    写入副本时使用的跨进程锁文件路径（集中放在 .locks 目录，不与副本放在一起，
+    避免 write_variant() 清理旧版本、回收目录时把正在使用的锁文件删掉）
+    """
+    return os.path.join(root, '.locks', rel_path.replace(os.sep, '-') + '.lock')
+
+
+def write_variant(root, rel_path, version, data):
+    """
+    将图片数据写入指定版本的副本（先写临时文件再改名，并发读取不会读到半个文件），
+    同时删除同一对象的其他版本
+
+    Returns:
+        str: 副本的绝对路径
+    """
+    path = os.path.join(root, variant_path(rel_path, version))
+    directory, name = os.path.split(path)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}-{threading.get_ident()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    base = os.path.basename(rel_path) + '.'
+    for entry in os.listdir(directory):
+        if entry.startswith(base) and entry != name and '.tmp' not in entry:
+            try:
+                os.remove(os.path.join(directory, entry))
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def _gc_worker():
+    """后台回收线程：逐个删除队列中的文件"""
+    while True:
+        root, rel_path = _gc_queue.get()
+        try:
+            _remove(root, rel_path)
+        except Exception as e:
+            logging.error(f'回收外部存储文件失败 {rel_path}: {str(e)}')
+        finally:
+            _gc_queue.task_done()
+
+
+def _ensure_gc_thread():
+    """按需启动后台回收线程"""
+    global _gc_thread
+    with _gc_lock:
+        if _gc_thread is None or not _gc_thread.is_alive():
+            _gc_thread = threading.Thread(target=_gc_worker, name='blob-gc', daemon=True)
+            _gc_thread.start()
+
+
+def schedule_gc(kind, object_ids, product_id=None):
+    """
+    将已删除对象的文件加入异步回收队列，请求中不做任何文件操作
+    删除产品时传入 kind=product，会同时回收该产品的整个图库目录
+
+    Args:
+        kind: 存储类型
+        object_ids: 对象ID列表
+        product_id: 图库图片所属的产品ID（kind 为 gallery 时必填）
+    """
+    root = store_root()
+    for object_id in object_ids:
+        if kind == KIND_PRODUCT:
+            _gc_queue.put((root, relative_path(KIND_PRODUCT, object_id)))
+            _gc_queue.put((root, os.path.join(KIND_GALLERY, str(int(object_id)))))
+        else:
+            _gc_queue.put((root, relative_path(kind, object_id, product_id)))
+    _ensure_gc_thread()
+
+
+def wait_for_gc():
+    """等待回收队列处理完毕（用于命令行和测试）"""
+    _gc_queue.join()
+
+
+def _list_ids(directory):
+    """列出目录下以数字命名的文件或子目录对应的ID"""
+    if not os.path.isdir(directory):
+        return set()
+    ids = set()
+    for entry in os.listdir(directory):
+        name = entry.split('.', 1)[0]
+        if name.isdigit():
+            ids.add(int(name))
+    return ids
+
+
+def sweep():
+    """
+    全量回收：对比存储目录和数据库，删除已不存在的产品、图库图片和页面内容对应的文件
+    只查询ID列，不读取图片数据
+
+    Returns:
+        int: 删除的文件或目录数量
+    """
+    from app.models import Product, ProductImage, PageContent
+
+    root = store_root()
+    removed = 0
+
+    # 产品主图和整个产品图库目录
+    product_dir = os.path.join(root, KIND_PRODUCT)
+    gallery_dir = os.path.join(root, KIND_GALLERY)
+    stored = _list_ids(product_dir) | _list_ids(gallery_dir)
+    existing = {row[0] for row in db.session.query(Product.id).filter(Product.id.in_(stored))} if stored else set()
+    for product_id in stored - existing:
+        _remove(root, relative_path(KIND_PRODUCT, product_id))
+        _remove(root, os.path.join(KIND_GALLERY, str(product_id)))
+        removed += 1
+
+    # 单张图库图片
+    for product_id in _list_ids(gallery_dir) & existing:
+        stored_images = _list_ids(os.path.join(gallery_dir, str(product_id)))
+        if not stored_images:
+            continue
+        existing_images = {row[0] for row in db.session.query(ProductImage.id).filter(
+            ProductImage.product_id == product_id, ProductImage.id.in_(stored_images))}
+        for image_id in stored_images - existing_images:
+            _remove(root, relative_path(KIND_GALLERY, image_id, product_id))
+            removed += 1
+
+    # 页面内容图片
+    content_dir = os.path.join(root, KIND_PAGE_CONTENT)
+    stored = _list_ids(content_dir)
+    existing = {row[0] for row in db.session.query(PageContent.id).filter(PageContent.id.in_(stored))} if stored else set()
+    for content_id in stored - existing:
+        _remove(root, relative_path(KIND_PAGE_CONTENT, content_id))
+        removed += 1
+
+    return removed
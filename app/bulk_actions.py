@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+后台批量操作模块
+每个批量操作都是一条基于集合的 UPDATE / DELETE 语句，不加载 ORM 对象，也不读取图片数据
+函数只负责在当前事务中执行语句并维护统计计数器，提交由调用方完成
+"""
+from sqlalchemy import func, case, select
+
+from app import db, stats
+from app.models import Product, Contact
+
+# 首页推荐产品数量上限
+FEATURED_LIMIT = 6
+# 修改首页推荐时使用的 PostgreSQL 事务级咨询锁的键
+FEATURED_LOCK_KEY = 0x63686d01
+
+
+def _ids_filter(column, ids):
+    """构建 id IN (...) 条件"""
+    return column.in_(list(ids))
+
+
+def publish_products(ids):
+    """
+    批量上架产品
+
+    Returns:
+        int: 实际状态发生变化的产品数量
+    """
+    count = Product.query.filter(_ids_filter(Product.id, ids), Product.status.isnot(True)).update(
+        {Product.status: True}, synchronize_session=False
+    )
+    stats.bump(active_product_count=count)
+    return count
+
+
+def unpublish_products(ids):
+    """
+    批量下架产品
+
+    Returns:
+        int: 实际状态发生变化的产品数量
+    """
+    count = Product.query.filter(_ids_filter(Product.id, ids), Product.status == True).update(
+        {Product.status: False}, synchronize_session=False
+    )
+    stats.bump(active_product_count=-count)
+    return count
+
+
+def set_products_category(ids, category_id):
+    """
+    批量修改产品分类
+
+    Returns:
+        int: 实际分类发生变化的产品数量
+    """
+    return Product.query.filter(_ids_filter(Product.id, ids), Product.category_id != category_id).update(
+        {Product.category_id: category_id}, synchronize_session=False
+    )
+
+
+def lock_featured():
+    """
+    串行化增加首页推荐的操作，事务结束时释放
+    两个并发请求各自统计已推荐数量时都会看到旧值，一起超过上限；PostgreSQL 上先获取咨询锁，
+    拿到锁之后的语句在新的快照中统计，能看到前一个事务提交的推荐。SQLite 的写事务本身互斥，不需要加锁
+    """
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': FEATURED_LOCK_KEY})
+
+
+def feature_products(ids):
+    """
+    批量设为首页推荐
+    推荐数量上限在SQL中执行：只更新按创建时间倒序排列的前 N 个候选产品，
+    N = 上限 - 当前已推荐的上架产品数量（小于0时取0）
+    只有已上架且尚未推荐的产品才是候选产品；并发的推荐操作由 lock_featured() 串行化
+
+    Returns:
+        int: 实际设为推荐的产品数量
+    """
+    lock_featured()
+    featured_count = select(func.count(Product.id)).where(
+        Product.is_featured == True, Product.status == True
+    ).scalar_subquery()
+    remaining = case((featured_count < FEATURED_LIMIT, FEATURED_LIMIT - featured_count), else_=0)
+    candidates = select(Product.id).where(
+        _ids_filter(Product.id, ids),
+        Product.status == True,
+        Product.is_featured.isnot(True)
+    ).order_by(Product.created_at.desc()).limit(remaining)
+
+    return Product.query.filter(Product.id.in_(candidates)).update(
+        {Product.is_featured: True}, synchronize_session=False
+    )
+
+
+def unfeature_products(ids):
+    """
+    批量取消首页推荐
+
+    Returns:
+        int: 实际取消推荐的产品数量
+    """
+    return Product.query.filter(_ids_filter(Product.id, ids), Product.is_featured == True).update(
+        {Product.is_featured: False}, synchronize_session=False
+    )
+
+
+def delete_products(ids):
+    """
+    批量删除产品及其图库图片
+    先用一条聚合查询统计被删除的产品数量和其中已上架的数量（用于维护计数器），再执行删除
+    图库图片由数据库外键 ON DELETE CASCADE 删除，外部存储中的文件由调用方在提交后交给 blob_store 异步回收
+
+    Returns:
+        int: 删除的产品数量
+    """
+    total, active = db.session.query(
+        func.count(Product.id),
+        func.coalesce(func.sum(case((Product.status == True, 1), else_=0)), 0)
+    ).filter(_ids_filter(Product.id, ids)).one()
+    if not total:
+        return 0
+
+    Product.query.filter(_ids_filter(Product.id, ids)).delete(synchronize_session=False)
+    stats.bump(product_count=-total, active_product_count=-active)
+    return total
+
+
+def mark_contacts_read(ids=None):
+    """
+    批量将联系表单标记为已读
+
+    Args:
+        ids: 联系表单ID列表，为None时标记所有未读消息
+
+    Returns:
+        int: 实际从未读变为已读的数量
+    """
+    query = Contact.query.filter(Contact.is_read == False)
+    if ids is not None:
+        query = query.filter(_ids_filter(Contact.id, ids))
+    count = query.update({Contact.is_read: True}, synchronize_session=False)
+    stats.bump(unread_contact_count=-count)
+    return count
+
+
+def delete_contacts(ids):
+    """
+    批量删除联系表单
+
+    Returns:
+        int: 删除的数量
+    """
+    total, unread = db.session.query(
+        func.count(Contact.id),
+        func.coalesce(func.sum(case((Contact.is_read == False, 1), else_=0)), 0)
+    ).filter(_ids_filter(Contact.id, ids)).one()
+    if not total:
+        return 0
+
+    Contact.query.filter(_ids_filter(Contact.id, ids)).delete(synchronize_session=False)
+    stats.bump(unread_contact_count=-unread)
+    return total
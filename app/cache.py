@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+进程内缓存模块
+提供线程安全的 LRU 缓存：超出容量时淘汰最久未使用的条目，
+条目可以设置有效期（ttl，过期条目在被淘汰前仍可通过 lookup() 作为旧值读取），也可以附带标签，按标签批量失效（如 product:5、categories）
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存
+
+    Args:
+        maxsize: 最多保存的条目数量
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        # {键: (过期时间或None, 值, 标签)}
+        self._data = OrderedDict()
+        # {标签: {键}}
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """读取条目，命中时将其移到最近使用的位置，过期的条目视为不存在"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                if entry is not None:
+                    self._pop(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def lookup(self, key):
+        """
+        读取条目，已过期但尚未被淘汰的条目也返回（不删除），用于在重新生成期间返回旧值
+
+        Returns:
+            tuple: (值, 是否在有效期内)，不存在时返回 (None, False)
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, False
+            self._data.move_to_end(key)
+            if entry[0] is not None and entry[0] <= time.monotonic():
+                self.misses += 1
+                return entry[1], False
+            self.hits += 1
+            return entry[1], True
+
+    def set(self, key, value, ttl=None, tags=()):
+        """
+        写入条目，超出容量时淘汰最久未使用的条目
+
+        Args:
+            key: 键
+            value: 值
+            ttl: 有效期（秒），为None时不过期
+            tags: 标签列表，用于 invalidate_tags() 批量失效
+        """
+        expires = time.monotonic() + ttl if ttl else None
+        tags = tuple(tags or ())
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (expires, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._pop(next(iter(self._data)))
+
+    def _pop(self, key):
+        """删除条目并清理标签索引（调用方需持有锁）"""
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def delete(self, key):
+        """删除条目"""
+        with self._lock:
+            self._pop(key)
+
+    def invalidate_tags(self, *tags):
+        """
+        删除带有任一标签的所有条目
+
+        Returns:
+            int: 删除的条目数量
+        """
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._pop(key)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""
+产品目录的进程内只读模型
+前台的产品目录很小（几百个产品、几个分类），首页、产品列表、分页、分类筛选和相关产品却每次都要查询数据库。
+这里把所有已上架产品（不含图片数据）和分类一次性读入内存，前台页面直接在内存中完成筛选、排序和分页：
+
+- 产品和分类保存为 __slots__ 记录（ProductRecord / CategoryRecord），模板中与模型对象一样按属性访问，
+  也可以作为 {% cache %} 片段缓存的键
+- 索引：按ID、按分类（创建时间倒序）、推荐产品、全部产品（创建时间倒序）、每个产品的相关产品
+- Catalog 对象创建后不再修改；数据变化后在后台线程中生成新的 Catalog，完成后替换模块中的引用，
+  正在处理的请求继续使用旧对象，不需要加锁
+- 产品、分类的修改提交后（以及批量操作、相关产品推荐刷新后）调用 invalidate()，
+  其他工作进程通过失效消息总线（见 app/invalidation.py）得知后同样在后台重新生成
+- CATALOG_BACKGROUND_REBUILD=false（测试环境）时不使用后台线程，失效后由下一个请求同步重新生成
+
+重新生成期间（CATALOG_REBUILD_DELAY 秒的合并等待加上一次查询的时间）前台看到的仍是修改前的目录
+"""
+import logging
+import threading
+import time
+
+from flask import current_app
+from flask_sqlalchemy.pagination import Pagination
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app import db, db_routing, invalidation
+from app.models import Category, Product, ProductRelation
+
+# 首页展示的产品数量
+HOME_PRODUCT_COUNT = 6
+# 产品列表每页的产品数量
+PRODUCTS_PER_PAGE = 9
+# 产品详情页展示的相关产品数量
+RELATED_PRODUCT_COUNT = 4
+
+# 失效消息中的键：其他进程修改了目录（没有键的消息表示清空全部缓存，直接丢弃目录）
+MESSAGE_KEY = 'changed'
+
+# 当前的目录（只替换引用，不修改对象）
+_catalog = None
+# 同步生成目录时的锁，避免冷启动时多个请求同时查询
+_build_lock = threading.Lock()
+# 后台重新生成：目录失效的信号、线程和使用的应用实例
+_rebuild_event = threading.Event()
+_rebuild_thread = None
+_rebuild_lock = threading.Lock()
+_app = None
+
+
+class CategoryRecord:
+    """分类记录"""
+    __slots__ = ('id', 'name', 'description', 'created_at', 'updated_at')
+    __tablename__ = 'categories'
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+
+class ProductRecord:
+    """已上架产品的记录（不含图片数据，has_main_image 表示是否有主图）"""
+    __slots__ = ('id', 'name', 'description', 'brand', 'category_id', 'is_featured', 'has_main_image',
+                 'price', 'price_min', 'price_max', 'created_at', 'updated_at')
+    __tablename__ = 'products'
+
+    def __init__(self, row):
+        for name in self.__slots__:
+            setattr(self, name, getattr(row, name))
+
+    @property
+    def main_image(self):
+        """与快照中的产品卡片一致，模板中用于判断是否有主图"""
+        return self.has_main_image
+
+
+class ListPagination(Pagination):
+    """内存中列表的分页，模板中的用法与 query.paginate() 的结果相同"""
+
+    def _query_items(self):
+        items = self._query_args['items']
+        return list(items[self._query_offset:self._query_offset + self.per_page])
+
+    def _query_count(self):
+        return len(self._query_args['items'])
+
+
+class Catalog:
+    """
+    某一时刻的产品目录（创建后只读）
+
+    Args:
+        categories: CategoryRecord 列表（按创建时间排序）
+        products: ProductRecord 列表
+        relations: {产品ID: [相关产品ID（按排名）]}
+    """
+
+    def __init__(self, categories, products, relations):
+        self.categories = tuple(categories)
+        self.built_at = time.time()
+        self._categories = {category.id: category for category in self.categories}
+        newest = sorted(products, key=lambda product: (product.created_at, product.id), reverse=True)
+        self.products = tuple(newest)
+        self._products = {product.id: product for product in newest}
+        by_category = {}
+        for product in newest:
+            by_category.setdefault(product.category_id, []).append(product)
+        self._by_category = {category_id: tuple(items) for category_id, items in by_category.items()}
+        self.featured = tuple(product for product in newest if product.is_featured)
+        # 只保留已上架的相关产品
+        self._related = {
+            product_id: tuple(self._products[related_id] for related_id in related_ids
+                              if related_id in self._products)
+            for product_id, related_ids in relations.items()
+        }
+
+    def __len__(self):
+        return len(self.products)
+
+    def category(self, category_id):
+        """分类，不存在时返回None"""
+        return self._categories.get(category_id)
+
+    def product(self, product_id):
+        """已上架的产品，不存在或已下架时返回None"""
+        return self._products.get(product_id)
+
+    def listing(self, category_id=None):
+        """产品列表（创建时间倒序），指定分类时只包含该分类的产品"""
+        if category_id:
+            return self._by_category.get(category_id, ())
+        return self.products
+
+    def paginate(self, category_id=None, page=1, per_page=PRODUCTS_PER_PAGE):
+        """产品列表的一页"""
+        return ListPagination(page=page, per_page=per_page, error_out=False, items=self.listing(category_id))
+
+    def home_products(self, limit=HOME_PRODUCT_COUNT):
+        """首页产品：推荐产品（创建时间倒序），不足时用最新的其他产品补充"""
+        products = list(self.featured[:limit])
+        if len(products) < limit:
+            products += [product for product in self.products if not product.is_featured][:limit - len(products)]
+        return products
+
+    def related(self, product_id, category_id=None, limit=RELATED_PRODUCT_COUNT):
+        """
+        相关产品：按相关产品推荐的排名（见 app/recommendations.py）；尚未计算推荐时回退到同分类的最新产品
+
+        Args:
+            product_id: 产品ID（可以是已下架的产品）
+            category_id: 产品的分类ID，回退时使用
+            limit: 数量
+        """
+        related = self._related.get(product_id)
+        if related:
+            return list(related[:limit])
+        return [product for product in self.listing(category_id) if product.id != product_id][:limit] \
+            if category_id else []
+
+
+def build():
+    """
+    从数据库读取目录（三条查询，不读取图片数据），需要在应用上下文中调用
+
+    Returns:
+        Catalog: 新的目录
+    """
+    categories = [CategoryRecord(row) for row in db.session.query(
+        Category.id, Category.name, Category.description, Category.created_at, Category.updated_at
+    ).order_by(Category.created_at)]
+    products = [ProductRecord(row) for row in db.session.query(
+        Product.id, Product.name, Product.description, Product.brand, Product.category_id, Product.is_featured,
+        Product.main_image.isnot(None).label('has_main_image'),
+        Product.price, Product.price_min, Product.price_max, Product.created_at, Product.updated_at,
+    ).filter(Product.status == True)]
+    limit = current_app.config.get('RELATED_PRODUCTS_K', 8)
+    relations = {}
+    for product_id, related_id in db.session.query(ProductRelation.product_id, ProductRelation.related_id).filter(
+            ProductRelation.rank < limit).order_by(ProductRelation.product_id, ProductRelation.rank):
+        relations.setdefault(product_id, []).append(related_id)
+    return Catalog(categories, products, relations)
+
+
+def current():
+    """
+    当前的目录，还没有生成时在本请求中同步生成
+    生成目录的查询使用主库：副本的复制延迟可能让刚失效的旧数据被重新缓存
+
+    Returns:
+        Catalog: 目录
+    """
+    global _catalog
+    catalog = _catalog
+    if catalog is not None:
+        return catalog
+    with _build_lock:
+        if _catalog is None:
+            with db_routing.primary():
+                _catalog = build()
+        return _catalog
+
+
+def _rebuild_worker():
+    """后台线程：收到失效信号后等待 CATALOG_REBUILD_DELAY 秒合并多次修改，再生成新的目录并替换"""
+    global _catalog
+    while True:
+        _rebuild_event.wait()
+        app = _app
+        time.sleep(app.config.get('CATALOG_REBUILD_DELAY', 0.2))
+        _rebuild_event.clear()
+        with app.app_context():
+            try:
+                _catalog = build()
+                # 等待期间渲染的分类导航片段来自旧目录，替换后重新渲染（只影响本进程）
+                from app import fragment_cache
+                fragment_cache.invalidate('categories')
+            except Exception as e:
+                # 保留旧目录继续提供服务，下一次失效时再重新生成
+                logging.error(f'重新生成产品目录失败: {str(e)}')
+            finally:
+                db.session.remove()
+
+
+def _expire(rebuild=True):
+    """
+    本进程的目录失效：后台重新生成，或丢弃后由下一个请求同步生成
+
+    Args:
+        rebuild: 是否可以在后台重新生成（False 时直接丢弃）
+    """
+    global _catalog, _rebuild_thread
+    if not rebuild or _app is None or not _app.config.get('CATALOG_BACKGROUND_REBUILD', True) or _catalog is None:
+        _catalog = None
+        return
+    _rebuild_event.set()
+    with _rebuild_lock:
+        if _rebuild_thread is None or not _rebuild_thread.is_alive():
+            _rebuild_thread = threading.Thread(target=_rebuild_worker, name='catalog-rebuild', daemon=True)
+            _rebuild_thread.start()
+
+
+def invalidate():
+    """目录失效（在事务提交后调用），同时通知其他工作进程"""
+    _expire()
+    invalidation.publish('catalog', MESSAGE_KEY)
+
+
+def init_app(app):
+    """记录后台重新生成目录使用的应用实例"""
+    global _app
+    _app = app
+
+
+def _on_message(keys):
+    """失效消息总线的处理函数：其他进程修改了产品或分类；清空全部缓存时（keys 为None）丢弃目录"""
+    _expire(rebuild=keys is not None)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _on_changed(mapper, connection, target):
+    """记录目录变化（记在执行 flush 的会话上），提交后统一处理"""
+    object_session(target).info['catalog_changed'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _on_commit(session):
+    if session.info.pop('catalog_changed', None):
+        invalidate()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop('catalog_changed', None)
+
+
+invalidation.register('catalog', _on_message)
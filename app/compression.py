@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+响应压缩模块
+对HTML、JSON、CSS、JS等文本响应按 Accept-Encoding 协商 brotli / gzip 压缩：
+- 图片等已压缩的类型、小于 COMPRESS_MIN_SIZE 的响应、流式响应和已设置 Content-Encoding 的响应
+  （如 /assets/ 返回的预压缩文件）不做处理
+- 可压缩类型的响应一律添加 Vary: Accept-Encoding，避免代理缓存把压缩版本返回给不支持的客户端
+- 压缩结果按（地址+ETag 或内容摘要, 编码）缓存在进程内 LRU 中，
+  缓存的页面（如首页快照）重复返回同一内容时不再重复压缩，同一内容的并发请求也只压缩一次
+"""
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from app.cache import LRUCache
+from app.single_flight import SingleFlight
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只使用 gzip
+    brotli = None
+
+# 默认可压缩的类型
+DEFAULT_MIMETYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+)
+
+# 压缩结果缓存：{(ETag或内容摘要, 编码): 压缩后的内容}
+_compressed_cache = LRUCache(maxsize=256)
+# 合并同一内容的并发压缩
+_flight = SingleFlight('compression')
+
+
+def supported_encodings():
+    """按优先级排列的可用编码"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encodings):
+    """
+    根据请求的 Accept-Encoding 选择编码，质量值相同时优先 brotli
+
+    Returns:
+        str: 'br'、'gzip'，客户端都不接受时返回 None
+    """
+    best, best_quality = None, 0
+    for encoding in supported_encodings():
+        quality = accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, cache_key=None):
+    """
+    压缩内容，传入 cache_key 时复用缓存的压缩结果
+
+    Args:
+        data: 原始内容（bytes）
+        encoding: 'br' 或 'gzip'
+        cache_key: 缓存键（如 ETag），为None时使用内容摘要
+    """
+    key = (cache_key or hashlib.sha1(data).hexdigest(), encoding)
+    compressed = _compressed_cache.get(key)
+    if compressed is not None:
+        return compressed
+
+    config = current_app.config
+
+    def run():
+        if encoding == 'br':
+            result = brotli.compress(data, quality=config.get('COMPRESS_BR_LEVEL', 4))
+        else:
+            result = gzip.compress(data, compresslevel=config.get('COMPRESS_LEVEL', 6), mtime=0)
+        _compressed_cache.set(key, result)
+        return result
+
+    # 同一内容的并发请求只压缩一次
+    return _flight.do(key, run, timeout=config.get('SINGLE_FLIGHT_TIMEOUT', 10))
+
+
+def _is_compressible(response):
+    """判断响应类型是否属于可压缩的文本类型"""
+    mimetypes = current_app.config.get('COMPRESS_MIMETYPES') or DEFAULT_MIMETYPES
+    return response.mimetype in mimetypes
+
+
+def compress_response(response):
+    """after_request 钩子：按需压缩响应"""
+    if not current_app.config.get('COMPRESS_ENABLED', True):
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    if not _is_compressible(response):
+        return response
+
+    # 无论是否压缩，同一地址的响应内容都随 Accept-Encoding 变化
+    response.vary.add('Accept-Encoding')
+
+    if 'no-transform' in (response.headers.get('Cache-Control') or ''):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config.get('COMPRESS_MIN_SIZE', 500):
+        return response
+
+    etag, weak = response.get_etag()
+    cache_key = f'{request.path}|{etag}' if etag else None
+    response.set_data(compress(data, encoding, cache_key=cache_key))
+    response.headers['Content-Encoding'] = encoding
+    if etag:
+        # 压缩版本与原始内容不是同一个字节序列，使用不同的 ETag
+        response.set_etag(f'{etag}-{encoding}', weak=weak)
+    return response
+
+
+def init_app(app):
+    """注册响应压缩钩子"""
+    app.after_request(compress_response)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+数据库连接池隔离模块（舱壁）
+图片请求在传输大图片期间占用连接，突发的图片请求会占满共用的连接池，首页和后台页面只能排队等待。
+这里按流量类型使用各自的连接池（独立的引擎），一类流量耗尽自己的连接池不会影响其他类型：
+
+- admin：后台、登录、命令行和后台线程，使用默认引擎（db.engine）
+- pages：前台页面（main 蓝图），使用绑定 pool_pages
+- images：图片（挂载的图片服务和前台蓝图中的图片路由），使用绑定 pool_images
+
+每类连接池的大小、溢出数量、等待超时、pre-ping、回收时间和 PostgreSQL 的 statement_timeout
+分别由 DB_POOL_ADMIN / DB_POOL_PAGES / DB_POOL_IMAGES 配置。等待连接超时的请求直接返回 503，不会无限排队
+
+连接池使用情况（借出数量、峰值、等待次数和时间、超时次数）记录在进程内，后台 /admin/db-pools.json 查看；
+连接全部借出时写警告日志
+
+SQLite 内存数据库的每个引擎是独立的数据库，这种情况下所有流量共用默认引擎
+"""
+import logging
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# 流量类型，admin 使用默认引擎
+TRAFFIC_CLASSES = ('admin', 'pages', 'images')
+DEFAULT_CLASS = 'admin'
+# 流量类型对应的绑定名称前缀
+BIND_PREFIX = 'pool_'
+# 前台蓝图中的图片路由（图片服务未挂载时使用）
+IMAGE_ENDPOINTS = {'main.get_product_image', 'main.get_gallery_image', 'main.get_page_content_image'}
+# 等待连接超过该时间（秒）记为一次等待
+WAIT_THRESHOLD = 0.005
+# 连接池耗尽警告日志的最小间隔（秒）
+WARNING_INTERVAL = 60
+
+# 各连接池的统计：{名称: PoolStats}
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class PoolStats:
+    """一个连接池的使用统计"""
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.saturated = 0
+        self.peak = 0
+        self.last_warning = 0.0
+        self.lock = threading.Lock()
+
+    def record_checkout(self, waited, in_use):
+        with self.lock:
+            self.checkouts += 1
+            self.peak = max(self.peak, in_use)
+            if waited > WAIT_THRESHOLD:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait = max(self.max_wait, waited)
+            if self.capacity and in_use >= self.capacity:
+                self.saturated += 1
+                self._warn(f'连接池 {self.name} 的 {self.capacity} 个连接已全部借出')
+
+    def record_timeout(self, waited):
+        with self.lock:
+            self.timeouts += 1
+            self.max_wait = max(self.max_wait, waited)
+            self._warn(f'连接池 {self.name} 等待连接超时（{waited:.1f} 秒）')
+
+    def _warn(self, message):
+        now = time.monotonic()
+        if now - self.last_warning >= WARNING_INTERVAL:
+            self.last_warning = now
+            logging.warning(message)
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'capacity': self.capacity,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'max_wait': round(self.max_wait, 3),
+                'timeouts': self.timeouts,
+                'saturated': self.saturated,
+                'peak': self.peak,
+            }
+
+
+def _stats_for(name, capacity):
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = PoolStats(name, capacity)
+        stats.capacity = capacity
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录借出连接的等待时间和超时的连接池，pool_name 由 pool_class() 生成的子类设置"""
+
+    pool_name = DEFAULT_CLASS
+
+    def _capacity(self):
+        overflow = self._max_overflow
+        return self.size() + overflow if overflow >= 0 else 0
+
+    def _do_get(self):
+        stats = _stats_for(self.pool_name, self._capacity())
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            stats.record_timeout(time.perf_counter() - start)
+            raise
+        stats.record_checkout(time.perf_counter() - start, self.checkedout())
+        return record
+
+
+def pool_class(name):
+    """生成带名称的连接池类（引擎 dispose 时按类重新创建连接池，名称需要保存在类上）"""
+    return type(f'InstrumentedQueuePool_{name}', (InstrumentedQueuePool,), {'pool_name': name})
+
+
+def is_memory_sqlite(url):
+    """是否为 SQLite 内存数据库"""
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url, settings, name):
+    """
+    将 DB_POOL_* 配置转换为 create_engine 参数
+
+    Args:
+        url: 数据库地址
+        settings: 连接池配置（见 config.pool_settings）
+        name: 连接池名称，用于统计
+
+    Returns:
+        dict: create_engine 参数
+    """
+    if is_memory_sqlite(url):
+        return {}
+    options = {
+        'poolclass': pool_class(name),
+        'pool_size': settings['pool_size'],
+        'max_overflow': settings['max_overflow'],
+        'pool_timeout': settings['pool_timeout'],
+        'pool_recycle': settings['pool_recycle'],
+        'pool_pre_ping': settings['pool_pre_ping'],
+    }
+    if settings.get('statement_timeout') and make_url(url).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f"-c statement_timeout={int(settings['statement_timeout'])}"}
+    return options
+
+
+def bind_key(traffic_class):
+    """流量类型对应的绑定名称，admin 为None（默认引擎）"""
+    return None if traffic_class == DEFAULT_CLASS else BIND_PREFIX + traffic_class
+
+
+def traffic_class():
+    """当前请求的流量类型"""
+    if not has_request_context():
+        return DEFAULT_CLASS
+    current = g.get('db_traffic_class')
+    if current is None:
+        if request.endpoint in IMAGE_ENDPOINTS:
+            current = 'images'
+        elif request.blueprint == 'main':
+            current = 'pages'
+        else:
+            current = DEFAULT_CLASS
+        g.db_traffic_class = current
+    return current
+
+
+def engine(name=None):
+    """
+    流量类型对应的引擎
+
+    Args:
+        name: 流量类型，默认为当前请求的类型
+
+    Returns:
+        Engine: 引擎，该类型没有独立连接池时返回None（使用默认引擎）
+    """
+    key = bind_key(name or traffic_class())
+    if key is None or key not in current_app.extensions.get('db_pools', ()):
+        return None
+    from app import db
+    return db.engines[key]
+
+
+def snapshot():
+    """
+    各连接池当前状态和统计
+
+    Returns:
+        dict: {连接池名称: {in_use, capacity, checkouts, waits, ...}}
+    """
+    from app import db
+    result = {}
+    names = {None: DEFAULT_CLASS}
+    names.update((key, key) for key in db.engines if key)
+    names.update((bind_key(name), name) for name in TRAFFIC_CLASSES if name != DEFAULT_CLASS)
+    for key, name in names.items():
+        bound = db.engines.get(key)
+        if bound is None:
+            continue
+        pool = bound.pool
+        entry = _stats_for(name, pool._capacity() if isinstance(pool, InstrumentedQueuePool) else 0).as_dict()
+        entry['in_use'] = pool.checkedout() if isinstance(pool, QueuePool) else None
+        result[name] = entry
+    return result
+
+
+def init_app(app):
+    """
+    按 DB_POOL_* 配置默认引擎和各流量类型的绑定（在 db.init_app 之前调用）
+    只读副本的绑定使用前台页面的连接池配置
+    """
+    url = app.config['SQLALCHEMY_DATABASE_URI']
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    options.update(engine_options(url, app.config['DB_POOL_ADMIN'], DEFAULT_CLASS))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for key, bind in list(binds.items()):
+        if key.startswith('replica'):
+            binds[key] = dict(bind, **engine_options(bind['url'], app.config['DB_POOL_PAGES'], key))
+    pooled = set()
+    if not is_memory_sqlite(url):
+        for name in TRAFFIC_CLASSES:
+            if name == DEFAULT_CLASS:
+                continue
+            settings = app.config[f'DB_POOL_{name.upper()}']
+            binds[bind_key(name)] = dict(url=url, **engine_options(url, settings, name))
+            pooled.add(bind_key(name))
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['db_pools'] = pooled
+
+    @app.errorhandler(exc.TimeoutError)
+    def _pool_timeout(error):
+        """等待数据库连接超时：返回 503，客户端稍后重试"""
+        return 'Service Unavailable', 503, {'Retry-After': '1', 'Content-Type': 'text/plain; charset=utf-8'}
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+读写分离模块
+前台匿名浏览（首页、产品列表、产品详情、图片）只读取数据，可以由只读副本承担，
+主库只处理后台写入、登录和联系表单提交：
+
+- 副本通过 SQLALCHEMY_BINDS 中以 replica 开头的绑定配置（由环境变量 DATABASE_REPLICA_URLS 生成，逗号分隔）
+- 使用 @replica_reads 装饰的视图中，会话的 SELECT 语句发往副本（多个副本轮流使用）；
+  写入、刷新（flush）以及事务中已有写入之后的查询仍然使用主库
+- 读己之写：请求中提交过事务后，在会话中记录截止时间，REPLICA_STICKY_SECONDS 秒内
+  该客户端（如刚保存修改的管理员）的所有读取都使用主库，不会因复制延迟看到旧数据
+- 健康检查：每个副本每隔 REPLICA_HEALTH_INTERVAL 秒检查一次连接（PostgreSQL 同时检查复制延迟
+  是否超过 REPLICA_MAX_LAG 秒），执行出错或检查失败的副本暂停使用，全部不可用时回退到主库
+
+未配置副本时不做任何改变
+"""
+import functools
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_request_context, session as http_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+from app import db_pools
+
+# 副本绑定名称的前缀
+REPLICA_PREFIX = 'replica'
+# 会话中记录读己之写截止时间的键
+STICKY_SESSION_KEY = '_db_primary_until'
+
+
+class ReplicaRouter:
+    """
+    副本选择与健康状态
+
+    Args:
+        app: Flask应用实例
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.names = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {})
+                            if key and key.startswith(REPLICA_PREFIX))
+        self.health_interval = app.config.get('REPLICA_HEALTH_INTERVAL', 10)
+        self.max_lag = app.config.get('REPLICA_MAX_LAG', 30)
+        self.retry_interval = app.config.get('REPLICA_RETRY_INTERVAL', 30)
+        self._engines = None
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        # {副本名称: (是否可用, 下次检查时间)}
+        self._health = {name: (True, 0.0) for name in self.names}
+
+    @property
+    def engines(self):
+        """{副本名称: 引擎}"""
+        if self._engines is None:
+            from app import db
+            with self.app.app_context():
+                self._engines = {name: db.engines[name] for name in self.names}
+            for name, engine in self._engines.items():
+                event.listen(engine, 'handle_error', functools.partial(self._on_error, name))
+        return self._engines
+
+    def choose(self):
+        """
+        选择一个可用的副本
+
+        Returns:
+            Engine: 副本引擎，没有可用副本时返回None
+        """
+        if not self.names:
+            return None
+        engines = self.engines
+        start = next(self._counter)
+        for offset in range(len(self.names)):
+            name = self.names[(start + offset) % len(self.names)]
+            if self.is_healthy(name):
+                return engines[name]
+        return None
+
+    def is_healthy(self, name):
+        """副本是否可用，到达检查时间时由一个线程执行检查，其他线程使用上次的结果"""
+        healthy, next_check = self._health[name]
+        if time.monotonic() < next_check or not self._lock.acquire(blocking=False):
+            return healthy
+        try:
+            healthy = self._check(name)
+            interval = self.health_interval if healthy else self.retry_interval
+            self._health[name] = (healthy, time.monotonic() + interval)
+        finally:
+            self._lock.release()
+        return healthy
+
+    def _check(self, name):
+        """检查副本连接和复制延迟"""
+        engine = self.engines[name]
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    lag = connection.exec_driver_sql(
+                        'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())').scalar()
+                    if lag is not None and lag > self.max_lag:
+                        logging.warning(f'只读副本 {name} 复制延迟 {lag:.1f} 秒，暂时改用主库')
+                        return False
+                else:
+                    connection.exec_driver_sql('SELECT 1')
+        except Exception as e:
+            logging.warning(f'只读副本 {name} 不可用，暂时改用主库: {str(e)}')
+            return False
+        return True
+
+    def mark_down(self, name):
+        """将副本标记为不可用，REPLICA_RETRY_INTERVAL 秒后重新检查"""
+        self._health[name] = (False, time.monotonic() + self.retry_interval)
+
+    def _on_error(self, name, context):
+        """副本上的语句或连接出错时暂停使用（本次请求仍会失败，之后的请求改用主库）"""
+        if context.is_disconnect or context.connection is None:
+            logging.warning(f'只读副本 {name} 连接失败，暂时改用主库: {context.original_exception}')
+            self.mark_down(name)
+
+
+def _router():
+    """当前应用的副本路由器，未配置副本时返回None"""
+    return current_app.extensions.get('db_routing')
+
+
+def _wants_replica():
+    """当前请求是否应该从副本读取"""
+    return has_request_context() and g.get('db_route') == 'replica'
+
+
+class RoutingSession(Session):
+    """
+    只读视图中将 SELECT 语句发往副本的会话
+    其他语句使用当前请求流量类型的连接池（见 app/db_pools.py）
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and isinstance(clause, Select) and _wants_replica()
+                and not self._flushing and not self.info.get('db_wrote')):
+            router = _router()
+            engine = router.choose() if router is not None else None
+            if engine is not None:
+                return engine
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and has_request_context() and engine is self._db.engine:
+            return db_pools.engine() or engine
+        return engine
+
+
+def replica_reads(view):
+    """
+    视图装饰器：视图中的查询使用只读副本
+    刚提交过修改的客户端（读己之写）仍然使用主库
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _sticky_to_primary():
+            g.db_route = 'replica'
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """在只读视图中临时使用主库（读取必须与主库一致的数据）"""
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('db_route')
+    g.db_route = 'primary'
+    try:
+        yield
+    finally:
+        g.db_route = previous
+
+
+def _sticky_to_primary():
+    """客户端是否处于读己之写的时间窗口内"""
+    until = http_session.get(STICKY_SESSION_KEY)
+    return until is not None and until > time.time()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _on_flush(session, flush_context):
+    """事务中有写入后，后续查询使用主库（副本看不到未提交的数据）"""
+    session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    """批量 UPDATE / DELETE 等语句不经过 flush，同样记录为写入"""
+    if not orm_execute_state.is_select:
+        orm_execute_state.session.info['db_wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _on_commit(session):
+    """提交后记录到请求中，响应时写入读己之写的截止时间"""
+    if session.info.pop('db_wrote', None) and has_request_context():
+        g.db_committed = True
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop('db_wrote', None)
+
+
+def init_app(app):
+    """配置了副本时注册路由器和读己之写的响应钩子"""
+    router = ReplicaRouter(app)
+    if not router.names:
+        return
+    app.extensions['db_routing'] = router
+
+    @app.after_request
+    def _remember_write(response):
+        if g.get('db_committed'):
+            http_session[STICKY_SESSION_KEY] = time.time() + app.config.get('REPLICA_STICKY_SECONDS', 10)
+        return response
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+模板片段缓存模块
+为模板提供 {% cache key, ttl[, tags] %} ... {% endcache %} 标签：
+
+    {% cache ('product-card', product), 3600 %}
+        ...产品卡片...
+    {% endcache %}
+
+    {% cache 'footer-categories', 600, ['categories'] %}
+        ...分类导航...
+    {% endcache %}
+
+- key 可以是字符串或元组；其中的模型对象（包括快照中的 ModelSummary）会转换为「表名:ID:updated_at」，
+  数据修改后 updated_at 变化，自然命中新的缓存条目，同时自动附带标签「表名:ID」
+- 缓存键包含模板名，不同模板中的同名片段互不影响
+- 片段保存在进程内 LRU 中；产品、分类被修改或删除时按标签立即失效（见文件末尾的映射事件），
+  提交后通过失效消息总线通知其他工作进程
+- 同一个片段并发未命中时只渲染一次，其他请求等待并共享渲染结果（见 app/single_flight.py）
+- 已登录的管理员总是实时渲染，预览修改不受缓存影响
+"""
+import os
+
+from flask import current_app
+from flask_login import current_user
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+
+from app import db, invalidation
+from app.cache import LRUCache
+from app.single_flight import SingleFlight
+from app.models import Category, Product
+from app.snapshots import ModelSummary
+
+# 片段缓存：{(模板名, 缓存键): 渲染结果}
+_fragments = LRUCache(maxsize=2048)
+# 合并同一个片段的并发渲染
+_flight = SingleFlight('fragments')
+
+
+def model_tag(obj):
+    """模型对象的缓存标签，如 products:5"""
+    return f'{obj.__tablename__}:{obj.id}'
+
+
+def _normalize_key(key):
+    """
+    将缓存键转换为可哈希的元组，并收集其中模型对象对应的标签
+
+    Returns:
+        tuple: (缓存键, 标签列表)
+    """
+    parts = key if isinstance(key, (tuple, list)) else (key,)
+    normalized, tags = [], []
+    for part in parts:
+        if isinstance(part, (db.Model, ModelSummary)):
+            updated_at = getattr(part, 'updated_at', None)
+            if hasattr(updated_at, 'isoformat'):
+                updated_at = updated_at.isoformat()
+            normalized.append((model_tag(part), updated_at))
+            tags.append(model_tag(part))
+        else:
+            normalized.append(part)
+    return tuple(normalized), tags
+
+
+def _bypass_cache():
+    """片段缓存关闭，或当前是已登录的管理员时实时渲染"""
+    if not current_app.config.get('FRAGMENT_CACHE_ENABLED', True):
+        return True
+    return current_user.is_authenticated and getattr(current_user, 'is_admin', False)
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache %} 模板标签"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        parser.stream.expect('comma')
+        args.append(parser.parse_expression())
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render_cached', args), [], [], body).set_lineno(lineno)
+
+    def _render_cached(self, template_name, key, ttl, tags, caller):
+        if _bypass_cache():
+            return caller()
+        key, model_tags = _normalize_key(key)
+        cache_key = (template_name, key)
+        rendered, fresh = _fragments.lookup(cache_key)
+        if fresh:
+            return rendered
+
+        def render():
+            result = caller()
+            _fragments.set(cache_key, result, ttl=ttl, tags=model_tags + list(tags or ()))
+            return result
+
+        # 同一个片段同时只渲染一次，过期（未被显式失效）时其他线程在重新渲染期间使用旧的渲染结果
+        return _flight.do(cache_key, render, timeout=current_app.config.get('SINGLE_FLIGHT_TIMEOUT', 10),
+                          stale=rendered)
+
+
+def invalidate(*tags):
+    """按标签使片段失效，不传标签时清空全部片段"""
+    if not tags:
+        _fragments.clear()
+        return
+    _fragments.invalidate_tags(*tags)
+
+
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _on_product_changed(mapper, connection, target):
+    """产品被修改或删除时使其所有片段失效"""
+    invalidate(model_tag(target))
+    invalidation.publish_on_commit(target, 'fragment', model_tag(target))
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _on_category_changed(mapper, connection, target):
+    """分类变化时使分类导航等片段失效"""
+    invalidate(model_tag(target), 'categories')
+    invalidation.publish_on_commit(target, 'fragment', model_tag(target), 'categories')
+
+
+def _on_message(tags):
+    """其他工作进程发布的失效消息，tags 为None时清空全部片段"""
+    invalidate(*(tags or ()))
+
+
+invalidation.register('fragment', _on_message)
+
+
+def init_app(app):
+    """注册 {% cache %} 标签，并启用模板字节码缓存"""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    _fragments.maxsize = app.config.get('FRAGMENT_CACHE_SIZE', 2048)
+
+    # 模板编译结果写入磁盘，工作进程启动后无需重新编译模板
+    cache_dir = app.config.get('TEMPLATE_BYTECODE_CACHE_DIR')
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+轻量图片服务模块
+图片是访问量最大的请求（每个页面 6-10 张），走完整的 Flask 应用时每个请求都要经过
+会话、Flask-Login、蓝图分发和 ORM 对象构建。这里提供一个只处理 /image/ 的最小 WSGI 应用：
+
+- 直接使用连接池执行 Core 查询，只读取图片所需的列，不构建 ORM 对象
+- 外部存储（BLOB_STORE_PATH）中已有当前版本的副本时直接从磁盘读取，不查询图片数据
+- 部署在 Nginx 等代理之后时可以开启发送文件卸载（IMAGE_OFFLOAD）：图片先落盘为副本，
+  响应只返回 X-Accel-Redirect / X-Sendfile 头，由代理用 sendfile(2) 发送文件内容，
+  工作进程不再逐字节输出图片
+- 支持 ETag / Last-Modified 条件请求：请求带 If-None-Match / If-Modified-Since 时
+  先查询元数据，未修改时返回 304，不读取图片数据
+- 同一张图片的并发请求只查询一次数据库；首次落盘时多个工作进程之间用文件锁合并，只有一个进程读取并写入
+- 分块输出响应内容
+
+挂载方式：IMAGE_APP_ENABLED 为 True 时 create_app() 将其挂载到 /image/（前台蓝图中的图片路由保留，
+用于 url_for 生成地址和关闭时回退）；也可以单独运行：
+
+    gunicorn -w 4 'app.image_server:create_image_app()'
+"""
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from sqlalchemy import bindparam, create_engine, exc, func, select
+
+from app import blob_store, single_flight
+from app.models import PageContent, Product, ProductImage
+
+# 分块输出的块大小
+CHUNK_SIZE = 64 * 1024
+
+# 合并同一张图片的并发查询和落盘
+_flight = single_flight.SingleFlight('images')
+
+_ROUTE_PATTERN = re.compile(r'^/(product|gallery|page-content)/(\d+)$')
+
+# 发送文件卸载方式对应的响应头
+OFFLOAD_HEADERS = {
+    'x-accel-redirect': 'X-Accel-Redirect',  # Nginx
+    'x-sendfile': 'X-Sendfile',              # Apache mod_xsendfile、lighttpd
+}
+
+
+def _image_queries():
+    """
+    各类图片的查询语句：元数据查询（不含图片数据）和完整查询
+    返回列顺序：mimetype, filename, updated_at, 图片长度, 所属产品ID（非图库图片为自身ID）[, 图片数据]
+    """
+    products = Product.__table__
+    gallery = ProductImage.__table__
+    contents = PageContent.__table__
+    sources = {
+        blob_store.KIND_PRODUCT: (products, products.c.main_image, products.c.main_image_mimetype,
+                                  products.c.main_image_filename, products.c.updated_at, None),
+        blob_store.KIND_GALLERY: (gallery, gallery.c.image_data, gallery.c.mimetype,
+                                  gallery.c.filename, gallery.c.created_at, gallery.c.product_id),
+        blob_store.KIND_PAGE_CONTENT: (contents, contents.c.image_data, contents.c.image_mimetype,
+                                       contents.c.image_filename, contents.c.updated_at, None),
+    }
+    queries = {}
+    for kind, (table, data, mimetype, filename, updated_at, product_id) in sources.items():
+        columns = [mimetype, filename, updated_at, func.length(data), product_id if product_id is not None else table.c.id]
+        condition = table.c.id == bindparam('id')
+        queries[kind] = (
+            select(*columns).where(condition),
+            select(*columns, data).where(condition),
+        )
+    return queries
+
+
+class ImageApp:
+    """
+    只处理图片请求的 WSGI 应用
+
+    Args:
+        engine_factory: 返回 SQLAlchemy 引擎的函数（首次请求时调用）
+        store_root: 外部存储根目录，为None时不读取磁盘
+        max_age: 浏览器缓存时间（秒）
+        offload: 发送文件卸载方式：off（不卸载）、auto（代理在请求头 X-Sendfile-Type 中声明支持时卸载）、
+                 x-accel-redirect、x-sendfile（始终卸载，确认所有请求都经过代理时使用）
+        accel_prefix: X-Accel-Redirect 使用的 Nginx internal location 前缀，对应外部存储根目录
+        replica_chooser: 每个请求调用一次，返回可用的只读副本引擎（返回None时使用 engine_factory 的引擎）
+        guard: 限流和防盗链检查（app.rate_limit.ImageGuard），为None时不检查
+        flight_timeout: 等待其他请求读取同一张图片的最长时间（秒），见 app/single_flight.py
+    """
+
+    def __init__(self, engine_factory, store_root=None, max_age=3600, offload='off', accel_prefix='/_blobs/',
+                 replica_chooser=None, guard=None, flight_timeout=10):
+        self._engine_factory = engine_factory
+        self._engine = None
+        self.replica_chooser = replica_chooser
+        self.guard = guard
+        self.flight_timeout = flight_timeout
+        self.store_root = store_root
+        self.max_age = max_age
+        self.offload = (offload or 'off').lower()
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'
+        self.queries = _image_queries()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self._engine_factory()
+        return self._engine
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD'):
+            return self._respond(start_response, '405 Method Not Allowed', [('Allow', 'GET, HEAD')])
+        match = _ROUTE_PATTERN.match(environ.get('PATH_INFO', ''))
+        if match is None:
+            return self._respond(start_response, '404 Not Found')
+        kind, object_id = match.group(1), int(match.group(2))
+        if self.guard is not None:
+            rejected = self.guard.check(environ, kind, object_id)
+            if rejected is not None:
+                return self._respond(start_response, *rejected)
+
+        # 条件请求、需要卸载或外部存储中可能有副本时先查询元数据，否则一次查询取出全部数据
+        conditional = 'HTTP_IF_NONE_MATCH' in environ or 'HTTP_IF_MODIFIED_SINCE' in environ
+        offload = self.offload_mode(environ) if self.store_root else None
+        metadata_first = conditional or offload is not None or self._store_has_kind(kind)
+        engine = (self.replica_chooser() if self.replica_chooser else None) or self.engine
+        try:
+            row = self._fetch(engine, kind, object_id, full=not metadata_first)
+            if row is None:
+                return self._respond(start_response, '404 Not Found')
+            if not row[3] or (kind == blob_store.KIND_GALLERY and not row[0]):
+                return self._missing(kind, environ, start_response)
+            mimetype, filename, updated_at, length, owner_id = row[:5]
+            version = f'{int(updated_at.timestamp()) if updated_at else 0}-{length}'
+            etag = f'"{kind}-{object_id}-{version}"'
+            headers = self._cache_headers(etag, updated_at)
+            if conditional and self._not_modified(environ, etag, updated_at):
+                return self._respond(start_response, '304 Not Modified', headers)
+
+            rel_path = blob_store.relative_path(kind, object_id, owner_id if kind == blob_store.KIND_GALLERY else None)
+            path, data = None, None
+            if metadata_first:
+                path = blob_store.find_variant(self.store_root, rel_path, version) if self.store_root else None
+                if path is None and offload is not None:
+                    # 首次请求时落盘，之后的请求直接由代理发送
+                    path = self._write_variant(engine, kind, object_id, rel_path, version)
+                elif path is None:
+                    data = self._fetch(engine, kind, object_id, full=True)[5]
+            else:
+                data = row[5]
+        except exc.TimeoutError:
+            # 图片连接池已满：直接返回 503，不占用其他流量的连接
+            return self._respond(start_response, '503 Service Unavailable', [('Retry-After', '1')])
+
+        headers.append(('Content-Type', mimetype or 'image/jpeg'))
+        if filename:
+            headers.append(('Content-Disposition', f"inline; filename*=UTF-8''{quote(filename, safe='')}"))
+        if offload is not None:
+            headers.append(self._offload_header(offload, path))
+            return self._respond(start_response, '200 OK', headers)
+        if path is not None:
+            headers.append(('Content-Length', str(os.path.getsize(path))))
+            start_response('200 OK', headers)
+            if method == 'HEAD':
+                return []
+            return self._file_chunks(environ, path)
+
+        headers.append(('Content-Length', str(len(data))))
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return []
+        return _chunks(data)
+
+    def _fetch(self, engine, kind, object_id, full):
+        """
+        查询图片的元数据（full 为 True 时包括图片数据），同一张图片的并发查询只执行一次
+
+        Returns:
+            Row: 查询结果，记录不存在时返回None
+        """
+        query = self.queries[kind][1 if full else 0]
+
+        def run():
+            with engine.connect() as connection:
+                return connection.execute(query, {'id': object_id}).first()
+
+        return _flight.do((kind, object_id, full), run, timeout=self.flight_timeout)
+
+    def _write_variant(self, engine, kind, object_id, rel_path, version):
+        """
+        读取图片数据并写入外部存储，返回副本路径
+        进程内同一个副本只有一个线程写入；多个工作进程之间用文件锁合并，拿到锁后先检查其他进程是否已经写好
+        """
+        def run():
+            lock_path = blob_store.lock_path(self.store_root, rel_path)
+            with single_flight.file_lock(lock_path, timeout=self.flight_timeout):
+                path = blob_store.find_variant(self.store_root, rel_path, version)
+                if path is None:
+                    data = self._fetch(engine, kind, object_id, full=True)[5]
+                    path = blob_store.write_variant(self.store_root, rel_path, version, data)
+                return path
+
+        return _flight.do(('variant', rel_path, version), run, timeout=self.flight_timeout)
+
+    def offload_mode(self, environ):
+        """
+        判断本次请求是否卸载给代理发送
+
+        Returns:
+            str: 'x-accel-redirect' 或 'x-sendfile'，不卸载时返回None
+        """
+        if self.offload in OFFLOAD_HEADERS:
+            return self.offload
+        if self.offload == 'auto':
+            # 代理通过请求头声明支持的方式（与 Rack::Sendfile 的约定相同），直接访问应用时不卸载；
+            # 请求头由客户端提供时同样生效，因此 auto 需要显式开启，并且代理必须覆盖该请求头
+            declared = environ.get('HTTP_X_SENDFILE_TYPE', '').lower()
+            if declared in OFFLOAD_HEADERS:
+                return declared
+        return None
+
+    def _offload_header(self, offload, path):
+        """生成卸载响应头：X-Accel-Redirect 使用 internal location 地址，X-Sendfile 使用绝对路径"""
+        if offload == 'x-accel-redirect':
+            rel_path = os.path.relpath(path, self.store_root).replace(os.sep, '/')
+            return OFFLOAD_HEADERS[offload], self.accel_prefix + quote(rel_path)
+        return OFFLOAD_HEADERS[offload], path
+
+    def _store_has_kind(self, kind):
+        """外部存储中是否有该类型的图片目录"""
+        return bool(self.store_root) and os.path.isdir(os.path.join(self.store_root, kind))
+
+    def _file_chunks(self, environ, path):
+        """从磁盘分块输出，服务器支持时使用 wsgi.file_wrapper（sendfile）"""
+        f = open(path, 'rb')
+        wrapper = environ.get('wsgi.file_wrapper')
+        if wrapper is not None:
+            return wrapper(f, CHUNK_SIZE)
+        return _file_iter(f)
+
+    def _cache_headers(self, etag, updated_at):
+        headers = [('ETag', etag), ('Cache-Control', f'public, max-age={self.max_age}')]
+        if updated_at:
+            headers.append(('Last-Modified', formatdate(updated_at.timestamp(), usegmt=True)))
+        return headers
+
+    @staticmethod
+    def _not_modified(environ, etag, updated_at):
+        """判断条件请求是否命中（If-None-Match 优先）"""
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            candidates = [value.strip() for value in if_none_match.split(',')]
+            return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and updated_at:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return int(updated_at.timestamp()) <= int(since.timestamp())
+        return False
+
+    def _missing(self, kind, environ, start_response):
+        """记录存在但没有图片：图库图片重定向到默认图片，其他返回404（与前台路由一致）"""
+        if kind == blob_store.KIND_GALLERY:
+            location = environ.get('SCRIPT_NAME', '').rsplit('/image', 1)[0] + '/static/images/default-product.jpg'
+            return self._respond(start_response, '302 Found', [('Location', location)])
+        return self._respond(start_response, '404 Not Found')
+
+    @staticmethod
+    def _respond(start_response, status, headers=None):
+        headers = list(headers or [])
+        headers.append(('Content-Length', '0'))
+        start_response(status, headers)
+        return []
+
+
+def _chunks(data):
+    """将内存中的图片数据分块输出"""
+    view = memoryview(data)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield view[start:start + CHUNK_SIZE]
+
+
+def _file_iter(f):
+    with f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def mount(app):
+    """
+    将图片服务挂载到 Flask 应用的 /image/，使用应用中图片流量的连接池（配置了只读副本时从副本读取）和外部存储配置
+    """
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+    from app import db, db_pools
+
+    def engine_factory():
+        with app.app_context():
+            return db_pools.engine('images') or db.engine
+
+    router = app.extensions.get('db_routing')
+
+    image_app = ImageApp(
+        engine_factory, blob_store.store_root(app),
+        max_age=app.config.get('IMAGE_CACHE_MAX_AGE', 3600),
+        offload=app.config.get('IMAGE_OFFLOAD', 'off'),
+        accel_prefix=app.config.get('IMAGE_OFFLOAD_ACCEL_PREFIX', '/_blobs/'),
+        replica_chooser=router.choose if router is not None else None,
+        guard=app.extensions.get('image_guard'),
+        flight_timeout=app.config.get('SINGLE_FLIGHT_TIMEOUT', 10),
+    )
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {'/image': image_app})
+    return image_app
+
+
+def create_image_app(config_name=None):
+    """
+    创建独立运行的图片服务（不创建 Flask 应用），使用与主应用相同的配置
+
+    Args:
+        config_name: 配置名称，默认按环境变量 FLASK_CONFIG
+    """
+    from config import config
+
+    from app.db_pools import engine_options
+    from app.rate_limit import ImageGuard
+
+    settings = config[config_name or os.environ.get('FLASK_CONFIG', 'default')]
+    engine = create_engine(
+        settings.SQLALCHEMY_DATABASE_URI,
+        **engine_options(settings.SQLALCHEMY_DATABASE_URI, settings.DB_POOL_IMAGES, 'images'),
+    )
+    return ImageApp(
+        lambda: engine, os.path.abspath(settings.BLOB_STORE_PATH),
+        max_age=settings.IMAGE_CACHE_MAX_AGE,
+        offload=settings.IMAGE_OFFLOAD,
+        accel_prefix=settings.IMAGE_OFFLOAD_ACCEL_PREFIX,
+        flight_timeout=settings.SINGLE_FLIGHT_TIMEOUT,
+        guard=ImageGuard({key: getattr(settings, key) for key in dir(settings) if key.isupper()})
+        if settings.IMAGE_RATE_LIMIT_ENABLED else None,
+    )
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程缓存失效模块
+页面快照、模板片段、登录用户等缓存都保存在各个工作进程内。后台的修改只会清理处理该请求的进程中的缓存，
+其他进程（包括其他主机上的进程）需要通过这里的失效消息总线得知：
+
+- 修改提交后调用 publish(命名空间, 键...) 发布消息；映射事件中使用 publish_on_commit(target, ...)，
+  消息记在执行 flush 的会话上，事务提交后才发布，回滚时丢弃
+- 每个工作进程运行一个监听线程，收到其他进程发布的消息后调用该命名空间注册的处理函数（只清理本进程缓存）
+- PostgreSQL 使用 LISTEN/NOTIFY，消息实时送达；其他数据库（如测试使用的 SQLite）
+  写入 cache_invalidations 表，监听线程每隔 CACHE_BUS_POLL_INTERVAL 秒轮询一次
+- 监听连接断开期间可能错过消息，重新连接后清空所有已注册的缓存
+
+处理函数的参数为键列表，为None表示清空该命名空间的全部缓存
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app import db
+from app.models import CacheInvalidation, china_now
+
+# PostgreSQL NOTIFY 消息的最大长度为 8000 字节，超过时拆分为多条
+MAX_PAYLOAD_SIZE = 7000
+# 轮询模式下失效记录的保留时间
+POLL_RETENTION = timedelta(minutes=10)
+
+# 已注册的处理函数：{命名空间: 处理函数}
+_handlers = {}
+# 应用实例的随机标识，与进程ID一起区分不同主机、不同进程发布的消息
+_instance = uuid.uuid4().hex[:8]
+# 监听线程：{进程ID: 线程}，fork 出的工作进程需要启动自己的线程
+_listeners = {}
+_listener_lock = threading.Lock()
+
+
+def register(namespace, handler):
+    """
+    注册命名空间的处理函数
+
+    Args:
+        namespace: 命名空间，如 snapshot、fragment、user
+        handler: 处理函数，参数为键列表（None 表示全部）
+    """
+    _handlers[namespace] = handler
+
+
+def backend(app=None):
+    """消息总线的实现方式：notify（PostgreSQL）或 poll"""
+    app = app or current_app
+    configured = app.config.get('CACHE_BUS_BACKEND', 'auto')
+    if configured != 'auto':
+        return configured
+    with app.app_context():
+        return 'notify' if db.engine.dialect.name == 'postgresql' else 'poll'
+
+
+def _sender():
+    """本进程的标识（fork 出的工作进程进程ID不同），监听线程忽略本进程发布的消息"""
+    return f'{os.getpid()}-{_instance}'
+
+
+def _payloads(namespace, keys):
+    """将消息按长度拆分并序列化，keys 为None时生成一条清空全部的消息"""
+    sender = _sender()
+    if keys is None:
+        yield json.dumps({'s': sender, 'n': namespace, 'k': None})
+        return
+    batch = []
+    for key in keys:
+        batch.append(str(key))
+        if len(batch) > 1 and len(json.dumps(batch, ensure_ascii=False).encode('utf-8')) > MAX_PAYLOAD_SIZE:
+            last = batch.pop()
+            yield json.dumps({'s': sender, 'n': namespace, 'k': batch}, ensure_ascii=False)
+            batch = [last]
+    if batch:
+        yield json.dumps({'s': sender, 'n': namespace, 'k': batch}, ensure_ascii=False)
+
+
+def publish(namespace, *keys):
+    """
+    向其他工作进程发布失效消息（在事务提交后调用，本进程的缓存由调用方自行清理）
+
+    Args:
+        namespace: 命名空间
+        keys: 失效的键，不传时清空其他进程中该命名空间的全部缓存
+    """
+    app = current_app._get_current_object()
+    if not app.config.get('CACHE_BUS_ENABLED', True):
+        return
+    payloads = list(_payloads(namespace, keys or None))
+    try:
+        with db.engine.begin() as connection:
+            if backend(app) == 'notify':
+                channel = app.config.get('CACHE_BUS_CHANNEL', 'cache_invalidation')
+                for payload in payloads:
+                    connection.execute(db.text('SELECT pg_notify(:channel, :payload)'),
+                                       {'channel': channel, 'payload': payload})
+            else:
+                now = china_now()
+                connection.execute(CacheInvalidation.__table__.insert(),
+                                   [{'payload': payload, 'created_at': now} for payload in payloads])
+    except Exception as e:
+        # 发布失败不影响已提交的修改，其他进程的缓存在有效期后过期
+        logging.error(f'发布缓存失效消息失败: {str(e)}')
+
+
+def publish_on_commit(target, namespace, *keys):
+    """
+    记录失效消息，在执行 flush 的会话（target 所在的会话）提交后发布（用于映射事件）
+
+    Args:
+        target: 映射事件中被修改的对象
+        namespace: 命名空间
+        keys: 失效的键，省略时清空该命名空间的全部缓存（记为None）
+    """
+    pending = object_session(target).info.setdefault('invalidation_messages', {})
+    recorded = pending.setdefault(namespace, set())
+    if keys:
+        recorded.update(keys)
+    else:
+        recorded.add(None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _on_commit(session):
+    pending = session.info.pop('invalidation_messages', None)
+    for namespace, keys in (pending or {}).items():
+        if None in keys:
+            publish(namespace)
+        else:
+            publish(namespace, *sorted(keys, key=str))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop('invalidation_messages', None)
+
+
+def dispatch(payload):
+    """处理一条消息：调用对应命名空间的处理函数，忽略本进程发布的消息"""
+    try:
+        message = json.loads(payload)
+    except ValueError:
+        logging.error(f'无法解析缓存失效消息: {payload[:200]}')
+        return
+    if message.get('s') == _sender():
+        return
+    handler = _handlers.get(message.get('n'))
+    if handler is not None:
+        handler(message.get('k'))
+
+
+def _clear_all():
+    """清空所有已注册的缓存（监听中断期间可能错过消息）"""
+    for handler in _handlers.values():
+        handler(None)
+
+
+def _listen_notify(app):
+    """PostgreSQL：在独立连接上 LISTEN，阻塞等待通知"""
+    channel = app.config.get('CACHE_BUS_CHANNEL', 'cache_invalidation')
+    with app.app_context():
+        raw = db.engine.raw_connection()
+    # 从连接池中分离，由监听线程独占
+    raw.detach()
+    connection = raw.driver_connection
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{channel}"')
+        while True:
+            if select.select([connection], [], [], 30) == ([], [], []):
+                continue
+            connection.poll()
+            while connection.notifies:
+                dispatch(connection.notifies.pop(0).payload)
+    finally:
+        raw.close()
+
+
+def _listen_poll(app):
+    """其他数据库：轮询 cache_invalidations 表"""
+    interval = app.config.get('CACHE_BUS_POLL_INTERVAL', 1.0)
+    table = CacheInvalidation.__table__
+    with app.app_context():
+        last_id = db.session.query(db.func.max(table.c.id)).scalar() or 0
+        db.session.remove()
+    last_prune = time.monotonic()
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                rows = db.session.execute(
+                    db.select(table.c.id, table.c.payload).where(table.c.id > last_id).order_by(table.c.id)
+                ).all()
+                for row in rows:
+                    dispatch(row.payload)
+                    last_id = row.id
+                if time.monotonic() - last_prune > POLL_RETENTION.total_seconds():
+                    db.session.execute(table.delete().where(table.c.created_at < china_now() - POLL_RETENTION))
+                    db.session.commit()
+                    last_prune = time.monotonic()
+            finally:
+                db.session.remove()
+
+
+def _run_listener(app):
+    """监听线程：连接出错时重试，并清空本进程缓存"""
+    listen = _listen_notify if backend(app) == 'notify' else _listen_poll
+    while True:
+        try:
+            listen(app)
+        except Exception as e:
+            logging.error(f'缓存失效监听中断，稍后重新连接: {str(e)}')
+            time.sleep(1)
+            _clear_all()
+
+
+def start_listener(app):
+    """
+    启动本进程的监听线程（已启动时直接返回）
+    gunicorn --preload 等方式 fork 出的工作进程不会继承线程，因此在每个进程的首个请求时调用
+
+    Returns:
+        threading.Thread: 监听线程
+    """
+    pid = os.getpid()
+    with _listener_lock:
+        thread = _listeners.get(pid)
+        if thread is None or not thread.is_alive():
+            thread = threading.Thread(target=_run_listener, args=(app,), name='cache-invalidation', daemon=True)
+            thread.start()
+            _listeners[pid] = thread
+    return thread
+
+
+def init_app(app):
+    """在每个工作进程的首个请求时启动监听线程"""
+    if not app.config.get('CACHE_BUS_ENABLED', True) or app.testing:
+        return
+
+    @app.before_request
+    def _ensure_listener():
+        if os.getpid() not in _listeners:
+            start_listener(app)
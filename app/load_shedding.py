@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发限制与降载模块
+爬虫或盗链突发时大量图片请求占满工作线程，所有请求的延迟一起恶化。这里在 WSGI 层按地址分组限制并发：
+
+- 分组：images（/image/）、admin（/admin、/auth）、pages（其他前台页面），/static/ 和 /assets/ 不限制
+- 每组的并发上限按 AIMD 自适应：请求耗时不超过目标延迟时上限缓慢增加（每个请求 +1/上限），
+  超过时按比例下降（每个目标延迟窗口内最多下降一次），上限保持在 [minimum, maximum] 之间
+- 超过上限的请求进入有长度上限的等待队列，队列已满或等待超过 queue_timeout 秒时直接返回
+  503 + Retry-After，不占用数据库连接
+- 被拒绝的匿名前台页面如果最近成功返回过（进程内缓存最近的页面响应），直接返回缓存的页面，
+  数据库饱和时已缓存的页面仍然可以访问
+
+各组的参数由 CONCURRENCY_PAGES / CONCURRENCY_IMAGES / CONCURRENCY_ADMIN 配置。
+并发限制针对每个工作进程内的线程（gthread、gevent 等），同步工作进程每次只处理一个请求，不需要限制
+"""
+import threading
+import time
+
+from werkzeug.http import parse_accept_header, parse_cookie
+from werkzeug.wsgi import ClosingIterator
+
+from app.cache import LRUCache
+from app.compression import choose_encoding
+
+# 不限制并发的路径前缀
+EXEMPT_PREFIXES = ('/static/', '/assets/')
+# 各分组的路径前缀，未匹配的路径属于 pages
+GROUP_PREFIXES = (
+    ('/image/', 'images'),
+    ('/admin', 'admin'),
+    ('/auth', 'admin'),
+)
+# 缓存的页面响应的最大字节数
+STALE_MAX_BYTES = 512 * 1024
+
+
+class AIMDLimit:
+    """
+    按延迟自适应的并发上限（加性增、乘性减）
+
+    Args:
+        initial: 初始上限
+        minimum: 最小上限
+        maximum: 最大上限
+        target_latency: 目标延迟（秒）
+        backoff: 超过目标延迟时上限乘以的系数
+    """
+
+    def __init__(self, initial, minimum, maximum, target_latency, backoff=0.9):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self._last_decrease = 0.0
+
+    def update(self, latency, in_flight):
+        """
+        根据一次请求的耗时调整上限（调用方持有锁）
+
+        Args:
+            latency: 请求耗时（秒）
+            in_flight: 该请求完成前正在处理的请求数
+        """
+        if latency > self.target_latency:
+            now = time.monotonic()
+            # 同一批慢请求只触发一次下降，避免上限塌到最小值
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+        elif in_flight >= self.limit / 2:
+            # 并发较低时延迟不反映容量，不增加上限
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+
+class ConcurrencyLimiter:
+    """
+    一个分组的并发限制和等待队列
+
+    Args:
+        name: 分组名称
+        settings: 配置（见 config.concurrency_settings）
+    """
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.limit = AIMDLimit(settings['initial'], settings['minimum'], settings['maximum'],
+                               settings['target_latency'])
+        self.queue_size = settings['queue_size']
+        self.queue_timeout = settings['queue_timeout']
+        self.in_flight = 0
+        self.waiting = 0
+        self.accepted = 0
+        self.shed = 0
+        self.stale = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        占用一个并发名额，必要时排队等待
+
+        Returns:
+            bool: 是否获得名额（False 表示应当拒绝请求）
+        """
+        with self._condition:
+            if self.in_flight < int(self.limit.limit):
+                self.in_flight += 1
+                self.accepted += 1
+                return True
+            if self.waiting >= self.queue_size:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self.in_flight >= int(self.limit.limit):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.shed += 1
+                        return False
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+            self.accepted += 1
+            return True
+
+    def release(self, latency):
+        """请求完成：按耗时调整上限并唤醒等待的请求"""
+        with self._condition:
+            self.limit.update(latency, self.in_flight)
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def record_stale(self):
+        """记录一次用缓存页面代替拒绝"""
+        with self._condition:
+            self.stale += 1
+
+    def as_dict(self):
+        with self._condition:
+            return {
+                'limit': round(self.limit.limit, 2),
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'accepted': self.accepted,
+                'shed': self.shed,
+                'stale': self.stale,
+            }
+
+
+class LoadSheddingMiddleware:
+    """
+    按分组限制并发的 WSGI 中间件
+
+    Args:
+        wsgi_app: 被包装的 WSGI 应用
+        groups: {分组名称: 配置}
+        retry_after: 拒绝响应的 Retry-After（秒）
+        session_cookie: 会话 Cookie 名称，带会话的请求不使用、也不写入页面缓存
+        stale_cache_size: 缓存的页面响应数量，0 表示不缓存
+        stale_ttl: 页面响应缓存的有效期（秒）
+    """
+
+    def __init__(self, wsgi_app, groups, retry_after=1, session_cookie='session',
+                 stale_cache_size=256, stale_ttl=600):
+        self.wsgi_app = wsgi_app
+        self.limiters = {name: ConcurrencyLimiter(name, settings) for name, settings in groups.items()}
+        self.retry_after = str(retry_after)
+        self.session_cookie = session_cookie
+        self.stale_cache = LRUCache(stale_cache_size) if stale_cache_size else None
+        self.stale_ttl = stale_ttl
+
+    @staticmethod
+    def group(path):
+        """请求路径所属的分组，不限制的路径返回None"""
+        if path.startswith(EXEMPT_PREFIXES):
+            return None
+        for prefix, name in GROUP_PREFIXES:
+            if path.startswith(prefix):
+                return name
+        return 'pages'
+
+    def __call__(self, environ, start_response):
+        limiter = self.limiters.get(self.group(environ.get('PATH_INFO', '')))
+        if limiter is None:
+            return self.wsgi_app(environ, start_response)
+        cache_key = self._stale_key(environ) if limiter.name == 'pages' else None
+        if not limiter.acquire():
+            return self._reject(limiter, cache_key, start_response)
+
+        start = time.monotonic()
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                limiter.release(time.monotonic() - start)
+
+        try:
+            if cache_key is None:
+                return ClosingIterator(self.wsgi_app(environ, start_response), release)
+            return self._call_and_remember(environ, start_response, cache_key, release)
+        except BaseException:
+            release()
+            raise
+
+    def _call_and_remember(self, environ, start_response, cache_key, release):
+        """处理页面请求，并将成功的匿名 HTML 响应保存到页面缓存"""
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers]
+            return start_response(status, headers, exc_info)
+
+        iterable = self.wsgi_app(environ, capture)
+        status, headers = captured or (None, [])
+        names = {name.lower(): value for name, value in headers}
+        if (not status or not status.startswith('200') or 'set-cookie' in names
+                or not names.get('content-type', '').startswith('text/html')
+                or int(names.get('content-length') or STALE_MAX_BYTES + 1) > STALE_MAX_BYTES):
+            return ClosingIterator(iterable, release)
+        try:
+            body = b''.join(iterable)
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+            release()
+        self.stale_cache.set(cache_key, (status, headers, body), ttl=self.stale_ttl)
+        return [body]
+
+    def _stale_key(self, environ):
+        """页面缓存键：地址和响应编码；非 GET 或带会话的请求返回None"""
+        if self.stale_cache is None or environ.get('REQUEST_METHOD') != 'GET':
+            return None
+        if self.session_cookie in parse_cookie(environ):
+            return None
+        encoding = choose_encoding(parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING')))
+        return environ.get('PATH_INFO', ''), environ.get('QUERY_STRING', ''), encoding
+
+    def _reject(self, limiter, cache_key, start_response):
+        """拒绝请求：有缓存的页面时返回缓存，否则返回 503"""
+        cached = self.stale_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            status, headers, body = cached
+            limiter.record_stale()
+            start_response(status, list(headers) + [('X-Load-Shed', 'stale')])
+            return [body]
+        start_response('503 Service Unavailable', [
+            ('Content-Type', 'text/plain; charset=utf-8'),
+            ('Content-Length', '19'),
+            ('Retry-After', self.retry_after),
+        ])
+        return [b'Service Unavailable']
+
+    def snapshot(self):
+        """各分组的当前上限、并发数和计数"""
+        return {name: limiter.as_dict() for name, limiter in self.limiters.items()}
+
+
+def init_app(app):
+    """
+    在最外层包装应用（包括挂载的图片服务），需要在 mount() 之后调用
+
+    Returns:
+        LoadSheddingMiddleware: 中间件，未启用时返回None
+    """
+    if not app.config.get('LOAD_SHEDDING_ENABLED', True):
+        return None
+    middleware = LoadSheddingMiddleware(
+        app.wsgi_app,
+        {
+            'pages': app.config['CONCURRENCY_PAGES'],
+            'images': app.config['CONCURRENCY_IMAGES'],
+            'admin': app.config['CONCURRENCY_ADMIN'],
+        },
+        retry_after=app.config.get('LOAD_SHEDDING_RETRY_AFTER', 1),
+        session_cookie=app.config.get('SESSION_COOKIE_NAME', 'session'),
+        stale_cache_size=app.config.get('LOAD_SHEDDING_STALE_CACHE_SIZE', 256),
+        stale_ttl=app.config.get('LOAD_SHEDDING_STALE_TTL', 600),
+    )
+    app.wsgi_app = middleware
+    app.extensions['load_shedding'] = middleware
+    return middleware
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+版本化数据库迁移模块
+替代根目录下零散的 migrate_*.py 脚本：每个迁移有固定的版本号，
+执行过的版本记录在 schema_migrations 表中，重复执行 flask db-migrate 不会重复迁移
+"""
+from app import db
+from app.models import SchemaMigration
+
+# 已注册的迁移列表，按版本号顺序执行：[(version, description, func), ...]
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    注册迁移函数的装饰器
+
+    Args:
+        version: 迁移版本号，按字符串排序决定执行顺序
+        description: 迁移说明
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def _create_indexes(connection, table, names):
+    """按名称创建模型中声明的索引（已存在则跳过）"""
+    for index in table.indexes:
+        if index.name in names:
+            index.create(connection, checkfirst=True)
+
+
+@migration('0001_hot_query_indexes', '为前台和后台热点查询创建组合索引和部分索引')
+def add_hot_query_indexes(connection):
+    """
+    创建热点查询所需的索引
+    索引定义在 app/models.py 中，这里只负责在已有数据库上创建
+    """
+    from app.models import Category, Product, ProductImage, Contact
+
+    _create_indexes(connection, Category.__table__, {'ix_categories_created_at'})
+    _create_indexes(connection, Product.__table__, {
+        'ix_products_category_status_created',
+        'ix_products_created_at',
+        'ix_products_featured_created',
+        'ix_products_active_created',
+    })
+    _create_indexes(connection, ProductImage.__table__, {'ix_product_images_product_order'})
+    _create_indexes(connection, Contact.__table__, {
+        'ix_contacts_created_at',
+        'ix_contacts_unread_created',
+    })
+
+
+@migration('0002_site_statistics', '创建仪表盘统计计数器表')
+def add_site_statistics(connection):
+    """
+    创建 site_statistics 表
+    计数器的初始值在首次读取时由 app.stats.reconcile() 核对生成
+    """
+    from app.models import SiteStatistic
+
+    SiteStatistic.__table__.create(connection, checkfirst=True)
+
+
+@migration('0003_product_images_cascade', '图库图片外键改为 ON DELETE CASCADE')
+def product_images_cascade(connection):
+    """
+    将 product_images.product_id 外键改为 ON DELETE CASCADE
+    删除产品时由数据库删除图库图片，ORM 不再加载图片数据
+    """
+    from sqlalchemy import inspect
+    from app.models import ProductImage
+
+    inspector = inspect(connection)
+    foreign_keys = [fk for fk in inspector.get_foreign_keys('product_images')
+                    if fk['referred_table'] == 'products']
+    if foreign_keys and all(fk.get('options', {}).get('ondelete', '').upper() == 'CASCADE'
+                            for fk in foreign_keys):
+        return
+
+    if connection.dialect.name == 'postgresql':
+        for fk in foreign_keys:
+            connection.exec_driver_sql(f'ALTER TABLE product_images DROP CONSTRAINT "{fk["name"]}"')
+        connection.exec_driver_sql(
+            'ALTER TABLE product_images ADD CONSTRAINT product_images_product_id_fkey '
+            'FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE CASCADE'
+        )
+    else:
+        # SQLite 不支持修改外键，按官方推荐方式重建表：
+        # 删除旧索引 -> 重命名旧表 -> 按模型创建新表（含索引）-> 复制数据 -> 删除旧表
+        table = ProductImage.__table__
+        for index in inspector.get_indexes('product_images'):
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS "{index["name"]}"')
+        connection.exec_driver_sql('ALTER TABLE product_images RENAME TO product_images_old')
+        table.create(connection)
+        columns = ', '.join(f'"{column.name}"' for column in table.columns)
+        connection.exec_driver_sql(
+            f'INSERT INTO product_images ({columns}) SELECT {columns} FROM product_images_old'
+        )
+        connection.exec_driver_sql('DROP TABLE product_images_old')
+
+
+@migration('0004_product_relations', '创建相关产品推荐表')
+def add_product_relations(connection):
+    """
+    创建 product_relations 表
+    推荐数据由 flask refresh-related 计算生成
+    """
+    from app.models import ProductRelation
+
+    ProductRelation.__table__.create(connection, checkfirst=True)
+
+
+@migration('0005_view_snapshots', '创建页面数据快照表')
+def add_view_snapshots(connection):
+    """
+    创建 view_snapshots 表
+    快照在首次访问时生成，不需要迁移数据
+    """
+    from app.models import ViewSnapshot
+
+    ViewSnapshot.__table__.create(connection, checkfirst=True)
+
+
+@migration('0006_cache_invalidations', '创建缓存失效消息表')
+def add_cache_invalidations(connection):
+    """
+    创建 cache_invalidations 表
+    只在轮询模式（非 PostgreSQL）下使用
+    """
+    from app.models import CacheInvalidation
+
+    CacheInvalidation.__table__.create(connection, checkfirst=True)
+
+
+def applied_versions():
+    """获取已执行的迁移版本集合"""
+    table = SchemaMigration.__table__
+    with db.engine.begin() as connection:
+        table.create(connection, checkfirst=True)
+        return set(connection.execute(db.select(table.c.version)).scalars())
+
+
+def pending_migrations():
+    """获取尚未执行的迁移列表"""
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def upgrade():
+    """
+    执行所有尚未执行的迁移
+    每个迁移在单独的事务中执行，成功后写入 schema_migrations
+
+    Returns:
+        list: 本次执行的迁移版本号列表
+    """
+    executed = []
+    for version, description, func in pending_migrations():
+        with db.engine.begin() as connection:
+            func(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version,
+                description=description
+            ))
+        executed.append(version)
+    return executed
@@ -29,7 +29,13 @@ class Category(db.Model):
     updated_at = db.Column(db.DateTime, default=china_now, onupdate=china_now)
     
     # 关系：一个分类可以有多个产品
-    products = db.relationship('Product', backref='category', lazy='dynamic')
+    # passive_deletes='all'：删除分类时不加载产品来置空外键，由数据库外键约束阻止删除仍有产品的分类
+    products = db.relationship('Product', backref='category', lazy='dynamic', passive_deletes='all')
+    
+    # 索引：前台导航按创建时间排序读取分类
+    __table_args__ = (
+        db.Index('ix_categories_created_at', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<Category {self.name}>'
@@ -45,8 +51,8 @@ class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)  # 产品描述
-    # 使用BYTEA类型存储主图片
-    main_image = db.Column(db.LargeBinary)
+    # 使用BYTEA类型存储主图片（延迟加载：查询产品时不读取图片数据，判断是否有图片使用 has_main_image）
+    main_image = db.deferred(db.Column(db.LargeBinary))
     main_image_filename = db.Column(db.String(255))
     main_image_mimetype = db.Column(db.String(100))
     
@@ -87,7 +93,17 @@ class Product(db.Model):
     updated_at = db.Column(db.DateTime, default=china_now, onupdate=china_now)
     
     # 关系：一个产品可以有多张图片
-    images = db.relationship('ProductImage', backref='product', lazy='dynamic', cascade='all, delete-orphan')
+    # passive_deletes=True：删除产品时不加载图库图片（及其图片数据），由数据库 ON DELETE CASCADE 删除
+    images = db.relationship('ProductImage', backref='product', lazy='dynamic', cascade='all, delete-orphan',
+                             passive_deletes=True)
+    
+    # 索引：对应前台热点查询（部分索引的条件在类定义之后补充，见文件末尾）
+    __table_args__ = (
+        # 产品列表按分类筛选、相关产品查询：category_id = ? AND status = ? ORDER BY created_at DESC
+        db.Index('ix_products_category_status_created', 'category_id', 'status', 'created_at'),
+        # 后台产品列表和仪表盘最近产品：ORDER BY created_at DESC
+        db.Index('ix_products_created_at', 'created_at'),
+    )
     
     def __repr__(self):
         return f'<Product {self.name}>'
@@ -149,22 +165,27 @@ class ProductImage(db.Model):
     __tablename__ = 'product_images'
     
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    # 使用BYTEA类型存储图片数据
-    image_data = db.Column(db.LargeBinary)
+    # 使用BYTEA类型存储图片数据（延迟加载，判断是否有图片使用 has_image）
+    image_data = db.deferred(db.Column(db.LargeBinary))
     filename = db.Column(db.String(255))
     mimetype = db.Column(db.String(100))
     
     # 排序字段
     order = db.Column(db.Integer, default=0)
     
-    # 产品外键
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    # 产品外键（删除产品时由数据库级联删除图库图片）
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
     
     # 注意：product 关系由 Product.images 的 backref 自动创建，不需要在这里重复定义
     
     # 时间戳
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 索引：产品详情页按顺序读取图库图片
+    __table_args__ = (
+        db.Index('ix_product_images_product_order', 'product_id', 'order'),
+    )
+    
     def __repr__(self):
         return f'<ProductImage {self.filename} for product {self.product_id}>'
 
@@ -233,6 +254,11 @@ class Contact(db.Model):
     # 时间戳
     created_at = db.Column(db.DateTime, default=china_now)
     
+    # 索引：后台联系表单列表按时间倒序（未读消息的部分索引见文件末尾）
+    __table_args__ = (
+        db.Index('ix_contacts_created_at', 'created_at'),
+    )
+    
     def __repr__(self):
         return f'<Contact {self.name} - {self.subject}>'
 
@@ -248,7 +274,7 @@ class PageContent(db.Model):
     page_key = db.Column(db.String(100), nullable=False, unique=True)  # 页面标识，如 'home_hero_title'
     content_type = db.Column(db.String(50), nullable=False)  # 内容类型：text, html, image, json
     content_value = db.Column(db.Text)  # 内容值（文本、HTML或JSON）
-    image_data = db.Column(db.LargeBinary)  # 图片数据（如果是图片类型）
+    image_data = db.deferred(db.Column(db.LargeBinary))  # 图片数据（如果是图片类型，延迟加载）
     image_filename = db.Column(db.String(255))
     image_mimetype = db.Column(db.String(100))
     description = db.Column(db.String(200))  # 内容描述，用于后台显示
@@ -278,6 +304,111 @@ class PageContent(db.Model):
     def get_image_url(page_key):
         """获取图片URL"""
         content = PageContent.query.filter_by(page_key=page_key).first()
-        if content and content.image_data:
+        if content and content.has_image:
             return f'/admin/page-content/image/{content.id}'
-        return None
\ No newline at end of file
+        return None
+
+
+class SchemaMigration(db.Model):
+    """
+    数据库迁移记录模型
+    记录已经执行过的版本化迁移（见 app/migrations.py）
+    """
+    __tablename__ = 'schema_migrations'
+    
+    version = db.Column(db.String(50), primary_key=True)  # 迁移版本号，如 '0001_hot_query_indexes'
+    description = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=china_now)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
+
+
+class SiteStatistic(db.Model):
+    """
+    站点统计计数器模型
+    由后台写操作和联系表单在同一事务中增量维护，避免仪表盘每次加载都执行 COUNT(*)（见 app/stats.py）
+    """
+    __tablename__ = 'site_statistics'
+    
+    key = db.Column(db.String(50), primary_key=True)  # 计数器名称，如 'product_count'
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    # 时间戳
+    updated_at = db.Column(db.DateTime, default=china_now, onupdate=china_now)
+    reconciled_at = db.Column(db.DateTime)  # 最近一次与实际数据核对的时间
+    
+    def __repr__(self):
+        return f'<SiteStatistic {self.key}={self.value}>'
+
+
+class ProductRelation(db.Model):
+    """
+    相关产品推荐模型
+    每个产品按相似度排序的前K个相关产品，由 app/recommendations.py 离线计算，
+    产品详情页按主键 (product_id, rank) 一次索引查询取出
+    """
+    __tablename__ = 'product_relations'
+    
+    # 删除产品时由数据库删除它的推荐列表
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)  # 排名，从0开始
+    # 被推荐的产品ID（不设外键：删除产品后由增量刷新找到并重新计算引用它的推荐列表）
+    related_id = db.Column(db.Integer, nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)  # 余弦相似度
+    
+    def __repr__(self):
+        return f'<ProductRelation {self.product_id}#{self.rank} -> {self.related_id}>'
+
+
+class ViewSnapshot(db.Model):
+    """
+    页面数据快照模型
+    页面渲染所需数据的预计算结果（JSON），由 app/snapshots.py 读写，所有工作进程共享
+    """
+    __tablename__ = 'view_snapshots'
+    
+    key = db.Column(db.String(100), primary_key=True)  # 快照标识，如 'home'、'product:5'
+    # 失效次数：每次失效加1，生成快照时只有代数未变才写入，避免并发生成时写回过期数据
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    data = db.Column(db.Text)  # 快照内容（JSON），为空表示已失效、等待重新生成
+    built_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<ViewSnapshot {self.key}@{self.generation}>'
+
+
+class CacheInvalidation(db.Model):
+    """
+    缓存失效消息模型
+    不支持 LISTEN/NOTIFY 的数据库（如 SQLite）使用轮询方式在工作进程之间传递失效消息（见 app/invalidation.py），
+    记录保留10分钟后清理
+    """
+    __tablename__ = 'cache_invalidations'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    payload = db.Column(db.Text, nullable=False)  # 消息内容（JSON）
+    created_at = db.Column(db.DateTime, default=china_now, index=True)
+    
+    def __repr__(self):
+        return f'<CacheInvalidation {self.id}>'
+
+
+# 是否有图片：查询时计算 IS NOT NULL，列表和模板判断是否显示图片时不读取图片数据
+Product.has_main_image = db.column_property(Product.__table__.c.main_image.isnot(None))
+ProductImage.has_image = db.column_property(ProductImage.__table__.c.image_data.isnot(None))
+PageContent.has_image = db.column_property(PageContent.__table__.c.image_data.isnot(None))
+
+# 部分索引（PostgreSQL 和 SQLite 均支持），条件中需要引用列对象，因此在类定义之后声明
+# 首页推荐产品：status = true AND is_featured = true ORDER BY created_at DESC
+db.Index('ix_products_featured_created', Product.created_at,
+         postgresql_where=db.and_(Product.status == True, Product.is_featured == True),
+         sqlite_where=db.and_(Product.status == True, Product.is_featured == True))
+# 已上架产品列表、首页补充产品：status = true ORDER BY created_at DESC
+db.Index('ix_products_active_created', Product.created_at,
+         postgresql_where=Product.status == True,
+         sqlite_where=Product.status == True)
+# 未读联系表单：is_read = false ORDER BY created_at DESC
+db.Index('ix_contacts_unread_created', Contact.created_at,
+         postgresql_where=Contact.is_read == False,
+         sqlite_where=Contact.is_read == False)
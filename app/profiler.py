@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+请求采样分析模块
+线上某个页面变慢时，不需要重新部署就可以分析单个请求的耗时分布：
+
+- 触发方式：已登录的管理员在地址后加 ?_profile=1，或请求头 X-Profile 等于 PROFILER_TOKEN
+  （命令行 curl 使用）；也可以按 PROFILER_SAMPLE_RATE 的比例随机分析请求
+- 分析期间由一个后台采样线程每隔 PROFILER_INTERVAL 秒读取请求线程的调用栈（sys._current_frames），
+  请求本身不插桩，开销只有采样线程
+- 结果按 collapsed stack 格式（每行「外层;...;内层 次数」）写入 PROFILER_DIR，可以直接用
+  flamegraph.pl、speedscope 等工具生成火焰图；目录中最多保留 PROFILER_MAX_FILES 个文件
+- 后台 /admin/profiles 按时间列出最近的分析结果（路由、耗时、采样数）
+
+只分析经过 Flask 的请求，挂载的图片服务（app/image_server.py）不在其中
+"""
+import functools
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, g, request
+
+from app.models import china_now
+
+# 分析结果文件名：时间_路由_耗时ms_采样数.folded
+FILE_PATTERN = re.compile(r'^(\d{8}T\d{6}\d{6})_(.+)_(\d+)ms_(\d+)\.folded$')
+# 项目根目录，调用栈中的文件路径相对于它显示
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@functools.lru_cache(maxsize=4096)
+def _short_path(filename):
+    """项目内的文件显示相对路径，第三方库显示包名开始的路径"""
+    if filename.startswith(PROJECT_ROOT + os.sep):
+        return os.path.relpath(filename, PROJECT_ROOT).replace(os.sep, '/')
+    parts = filename.replace(os.sep, '/').split('/')
+    for marker in ('site-packages', 'dist-packages'):
+        if marker in parts:
+            return '/'.join(parts[parts.index(marker) + 1:])
+    return '/'.join(parts[-2:])
+
+
+def _frame_label(code):
+    """调用栈中一帧的名称：函数名（文件:函数首行）"""
+    return f'{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Profile:
+    """一个请求的采样结果"""
+
+    def __init__(self, thread_id, endpoint):
+        self.thread_id = thread_id
+        self.endpoint = endpoint
+        # 分析结果的标识（开始时间），也是文件名的前缀
+        self.id = china_now().strftime('%Y%m%dT%H%M%S%f')
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+        self.samples = 0
+
+    def add(self, frame):
+        """记录一次采样（由采样线程调用）"""
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        self.stacks[';'.join(labels)] += 1
+        self.samples += 1
+
+    def collapsed(self):
+        """collapsed stack 格式的文本"""
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class Sampler:
+    """
+    后台采样线程：有正在分析的请求时按间隔采样，没有时等待
+
+    Args:
+        interval: 采样间隔（秒）
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def start(self, profile):
+        """开始采样一个请求线程"""
+        with self._lock:
+            self._profiles[profile.thread_id] = profile
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def stop(self, profile):
+        """停止采样，返回后采样线程不会再修改 profile（正在进行的一轮采样在锁内完成）"""
+        with self._lock:
+            self._profiles.pop(profile.thread_id, None)
+
+    def _run(self):
+        while True:
+            # 整轮采样都持有锁：stop() 会等这一轮结束，之后写入结果时 stacks 不会再变化
+            with self._lock:
+                profiles = list(self._profiles.values())
+                if not profiles:
+                    self._wakeup.clear()
+                else:
+                    frames = sys._current_frames()
+                    for profile in profiles:
+                        frame = frames.get(profile.thread_id)
+                        if frame is not None:
+                            profile.add(frame)
+                    del frames
+            if not profiles:
+                self._wakeup.wait()
+                continue
+            time.sleep(self.interval)
+
+
+_sampler = Sampler()
+
+
+def profile_dir(app=None):
+    """分析结果目录（绝对路径）"""
+    app = app or current_app
+    return os.path.join(PROJECT_ROOT, app.config.get('PROFILER_DIR') or 'var/profiles')
+
+
+def _requested():
+    """请求是否要求分析：令牌请求头，或管理员的 ?_profile=1"""
+    token = current_app.config.get('PROFILER_TOKEN')
+    header = request.headers.get('X-Profile')
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        return True
+    if request.args.get('_profile') == '1':
+        from flask_login import current_user
+        return current_user.is_authenticated and current_user.is_admin
+    return False
+
+
+def write_profile(profile, duration, directory, max_files):
+    """
+    写入分析结果并清理超出数量的旧文件
+
+    Returns:
+        str: 文件名
+    """
+    os.makedirs(directory, exist_ok=True)
+    endpoint = re.sub(r'[^\w.-]', '-', profile.endpoint or 'unknown')
+    name = f'{profile.id}_{endpoint}_{int(duration * 1000)}ms_{profile.samples}.folded'
+    temp_path = os.path.join(directory, f'.{name}.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(profile.collapsed())
+    os.replace(temp_path, os.path.join(directory, name))
+    existing = sorted(entry for entry in os.listdir(directory) if FILE_PATTERN.match(entry))
+    for old in existing[:max(0, len(existing) - max_files)]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except OSError:
+            pass
+    return name
+
+
+def list_profiles(directory, limit=100):
+    """
+    最近的分析结果
+
+    Returns:
+        list: [{'name', 'time', 'endpoint', 'duration_ms', 'samples', 'size'}]，按时间倒序
+    """
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = FILE_PATTERN.match(name)
+        if match is None:
+            continue
+        profiles.append({
+            'name': name,
+            'time': datetime.strptime(match.group(1), '%Y%m%dT%H%M%S%f'),
+            'endpoint': match.group(2),
+            'duration_ms': int(match.group(3)),
+            'samples': int(match.group(4)),
+            'size': os.path.getsize(os.path.join(directory, name)),
+        })
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+def init_app(app):
+    """注册请求钩子，开始和结束分析"""
+    if not app.config.get('PROFILER_ENABLED', True):
+        return
+    _sampler.interval = app.config.get('PROFILER_INTERVAL', 0.005)
+    sample_rate = app.config.get('PROFILER_SAMPLE_RATE', 0.0)
+
+    @app.before_request
+    def _start_profile():
+        explicit = _requested()
+        if not explicit and not (sample_rate and random.random() < sample_rate):
+            return
+        profile = Profile(threading.get_ident(), request.endpoint)
+        g.profile, g.profile_explicit = profile, explicit
+        _sampler.start(profile)
+
+    @app.after_request
+    def _profile_header(response):
+        profile = g.get('profile')
+        if profile is not None and g.get('profile_explicit'):
+            # 文件在请求结束时写入，文件名以该标识开头
+            response.headers['X-Profile-Id'] = profile.id
+        return response
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        _sampler.stop(profile)
+        duration = time.perf_counter() - profile.started
+        try:
+            write_profile(profile, duration, profile_dir(app), app.config.get('PROFILER_MAX_FILES', 200))
+        except OSError as e:
+            logging.error(f'写入请求分析结果失败: {str(e)}')
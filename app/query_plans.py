@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询执行计划检查模块
+对前台和后台的热点查询执行 EXPLAIN，发现退化为全表扫描的查询
+支持 PostgreSQL（EXPLAIN (FORMAT JSON)）和 SQLite（EXPLAIN QUERY PLAN）
+"""
+import re
+
+from sqlalchemy import select, func
+
+from app import db
+from app.models import Category, Product, ProductImage, Contact
+
+
+def hot_queries():
+    """
+    热点查询列表，与 app/routes.py、app/admin.py 中的查询保持一致
+
+    Returns:
+        dict: {查询名称: SQLAlchemy Select 语句}
+    """
+    return {
+        # 首页推荐产品
+        'home_featured': select(Product).filter_by(status=True, is_featured=True)
+            .order_by(Product.created_at.desc()).limit(6),
+        # 首页推荐不足时用最新产品补充
+        'home_latest': select(Product).filter_by(status=True).filter(~Product.id.in_([0]))
+            .order_by(Product.created_at.desc()).limit(6),
+        # 导航栏分类
+        'nav_categories': select(Category).order_by(Category.created_at),
+        # 产品列表（全部分类）
+        'products_all': select(Product).filter_by(status=True)
+            .order_by(Product.created_at.desc()).limit(9).offset(0),
+        # 产品列表（按分类筛选）
+        'products_by_category': select(Product).filter_by(status=True, category_id=1)
+            .order_by(Product.created_at.desc()).limit(9).offset(0),
+        # 产品详情页的相关产品
+        'related_products': select(Product).filter_by(category_id=1, status=True)
+            .filter(Product.id != 1).order_by(Product.created_at.desc()).limit(4),
+        # 产品详情页的图库图片
+        'product_gallery': select(ProductImage).filter_by(product_id=1).order_by(ProductImage.order),
+        # 首页推荐数量上限检查
+        'featured_count': select(func.count()).select_from(Product).filter_by(is_featured=True, status=True),
+        # 后台仪表盘最近产品
+        'admin_recent_products': select(Product).order_by(Product.created_at.desc()).limit(5),
+        # 后台联系表单列表
+        'contacts_inbox': select(Contact).order_by(Contact.created_at.desc()),
+        # 后台仪表盘最近未读联系表单
+        'contacts_unread': select(Contact).filter_by(is_read=False)
+            .order_by(Contact.created_at.desc()).limit(5),
+        # 未读联系表单数量
+        'contacts_unread_count': select(func.count()).select_from(Contact).filter_by(is_read=False),
+    }
+
+
+def _compile(statement, dialect):
+    """将语句编译为带字面量参数的SQL字符串"""
+    return str(statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+
+
+def _explain_sqlite(connection, sql):
+    """
+    SQLite执行计划
+    'SCAN products' 表示全表扫描；'SCAN products USING INDEX ...' 为按索引顺序扫描，不算退化
+    'USE TEMP B-TREE FOR ORDER BY' 表示排序没有用上索引
+    """
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql).fetchall()
+    plan = [row[-1] for row in rows]
+    problems = []
+    for detail in plan:
+        if re.match(r'^SCAN \w+$', detail.strip()):
+            problems.append(f'全表扫描: {detail}')
+        elif 'USE TEMP B-TREE FOR ORDER BY' in detail:
+            problems.append(f'排序未使用索引: {detail}')
+    return plan, problems
+
+
+def _walk_pg_plan(node):
+    """遍历PostgreSQL JSON执行计划的所有节点"""
+    yield node
+    for child in node.get('Plans', []):
+        yield from _walk_pg_plan(child)
+
+
+def _explain_postgresql(connection, sql):
+    """
+    PostgreSQL执行计划
+    关闭 enable_seqscan 后，如果仍然出现 Seq Scan，说明没有可用的索引
+    """
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    result = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + sql).scalar()
+    root = result[0]['Plan']
+    plan = []
+    problems = []
+    for node in _walk_pg_plan(root):
+        detail = node['Node Type']
+        if node.get('Relation Name'):
+            detail += f" on {node['Relation Name']}"
+        if node.get('Index Name'):
+            detail += f" using {node['Index Name']}"
+        plan.append(detail)
+        if node['Node Type'] == 'Seq Scan':
+            problems.append(f'全表扫描: {detail}')
+    return plan, problems
+
+
+def check_query_plans(engine=None):
+    """
+    对所有热点查询执行EXPLAIN
+
+    Args:
+        engine: 数据库引擎，默认为当前应用的 db.engine
+
+    Returns:
+        dict: {查询名称: {'sql': SQL, 'plan': [计划行], 'problems': [问题描述]}}
+    """
+    engine = engine or db.engine
+    explain = _explain_postgresql if engine.dialect.name == 'postgresql' else _explain_sqlite
+    report = {}
+    for name, statement in hot_queries().items():
+        sql = _compile(statement, engine.dialect)
+        # 每条查询单独开启事务，SET LOCAL 只在事务内生效，结束后回滚
+        with engine.connect() as connection:
+            with connection.begin() as transaction:
+                plan, problems = explain(connection, sql)
+                transaction.rollback()
+        report[name] = {'sql': sql, 'plan': plan, 'problems': problems}
+    return report
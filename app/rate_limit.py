@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+图片访问限流与防盗链模块
+/image/ 下的产品图片公开访问且由数据库提供，被第三方页面直接引用（盗链）时消耗的是本站的数据库带宽。
+这里在图片服务处理请求之前检查：
+
+- 令牌桶限流：每个客户端 IP 一个桶（IMAGE_RATE_LIMIT_IP_*），来自其他站点的请求按引用域名再共用一个桶
+  （IMAGE_RATE_LIMIT_REFERER_*），超出时返回 429 + Retry-After；本站页面引用的图片（Referer 为本站）
+  一次页面加载就有几十张，每个 IP 使用按页面规模设置的单独的桶（IMAGE_RATE_LIMIT_PAGE_*）
+- 已登录管理员的会话（后台列表页有上百张缩略图）不限流：登录时在签名的会话 Cookie 中写入
+  SESSION_EXEMPT_KEY，这里只校验 Cookie 签名，不查询数据库
+- 防盗链：Referer 不属于本站（请求的 Host、SITE_URL 和 IMAGE_ALLOWED_REFERERS）时按 IMAGE_HOTLINK_POLICY 处理：
+  limit（按引用域名限流，默认）、block（返回 403）、off（不区分）；没有 Referer 的请求（直接访问、
+  隐私设置）只按 IP 限流
+- 签名地址：需要在外部站点嵌入的图片可以用 flask sign-image-url 生成带有效期的签名地址，
+  签名有效的请求不做防盗链检查；签名无效或过期返回 403
+
+令牌桶的存储：memory（每个工作进程独立）或 sqlite（同一主机的所有工作进程共用 RATE_LIMIT_SQLITE_PATH 文件）
+"""
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from flask.sessions import SecureCookieSessionInterface
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.http import parse_cookie
+
+# 图片类型对应的前台路由
+IMAGE_ENDPOINTS = {
+    'product': 'main.get_product_image',
+    'gallery': 'main.get_gallery_image',
+    'page-content': 'main.get_page_content_image',
+}
+# 进程内调用方（如静态导出）在 WSGI environ 中设置该键跳过检查，HTTP 请求无法设置
+EXEMPT_ENVIRON_KEY = 'app.rate_limit.exempt'
+# 管理员登录时写入会话的键（见 app/auth.py），带有该键的会话不限流
+SESSION_EXEMPT_KEY = 'image_rate_limit_exempt'
+# 签名的字节数（base64url 编码后约 22 个字符）
+SIGNATURE_BYTES = 16
+# 内存令牌桶数量超过该值时清理已经回满的桶
+MEMORY_PRUNE_SIZE = 100000
+# SQLite 令牌桶：每多少次请求清理一次长期未使用的桶
+SQLITE_PRUNE_EVERY = 1000
+
+
+class MemoryBackend:
+    """进程内的令牌桶"""
+
+    def __init__(self):
+        # {键: (令牌数, 更新时间, 回满所需秒数)}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1.0):
+        """
+        从桶中取出令牌
+
+        Args:
+            key: 桶的键
+            capacity: 桶容量（允许的突发数量）
+            rate: 每秒补充的令牌数
+            cost: 本次消耗的令牌数
+
+        Returns:
+            float: 0 表示允许，否则为需要等待的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, None))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < cost:
+                self._buckets[key] = (tokens, now, capacity / rate)
+                return (cost - tokens) / rate
+            self._buckets[key] = (tokens - cost, now, capacity / rate)
+            if len(self._buckets) > MEMORY_PRUNE_SIZE:
+                self._prune(now)
+        return 0.0
+
+    def _prune(self, now):
+        """
+        删除已经回满的桶（再次使用时按满桶处理，结果相同）
+        不同的桶（IP、引用域名）容量和补充速度不同，按各自记录的回满时间判断
+        """
+        for key in [k for k, (_, updated, refill_seconds) in self._buckets.items() if now - updated > refill_seconds]:
+            del self._buckets[key]
+
+
+class SQLiteBackend:
+    """
+    保存在 SQLite 文件中的令牌桶，同一主机上的多个工作进程共用
+    每次取令牌在一个 IMMEDIATE 事务中读取并更新，数据库出错时放行请求
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        """每个进程的每个线程一个连接（fork 出的进程不能复用父进程的连接）"""
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS token_buckets '
+                               '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            self._local.pid, self._local.connection = pid, connection
+        return self._local.connection
+
+    def take(self, key, capacity, rate, cost=1.0):
+        """与 MemoryBackend.take 相同"""
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tokens, updated FROM token_buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0 if tokens >= cost else (cost - tokens) / rate
+                if not wait:
+                    tokens -= cost
+                connection.execute('INSERT OR REPLACE INTO token_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                   (key, tokens, now))
+                if random.randrange(SQLITE_PRUNE_EVERY) == 0:
+                    connection.execute('DELETE FROM token_buckets WHERE updated < ?', (now - 3600,))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            logging.warning(f'限流存储不可用，放行请求: {str(e)}')
+            return 0.0
+        return wait
+
+
+def _session_serializer(secret_key):
+    """与 Flask 默认会话接口（SecureCookieSessionInterface）相同参数的 Cookie 签名序列化器"""
+    interface = SecureCookieSessionInterface()
+    return URLSafeTimedSerializer(secret_key, salt=interface.salt, serializer=interface.serializer,
+                                  signer_kwargs={'key_derivation': interface.key_derivation,
+                                                 'digest_method': interface.digest_method})
+
+
+def _signature(secret_key, kind, object_id, expires):
+    """签名：HMAC-SHA256(类型:ID:过期时间)"""
+    message = f'{kind}:{object_id}:{expires}'.encode('utf-8')
+    digest = hmac.new(secret_key.encode('utf-8'), message, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def sign_query(secret_key, kind, object_id, expires_in):
+    """
+    生成签名地址的查询参数
+
+    Args:
+        secret_key: 签名密钥（SECRET_KEY）
+        kind: 图片类型：product、gallery、page-content
+        object_id: 记录ID
+        expires_in: 有效期（秒）
+
+    Returns:
+        dict: {'expires': 过期时间戳, 'sig': 签名}
+    """
+    expires = int(time.time() + expires_in)
+    return {'expires': expires, 'sig': _signature(secret_key, kind, object_id, expires)}
+
+
+def signed_image_url(kind, object_id, expires_in=None):
+    """
+    生成带签名的图片绝对地址（需要在请求上下文或 SERVER_NAME 已配置的应用上下文中调用）
+
+    Args:
+        kind: 图片类型
+        object_id: 记录ID
+        expires_in: 有效期（秒），默认 IMAGE_URL_SIGNATURE_TTL
+    """
+    from flask import current_app, url_for
+
+    expires_in = expires_in or current_app.config.get('IMAGE_URL_SIGNATURE_TTL', 30 * 86400)
+    query = sign_query(current_app.config['SECRET_KEY'], kind, object_id, expires_in)
+    id_argument = {'product': 'product_id', 'gallery': 'image_id', 'page-content': 'content_id'}[kind]
+    return url_for(IMAGE_ENDPOINTS[kind], _external=True, **{id_argument: object_id}) + '?' + urlencode(query)
+
+
+class ImageGuard:
+    """
+    图片请求的限流、防盗链和签名检查
+
+    Args:
+        config: 配置（Flask app.config 或同名键的字典）
+        backend: 令牌桶存储，默认按 RATE_LIMIT_BACKEND 创建
+    """
+
+    def __init__(self, config, backend=None):
+        self.secret_key = config.get('SECRET_KEY') or ''
+        self.ip_limit = (config.get('IMAGE_RATE_LIMIT_IP_BURST', 60), config.get('IMAGE_RATE_LIMIT_IP_RATE', 10.0))
+        self.referer_limit = (config.get('IMAGE_RATE_LIMIT_REFERER_BURST', 30),
+                              config.get('IMAGE_RATE_LIMIT_REFERER_RATE', 1.0))
+        self.page_limit = (config.get('IMAGE_RATE_LIMIT_PAGE_BURST', 300),
+                           config.get('IMAGE_RATE_LIMIT_PAGE_RATE', 30.0))
+        self.hotlink_policy = (config.get('IMAGE_HOTLINK_POLICY') or 'limit').lower()
+        self.trusted_proxies = config.get('RATE_LIMIT_TRUSTED_PROXIES', 0)
+        site_host = urlsplit(config.get('SITE_URL') or '').hostname
+        self.allowed_hosts = {host.strip().lower() for host in (config.get('IMAGE_ALLOWED_REFERERS') or '').split(',')
+                              if host.strip()}
+        if site_host:
+            self.allowed_hosts.add(site_host.lower())
+        if backend is None:
+            if (config.get('RATE_LIMIT_BACKEND') or 'memory') == 'sqlite':
+                backend = SQLiteBackend(config.get('RATE_LIMIT_SQLITE_PATH') or 'var/ratelimit.db')
+            else:
+                backend = MemoryBackend()
+        self.backend = backend
+        self.session_cookie = config.get('SESSION_COOKIE_NAME') or 'session'
+        lifetime = config.get('PERMANENT_SESSION_LIFETIME') or 31 * 86400
+        self.session_max_age = lifetime.total_seconds() if hasattr(lifetime, 'total_seconds') else lifetime
+        self._session_serializer = _session_serializer(self.secret_key) if self.secret_key else None
+
+    def admin_session(self, environ):
+        """请求是否带有管理员登录时写入的会话（与 Flask 相同的方式校验会话 Cookie 的签名和有效期）"""
+        if self._session_serializer is None:
+            return False
+        value = parse_cookie(environ.get('HTTP_COOKIE', '')).get(self.session_cookie)
+        if not value:
+            return False
+        try:
+            data = self._session_serializer.loads(value, max_age=self.session_max_age)
+        except BadSignature:
+            return False
+        return bool(data.get(SESSION_EXEMPT_KEY)) and '_user_id' in data
+
+    def client_ip(self, environ):
+        """客户端 IP：经过 RATE_LIMIT_TRUSTED_PROXIES 层代理时取 X-Forwarded-For 中对应的地址"""
+        if self.trusted_proxies:
+            forwarded = [part.strip() for part in environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if part.strip()]
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies]
+        return environ.get('REMOTE_ADDR', '')
+
+    def foreign_referer(self, environ):
+        """来自其他站点时返回引用域名，本站或没有 Referer 时返回None"""
+        referer = environ.get('HTTP_REFERER')
+        if not referer:
+            return None
+        host = (urlsplit(referer).hostname or '').lower()
+        own_host = (environ.get('HTTP_HOST') or '').split(':')[0].lower()
+        if not host or host == own_host or host in self.allowed_hosts:
+            return None
+        return host
+
+    def verify_signature(self, environ, kind, object_id):
+        """
+        检查签名参数
+
+        Returns:
+            bool: True 签名有效，False 签名无效或过期，None 没有签名参数
+        """
+        query = parse_qs(environ.get('QUERY_STRING', ''))
+        if 'sig' not in query and 'expires' not in query:
+            return None
+        try:
+            expires = int(query['expires'][0])
+            signature = query['sig'][0]
+        except (KeyError, ValueError):
+            return False
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(signature, _signature(self.secret_key, kind, object_id, expires))
+
+    def check(self, environ, kind, object_id):
+        """
+        检查图片请求
+
+        Returns:
+            tuple: 拒绝时返回 (状态, 响应头列表)，允许时返回None
+        """
+        if environ.get(EXEMPT_ENVIRON_KEY) or self.admin_session(environ):
+            return None
+        signed = self.verify_signature(environ, kind, object_id)
+        if signed is False:
+            return '403 Forbidden', []
+        referer = self.foreign_referer(environ)
+        if not signed and self.hotlink_policy != 'off' and referer is not None:
+            if self.hotlink_policy == 'block':
+                return '403 Forbidden', []
+            wait = self.backend.take(f'ref:{referer}', *self.referer_limit)
+            if wait:
+                return self._too_many(wait)
+        if referer is None and environ.get('HTTP_REFERER'):
+            # 本站页面加载的图片；Referer 可以伪造，因此仍然按 IP 限流，只是容量按页面规模设置
+            wait = self.backend.take(f'page:{self.client_ip(environ)}', *self.page_limit)
+        else:
+            wait = self.backend.take(f'ip:{self.client_ip(environ)}', *self.ip_limit)
+        if wait:
+            return self._too_many(wait)
+        return None
+
+    @staticmethod
+    def _too_many(wait):
+        return '429 Too Many Requests', [('Retry-After', str(max(1, int(wait + 0.999))))]
+
+
+def init_app(app):
+    """
+    创建图片请求检查器（挂载的图片服务使用），并为前台蓝图中的图片路由注册检查钩子
+
+    Returns:
+        ImageGuard: 检查器，未启用时返回None
+    """
+    if not app.config.get('IMAGE_RATE_LIMIT_ENABLED', True):
+        return None
+    guard = ImageGuard(app.config)
+    app.extensions['image_guard'] = guard
+    kinds = {endpoint: kind for kind, endpoint in IMAGE_ENDPOINTS.items()}
+
+    @app.before_request
+    def _guard_image_routes():
+        from flask import request, Response
+        kind = kinds.get(request.endpoint)
+        if kind is None:
+            return None
+        object_id = next(iter((request.view_args or {}).values()), None)
+        rejected = guard.check(request.environ, kind, object_id)
+        if rejected is not None:
+            status, headers = rejected
+            return Response(status=status, headers=headers)
+        return None
+
+    return guard
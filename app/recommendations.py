@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+相关产品推荐模块
+原来的产品详情页每次访问都查询「同分类最新的4个产品」。这里为每个产品离线计算按相似度排序的前K个相关产品，
+写入 product_relations 表，随产品目录一起读入内存（见 app/catalog.py），详情页不再查询
+
+特征向量（特征哈希到固定维度，各组分别归一化后按权重合并）：
+- 分类、品牌
+- 技术规格的参数名（technical_specs 的键）
+- 产品优势（每行一个）
+- 产品名称的字符 2-gram / 3-gram（中文名称没有空格分词）
+
+相似度为余弦相似度，分批用 NumPy 矩阵乘法计算，只推荐已上架的产品
+
+增量刷新：产品新增、修改、删除后只重新计算受影响的推荐列表——变化的产品本身、
+推荐列表中引用了它们的产品、以及与它们的相似度超过当前第K名的产品
+写操作提交后由后台线程执行；flask refresh-related 计算还没有推荐列表的产品，加 --full 全量计算
+"""
+import json
+import logging
+import queue
+import re
+import threading
+import zlib
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from app import catalog, db
+from app.models import Product, ProductRelation
+
+# 特征哈希的维度
+FEATURE_DIM = 4096
+# 每批计算相似度的产品数量
+BATCH_SIZE = 256
+# 各组特征的权重
+FEATURE_WEIGHTS = {
+    'category': 3.0,
+    'brand': 2.0,
+    'spec': 1.0,
+    'advantage': 1.0,
+    'name': 1.5,
+}
+# 参与计算的产品列（不读取图片）
+FEATURE_COLUMNS = (
+    Product.id, Product.name, Product.brand, Product.category_id,
+    Product.technical_specs, Product.advantages, Product.status, Product.created_at,
+)
+
+# 待刷新的产品ID队列：(应用实例, 产品ID集合)
+_refresh_queue = queue.Queue()
+_refresh_thread = None
+_refresh_lock = threading.Lock()
+
+
+def _normalize_text(value):
+    """统一大小写并去掉空白和常见标点"""
+    return re.sub(r'[\s\-_/,，、。:：;；()（）]+', '', (value or '').lower())
+
+
+def _name_ngrams(name):
+    """名称的字符 2-gram 和 3-gram"""
+    text = _normalize_text(name)
+    grams = [text[i:i + n] for n in (2, 3) for i in range(len(text) - n + 1)]
+    return grams or ([text] if text else [])
+
+
+def extract_features(row):
+    """
+    提取产品的特征（按组）
+
+    Returns:
+        dict: {特征组: [特征字符串]}
+    """
+    specs = []
+    if row.technical_specs:
+        try:
+            parsed = json.loads(row.technical_specs)
+            if isinstance(parsed, dict):
+                specs = [_normalize_text(key) for key in parsed]
+        except ValueError:
+            pass
+    advantages = [_normalize_text(line) for line in (row.advantages or '').split('\n') if line.strip()]
+    return {
+        'category': [str(row.category_id)] if row.category_id is not None else [],
+        'brand': [_normalize_text(row.brand)] if row.brand and row.brand.strip() else [],
+        'spec': [s for s in specs if s],
+        'advantage': [a for a in advantages if a],
+        'name': _name_ngrams(row.name),
+    }
+
+
+def _feature_index(group, feature):
+    """特征哈希：使用稳定的 CRC32（Python 内置 hash 每个进程不同）"""
+    return zlib.crc32(f'{group}:{feature}'.encode('utf-8')) % FEATURE_DIM
+
+
+def build_matrix(rows):
+    """
+    构建所有产品的特征矩阵（每行已归一化，行向量点积即余弦相似度）
+
+    Returns:
+        numpy.ndarray: 形状为 (产品数, FEATURE_DIM) 的 float32 矩阵
+    """
+    matrix = np.zeros((len(rows), FEATURE_DIM), dtype=np.float32)
+    group_vector = np.zeros(FEATURE_DIM, dtype=np.float32)
+    for i, row in enumerate(rows):
+        for group, features in extract_features(row).items():
+            if not features:
+                continue
+            group_vector[:] = 0
+            for feature in features:
+                group_vector[_feature_index(group, feature)] += 1.0
+            norm = np.linalg.norm(group_vector)
+            if norm:
+                matrix[i] += group_vector * (FEATURE_WEIGHTS[group] / norm)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _top_k(matrix, targets, candidates, k):
+    """
+    分批计算目标产品与候选产品的相似度，取前K个
+
+    Args:
+        matrix: 特征矩阵
+        targets: 目标产品的行号数组
+        candidates: 候选产品（已上架）的布尔掩码
+        k: 每个产品保留的数量
+
+    Yields:
+        (行号, [(候选行号, 相似度), ...])
+    """
+    for start in range(0, len(targets), BATCH_SIZE):
+        batch = targets[start:start + BATCH_SIZE]
+        scores = matrix[batch] @ matrix.T
+        scores[:, ~candidates] = -np.inf
+        scores[np.arange(len(batch)), batch] = -np.inf  # 排除自身
+        count = min(k, scores.shape[1])
+        if count == 0:
+            for row in batch:
+                yield row, []
+            continue
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count] if count < scores.shape[1] \
+            else np.tile(np.arange(scores.shape[1]), (len(batch), 1))
+        for i, row in enumerate(batch):
+            order = top[i][np.argsort(-scores[i, top[i]], kind='stable')]
+            yield row, [(j, float(scores[i, j])) for j in order if scores[i, j] > 0]
+
+
+def refresh(product_ids=None, k=None):
+    """
+    重新计算推荐列表
+
+    Args:
+        product_ids: 发生变化的产品ID（包括已删除的），为None时全量计算
+        k: 每个产品保留的相关产品数量，默认 RELATED_PRODUCTS_K
+
+    Returns:
+        int: 重新计算的推荐列表数量
+    """
+    k = k or current_app.config.get('RELATED_PRODUCTS_K', 8)
+    rows = db.session.query(*FEATURE_COLUMNS).order_by(Product.id).all()
+    if not rows:
+        db.session.query(ProductRelation).delete(synchronize_session=False)
+        db.session.commit()
+        return 0
+
+    ids = np.array([row.id for row in rows])
+    position = {product_id: i for i, product_id in enumerate(ids.tolist())}
+    matrix = build_matrix(rows)
+    candidates = np.array([bool(row.status) for row in rows])
+
+    if product_ids is None:
+        targets = np.arange(len(rows))
+    else:
+        changed = set(product_ids)
+        affected = set(changed)
+        # 推荐列表中引用了变化产品的产品
+        affected.update(r[0] for r in db.session.query(ProductRelation.product_id).filter(
+            ProductRelation.related_id.in_(changed)).distinct())
+        # 变化产品可能进入其推荐列表的产品：相似度超过当前第K名（列表不满K个时任何正相似度）
+        present = [position[i] for i in changed if i in position and candidates[position[i]]]
+        if present:
+            threshold = np.zeros(len(rows), dtype=np.float32)
+            for product_id, score, count in db.session.query(
+                    ProductRelation.product_id, db.func.min(ProductRelation.score),
+                    db.func.count()).group_by(ProductRelation.product_id):
+                if product_id in position and count >= k:
+                    threshold[position[product_id]] = score
+            similarity = (matrix @ matrix[present].T).max(axis=1)
+            affected.update(ids[similarity > threshold].tolist())
+        targets = np.array(sorted(position[i] for i in affected if i in position), dtype=np.int64)
+
+        # 已删除的产品：推荐列表由外键级联删除，这里清理残留
+        deleted = [i for i in changed if i not in position]
+        if deleted:
+            ProductRelation.query.filter(ProductRelation.product_id.in_(deleted)).delete(synchronize_session=False)
+
+    target_ids = ids[targets].tolist()
+    for start in range(0, len(target_ids), 500):
+        ProductRelation.query.filter(ProductRelation.product_id.in_(target_ids[start:start + 500])).delete(
+            synchronize_session=False)
+    relations = []
+    for row, neighbours in _top_k(matrix, targets, candidates, k):
+        relations.extend(
+            {'product_id': int(ids[row]), 'rank': rank, 'related_id': int(ids[j]), 'score': score}
+            for rank, (j, score) in enumerate(neighbours)
+        )
+    if relations:
+        db.session.execute(ProductRelation.__table__.insert(), relations)
+    db.session.commit()
+    # 推荐列表变化后进程内目录中的相关产品重新生成
+    catalog.invalidate()
+    return len(target_ids)
+
+
+def missing_product_ids():
+    """还没有推荐列表的产品ID（如导入数据后、首次部署时）"""
+    has_relations = db.session.query(ProductRelation.product_id).filter(
+        ProductRelation.product_id == Product.id).exists()
+    return [row[0] for row in db.session.query(Product.id).filter(~has_relations)]
+
+
+def _refresh_worker():
+    """后台刷新线程：合并队列中的产品ID后批量刷新"""
+    while True:
+        app, product_ids = _refresh_queue.get()
+        try:
+            # 合并短时间内的多次修改
+            while True:
+                try:
+                    other_app, other_ids = _refresh_queue.get_nowait()
+                except queue.Empty:
+                    break
+                product_ids |= other_ids
+                _refresh_queue.task_done()
+            with app.app_context():
+                try:
+                    refresh(product_ids)
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f'刷新相关产品推荐失败: {str(e)}')
+                finally:
+                    db.session.remove()
+        finally:
+            _refresh_queue.task_done()
+
+
+def schedule_refresh(product_ids):
+    """
+    将发生变化的产品加入后台刷新队列（在事务提交后调用）
+
+    Args:
+        product_ids: 产品ID列表
+    """
+    global _refresh_thread
+    product_ids = set(product_ids)
+    if not product_ids or not current_app.config.get('RELATED_PRODUCTS_AUTO_REFRESH', True):
+        return
+    _refresh_queue.put((current_app._get_current_object(), product_ids))
+    with _refresh_lock:
+        if _refresh_thread is None or not _refresh_thread.is_alive():
+            _refresh_thread = threading.Thread(target=_refresh_worker, name='related-refresh', daemon=True)
+            _refresh_thread.start()
+
+
+def wait_for_refresh():
+    """等待刷新队列处理完毕（用于命令行和测试）"""
+    _refresh_queue.join()
+
+
+# 影响推荐结果的产品字段
+FEATURE_ATTRIBUTES = ('name', 'brand', 'category_id', 'technical_specs', 'advantages', 'status')
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_delete')
+def _on_product_added_or_deleted(mapper, connection, target):
+    """记录新增或删除的产品（记在执行 flush 的会话上），提交后刷新"""
+    object_session(target).info.setdefault('related_refresh', set()).add(target.id)
+
+
+@event.listens_for(Product, 'after_update')
+def _on_product_updated(mapper, connection, target):
+    """影响特征或上架状态的字段变化时记录，提交后刷新"""
+    state = db.inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in FEATURE_ATTRIBUTES):
+        object_session(target).info.setdefault('related_refresh', set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _on_commit(session):
+    """事务提交后将记录的产品交给后台线程刷新"""
+    product_ids = session.info.pop('related_refresh', None)
+    if product_ids:
+        schedule_refresh(product_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _on_rollback(session):
+    """事务回滚后丢弃记录"""
+    session.info.pop('related_refresh', None)
@@ -3,11 +3,13 @@
 前台路由模块
 处理网站前台页面的访问和数据展示
 """
-from flask import Blueprint, render_template, request, send_file, redirect, url_for, current_app
+from flask import Blueprint, render_template, request, send_file, redirect, url_for, current_app, abort
 from io import BytesIO
 
 from app import db
 from app.models import Product, Category, ProductImage, Contact, PageContent
+from app import catalog, sitemap, snapshots
+from app.db_routing import replica_reads
 import os
 import uuid
 from werkzeug.utils import secure_filename
@@ -61,51 +63,21 @@ def allowed_file(filename):
 
 
 @main.route('/')
+@replica_reads
 def index():
     """
     网站首页
     展示公司信息、产品分类和部分产品
     """
-    # 获取所有分类
-    categories = Category.query.order_by(Category.created_at).all()
-    
-    # 获取首页推荐产品（最多6个）
-    featured_products = Product.query.filter_by(status=True, is_featured=True).order_by(Product.created_at.desc()).limit(6).all()
-    # 如果推荐产品不足6个，用最新产品补充
-    if len(featured_products) < 6:
-        remaining_count = 6 - len(featured_products)
-        featured_ids = [p.id for p in featured_products]
-        additional_products = Product.query.filter_by(status=True).filter(~Product.id.in_(featured_ids if featured_ids else [0])).order_by(Product.created_at.desc()).limit(remaining_count).all()
-        featured_products = list(featured_products) + additional_products
-    
-    # 获取页面内容
-    page_content = {}
-    for key in ['home_hero_title', 'home_hero_description', 'home_hero_image',
-                'home_about_title', 'home_about_subtitle', 'home_about_description', 'home_about_image',
-                'home_about_intro_title', 'home_about_intro_text',
-                'home_services_title', 'home_services_subtitle',
-                'home_services_results_title', 'home_services_results_subtitle',
-                'home_contact_title', 'home_contact_subtitle']:
-        page_content[key] = PageContent.get_content(key)
-    
-    # 获取JSON格式的内容
-    import json
-    page_content['home_hero_stats'] = PageContent.get_content('home_hero_stats', '[]')
-    page_content['home_about_features'] = PageContent.get_content('home_about_features', '[]')
-    page_content['home_services_list'] = PageContent.get_content('home_services_list', '[]')
-    page_content['home_services_results_images'] = PageContent.get_content('home_services_results_images', '[]')
-    page_content['home_contact_info'] = PageContent.get_content('home_contact_info', '{}')
-    
-    # 获取图片内容对象（用于获取ID）
-    hero_image_content = PageContent.query.filter_by(page_key='home_hero_image').first()
-    about_image_content = PageContent.query.filter_by(page_key='home_about_image').first()
-    page_content['home_hero_image_id'] = hero_image_content.id if hero_image_content and hero_image_content.image_data else None
-    page_content['home_about_image_id'] = about_image_content.id if about_image_content and about_image_content.image_data else None
+    # 分类和推荐产品（不足6个时用最新产品补充）来自进程内的目录（见 app/catalog.py），
+    # 首页内容来自预先生成的快照（见 app/snapshots.py）
+    products_catalog = catalog.current()
+    snapshot = snapshots.home_snapshot()
     
     return render_template('frontend/index.html', 
-                         categories=categories,
-                         featured_products=featured_products,
-                         page_content=page_content)
+                         categories=products_catalog.categories,
+                         featured_products=products_catalog.home_products(),
+                         page_content=snapshot['page_content'])
 
 
 @main.route('/about')
@@ -117,82 +89,54 @@ def about():
 
 
 @main.route('/products')
+@replica_reads
 def products():
     """
     产品列表页面
-    支持按分类筛选和分页
+    支持按分类筛选和分页，筛选、排序和分页都在进程内的目录中完成（见 app/catalog.py），不查询数据库
     """
-    from flask import request
-    from sqlalchemy import or_
-    
-    # 获取所有分类
-    categories = Category.query.order_by(Category.created_at).all()
+    products_catalog = catalog.current()
     
     # 获取分类ID参数
     category_id = request.args.get('category', type=int)
+    current_category = products_catalog.category(category_id) if category_id else None
     
-    # 获取分页参数
+    # 获取分页参数（每页显示9个产品，按创建时间倒序）
     page = request.args.get('page', 1, type=int)
-    per_page = 9  # 每页显示9个产品
-    
-    # 构建查询
-    query = Product.query.filter_by(status=True)
-    
-    # 按分类筛选
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-        current_category = Category.query.get(category_id)
-    else:
-        current_category = None
-    
-    # 排序
-    query = query.order_by(Product.created_at.desc())
-    
-    # 分页
-    pagination = query.paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False
-    )
+    pagination = products_catalog.paginate(category_id, page)
     
     products = pagination.items
     
     return render_template('frontend/products.html', 
-                         categories=categories,
+                         categories=products_catalog.categories,
                          products=products,
                          current_category=current_category,
                          pagination=pagination)
 
 
 @main.route('/product/<int:product_id>')
+@replica_reads
 def product_detail(product_id):
     """
     产品详情页面
     """
-    # 获取产品信息
-    product = Product.query.get_or_404(product_id)
+    # 产品信息、分类和图库图片ID来自预先生成的快照（见 app/snapshots.py），
+    # 导航栏的分类列表和相关产品来自进程内的目录（见 app/catalog.py）
+    snapshot = snapshots.product_snapshot(product_id)
+    if snapshot is None:
+        abort(404)
     
     # 检查产品状态
-    if not product.status:
+    if not snapshot['product'].status:
         return redirect(url_for('main.products'))
     
-    # 获取所有分类（用于导航栏）
-    categories = Category.query.order_by(Category.created_at).all()
-    
-    # 获取相关产品（同分类的其他产品）
-    related_products = Product.query.filter_by(
-        category_id=product.category_id,
-        status=True
-    ).filter(Product.id != product_id).order_by(Product.created_at.desc()).limit(4).all()
-    
-    # 获取产品的图库图片
-    product_images = ProductImage.query.filter_by(product_id=product_id).order_by(ProductImage.order).all()
-    
+    products_catalog = catalog.current()
+    product = snapshot['product']
     return render_template('frontend/product-detail.html',
                          product=product,
-                         categories=categories,
-                         related_products=related_products,
-                         product_images=product_images)
+                         categories=products_catalog.categories,
+                         related_products=products_catalog.related(product.id, product.category_id),
+                         product_images=snapshot['product_images'])
 
 
 @main.route('/contact', methods=['GET', 'POST'])
@@ -202,7 +146,7 @@ def contact():
     支持表单提交和处理
     """
     # 获取所有分类（用于导航栏）
-    categories = Category.query.order_by(Category.created_at).all()
+    categories = catalog.current().categories
     
     if request.method == 'POST':
         # 获取表单数据
@@ -229,6 +173,8 @@ def contact():
                 message=message
             )
             db.session.add(new_contact)
+            from app import stats
+            stats.bump(unread_contact_count=1)
             db.session.commit()
             
             # 记录日志
@@ -254,12 +200,13 @@ def contact():
 
 
 @main.route('/image/product/<int:product_id>')
+@replica_reads
 def get_product_image(product_id):
     """
     获取产品主图片
     从数据库中读取图片数据并返回
     """
-    product = Product.query.get_or_404(product_id)
+    product = Product.query.options(db.undefer(Product.main_image)).get_or_404(product_id)
     
     if product.main_image:
         # 使用BytesIO将二进制数据转换为可发送的文件对象
@@ -279,6 +226,7 @@ def get_product_image(product_id):
 
 
 @main.route('/image/gallery/<int:image_id>')
+@replica_reads
 def get_gallery_image(image_id):
     """
     获取产品图库图片
@@ -286,7 +234,7 @@ def get_gallery_image(image_id):
     """
     from app.models import ProductImage
     
-    image = ProductImage.query.get_or_404(image_id)
+    image = ProductImage.query.options(db.undefer(ProductImage.image_data)).get_or_404(image_id)
     
     if image.image_data and image.mimetype:
         # 使用BytesIO将二进制数据转换为可发送的文件对象
@@ -302,13 +250,14 @@ def get_gallery_image(image_id):
 
 
 @main.route('/image/page-content/<int:content_id>')
+@replica_reads
 def get_page_content_image(content_id):
     """
     获取页面内容图片（前台访问）
     """
     from app.models import PageContent
     
-    content = PageContent.query.get_or_404(content_id)
+    content = PageContent.query.options(db.undefer(PageContent.image_data)).get_or_404(content_id)
     
     if content.image_data:
         return send_file(
@@ -319,4 +268,35 @@ def get_page_content_image(content_id):
         )
     else:
         from flask import abort
-        abort(404)
\ No newline at end of file
+        abort(404)
+
+
+@main.route('/sitemap.xml')
+def sitemap_index():
+    """
+    站点地图（带图片地址），条目超过 SITEMAP_MAX_URLS 时为分片索引
+    由进程内缓存的分片拼接，只在产品、分类修改后重新生成变化的分片
+    """
+    return sitemap.make_response(sitemap.document())
+
+
+@main.route('/sitemap-<name>.xml')
+def sitemap_part(name):
+    """
+    站点地图的一个分片：pages（固定页面和分类列表）或 products-<n>（产品分片）
+    """
+    document = sitemap.document(name)
+    if document is None:
+        abort(404)
+    return sitemap.make_response(document)
+
+
+@main.route('/robots.txt')
+def robots_txt():
+    """
+    爬虫规则：不抓取后台和登录页面，并声明站点地图的地址
+    """
+    sitemap_url = (current_app.config.get('SITEMAP_BASE_URL') or request.url_root).rstrip('/') + \
+        url_for('main.sitemap_index')
+    body = f'User-agent: *\nDisallow: /admin/\nDisallow: /auth/\n\nSitemap: {sitemap_url}\n'
+    return current_app.response_class(body, mimetype='text/plain')
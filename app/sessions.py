@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+会话接口模块
+匿名的图片和静态文件请求不需要会话：默认的 SecureCookieSessionInterface 会为每个请求
+解码会话 Cookie，并且在 SESSION_PERMANENT + SESSION_REFRESH_EACH_REQUEST 下重新签名写回 Cookie。
+后台页面的几十张缩略图因此会重复这些工作
+
+这里对 SESSIONLESS_PATH_PREFIXES 中的路径返回一个空的会话对象：不读取 Cookie，
+请求中对会话的写入会被丢弃，响应也不会写回 Cookie；当前用户因此是匿名用户，不会触发用户查询
+"""
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+
+
+class SessionlessSession(SecureCookieSession):
+    """免会话路径使用的空会话，写入不会被保存"""
+
+
+class LightweightSessionInterface(SecureCookieSessionInterface):
+    """
+    对图片和静态文件路径跳过会话加载和保存的会话接口
+    其他路径与默认的签名Cookie会话完全一致
+    """
+
+    def is_sessionless(self, app, request):
+        """判断请求路径是否无需会话"""
+        prefixes = app.config.get('SESSIONLESS_PATH_PREFIXES') or ()
+        return request.path.startswith(tuple(prefixes))
+
+    def open_session(self, app, request):
+        if self.is_sessionless(app, request):
+            return SessionlessSession()
+        return super().open_session(app, request)
+
+    def save_session(self, app, session, response):
+        if isinstance(session, SessionlessSession):
+            return
+        return super().save_session(app, session, response)
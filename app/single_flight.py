@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+请求合并（single-flight）模块
+缓存未命中、失效或过期的瞬间，同一个键的多个并发请求会同时执行同样的生成操作（查询快照、
+渲染片段、压缩页面、读取图片并落盘），在数据库本来就繁忙时把负载放大成请求数倍。
+这里保证同一个键同时只有一个线程执行生成函数，其他线程等待并共享它的结果：
+
+- 生成函数抛出的异常同样传给等待的线程，不会让每个线程再各自重试一次
+- 等待超过 timeout 秒（SINGLE_FLIGHT_TIMEOUT）时不再等待，自己执行生成函数，
+  生成卡住时不会拖住所有请求
+- 调用方持有已过期的旧值时可以传入 stale：已经有线程在生成时直接返回旧值（stale-while-revalidate），
+  没有时由本线程生成；显式失效后调用方不应再传入旧值
+- 进程内的合并使用线程锁；需要跨工作进程合并的操作（如把图片写入外部存储）使用 file_lock()，
+  基于 fcntl.flock，没有 fcntl 的平台（Windows）上只在进程内合并
+
+用法：
+
+    flight = SingleFlight('snapshots')
+    value = flight.do(key, lambda: build(key), timeout=10)
+"""
+import contextlib
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl：file_lock() 不加锁
+    fcntl = None
+
+# 跨进程文件锁的轮询间隔（秒）
+LOCK_POLL_INTERVAL = 0.01
+
+# 已创建的合并器：{名称: SingleFlight}，用于统计
+_registry = {}
+
+
+class _Call:
+    """一次正在进行的生成"""
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    按键合并并发的生成操作
+
+    Args:
+        name: 名称（统计中显示）
+    """
+
+    def __init__(self, name):
+        self.name = name
+        # {键: 正在进行的 _Call}
+        self._calls = {}
+        self._lock = threading.Lock()
+        # 执行生成函数的次数、共享结果的次数、返回旧值的次数、等待超时的次数
+        self.leaders = 0
+        self.shared = 0
+        self.stale = 0
+        self.timeouts = 0
+        _registry[name] = self
+
+    def do(self, key, fn, timeout=None, stale=None):
+        """
+        执行生成函数，同一个键同时只执行一次
+
+        Args:
+            key: 键（可哈希）
+            fn: 生成函数（无参数）
+            timeout: 等待其他线程生成的最长时间（秒），为None时一直等待
+            stale: 已过期的旧值，不为None时不等待其他线程，直接返回旧值
+
+        Returns:
+            生成函数的结果（或旧值）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+            else:
+                leader = False
+                if stale is not None:
+                    self.stale += 1
+                    return stale
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            logging.warning(f'等待 {self.name} 生成超时（{timeout}秒），自行生成: {key!r}')
+            return fn()
+        with self._lock:
+            self.shared += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        """正在生成的键的数量"""
+        return len(self._calls)
+
+    def stats(self):
+        return {'leaders': self.leaders, 'shared': self.shared, 'stale': self.stale,
+                'timeouts': self.timeouts, 'in_flight': self.in_flight()}
+
+    def reset_stats(self):
+        with self._lock:
+            self.leaders = self.shared = self.stale = self.timeouts = 0
+
+
+def stats():
+    """所有合并器的统计：{名称: {...}}"""
+    return {name: flight.stats() for name, flight in sorted(_registry.items())}
+
+
+@contextlib.contextmanager
+def file_lock(path, timeout=None):
+    """
+    跨进程的排他文件锁（fcntl.flock），用于合并多个工作进程对同一个文件的生成操作
+    锁文件不删除（删除后其他进程可能锁住不同的文件）；没有 fcntl 时不加锁
+
+    Args:
+        path: 锁文件路径（目录不存在时创建）
+        timeout: 等待锁的最长时间（秒），超时后不加锁继续执行，为None时一直等待
+
+    Yields:
+        bool: 是否拿到了锁
+    """
+    if fcntl is None:
+        yield False
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
+        locked = _acquire(f, timeout)
+        try:
+            yield locked
+        finally:
+            if locked:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _acquire(f, timeout):
+    """获取文件锁，超时返回False"""
+    if timeout is None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return True
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                logging.warning(f'等待文件锁超时（{timeout}秒），不加锁继续: {f.name}')
+                return False
+            time.sleep(LOCK_POLL_INTERVAL)
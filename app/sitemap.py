@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+站点地图模块
+搜索引擎爬虫是访问量的主要来源之一，靠翻页 /products?page=N 和分类组合发现产品既慢又消耗数据库。
+这里生成 /sitemap.xml（带图片站点地图扩展 image:image），爬虫直接得到所有产品详情页及其图片地址：
+
+- 条目分为若干分片：固定页面和分类列表（pages），以及按产品ID区间划分的产品分片
+  （products-<n>，每片 SITEMAP_SHARD_SIZE 个ID），每个分片的 <url> 条目单独生成并缓存
+- URL 总数不超过 SITEMAP_MAX_URLS（协议上限 50000）时 /sitemap.xml 是包含全部条目的 urlset，
+  超过时改为 sitemapindex，列出 /sitemap-pages.xml 和各个 /sitemap-products-<n>.xml 及其 lastmod
+- 产品条目的 lastmod 取 updated_at，并附带主图和图库图片的地址
+- 生成产品分片时使用流式查询（yield_per）逐行读取已上架产品的ID和更新时间，不读取图片数据
+- 增量更新：产品、图库图片、分类的修改提交后只有所在的分片失效（见文件末尾的映射事件），
+  /sitemap.xml 用缓存的其他分片重新拼接，未变化分片的内容和 lastmod 不变，爬虫只需重新抓取变化的部分；
+  批量操作不触发ORM事件，由调用方在提交后调用 invalidate_products()；
+  其他工作进程通过失效消息总线（见 app/invalidation.py）清理
+- 响应带 ETag / Last-Modified，爬虫的条件请求返回 304
+"""
+import hashlib
+from xml.sax.saxutils import escape
+
+from flask import current_app, request, url_for
+from sqlalchemy import event, func
+from sqlalchemy.orm import object_session
+
+from app import db, db_routing, invalidation
+from app.cache import LRUCache
+from app.models import CHINA_TZ, Category, Product, ProductImage
+from app.single_flight import SingleFlight
+
+# 固定页面和分类列表的分片名称
+PAGES = 'pages'
+# 产品分片名称的前缀：products-<ID区间序号>
+PRODUCTS_PREFIX = 'products-'
+# 产品分片列表的缓存标签（任意产品变化时失效）
+SHARDS_TAG = 'shards'
+# 流式查询每批读取的行数
+YIELD_PER = 1000
+# 不带参数的固定页面
+STATIC_ENDPOINTS = ('main.index', 'main.products', 'main.contact')
+
+URLSET_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                 'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">\n')
+URLSET_FOOTER = '</urlset>\n'
+INDEX_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+INDEX_FOOTER = '</sitemapindex>\n'
+
+# 分片和文档的缓存：{(类型, 名称, 站点地址): Part / Document / 分片列表}，标签为所依赖的分片名称
+_cache = LRUCache(maxsize=256)
+# 合并同一个分片或文档的并发生成（爬虫经常并发抓取）
+_flight = SingleFlight('sitemap')
+
+
+class Part:
+    """一个分片：<url> 条目（UTF-8 编码的XML片段）、条目数量和最新的修改时间"""
+    __slots__ = ('body', 'count', 'lastmod')
+
+    def __init__(self, body, count, lastmod):
+        self.body = body
+        self.count = count
+        self.lastmod = lastmod
+
+
+class Document:
+    """生成好的XML文档"""
+    __slots__ = ('data', 'etag', 'last_modified')
+
+    def __init__(self, data, last_modified):
+        self.data = data
+        self.etag = hashlib.sha1(data).hexdigest()
+        self.last_modified = last_modified
+
+
+def shard_name(product_id):
+    """产品所在分片的名称"""
+    return f'{PRODUCTS_PREFIX}{int(product_id) // _shard_size()}'
+
+
+def _shard_size():
+    return current_app.config.get('SITEMAP_SHARD_SIZE', 10000)
+
+
+def _base_url():
+    """条目中使用的站点地址：配置了 SITEMAP_BASE_URL 时使用配置，否则使用请求的地址"""
+    return (current_app.config.get('SITEMAP_BASE_URL') or request.url_root).rstrip('/')
+
+
+def _w3c_datetime(value):
+    """数据库中的中国时间（不带时区）转换为 W3C 日期时间格式"""
+    return value.replace(tzinfo=CHINA_TZ).isoformat(timespec='seconds')
+
+
+def _url_entry(loc, lastmod=None, images=()):
+    parts = [f'<url><loc>{escape(loc)}</loc>']
+    if lastmod is not None:
+        parts.append(f'<lastmod>{_w3c_datetime(lastmod)}</lastmod>')
+    for image in images:
+        parts.append(f'<image:image><image:loc>{escape(image)}</image:loc></image:image>')
+    parts.append('</url>\n')
+    return ''.join(parts)
+
+
+def _latest(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+def _build_pages(base):
+    """固定页面和分类列表（一条查询）"""
+    entries = [_url_entry(base + url_for(endpoint)) for endpoint in STATIC_ENDPOINTS]
+    lastmod = None
+    for category_id, updated_at in db.session.query(Category.id, Category.updated_at).order_by(Category.id):
+        entries.append(_url_entry(base + url_for('main.products', category=category_id), updated_at))
+        lastmod = _latest(lastmod, updated_at)
+    return Part(''.join(entries).encode('utf-8'), len(entries), lastmod)
+
+
+def _build_products(base, shard):
+    """
+    产品分片：ID在 [shard * SITEMAP_SHARD_SIZE, (shard + 1) * SITEMAP_SHARD_SIZE) 区间内的已上架产品
+    （两条流式查询：图库图片ID、产品ID和更新时间）
+    """
+    size = _shard_size()
+    low, high = shard * size, (shard + 1) * size
+    gallery = {}
+    for image_id, product_id in db.session.execute(
+        db.select(ProductImage.id, ProductImage.product_id).where(
+            ProductImage.product_id >= low, ProductImage.product_id < high, ProductImage.image_data.isnot(None)
+        ).order_by(ProductImage.product_id, ProductImage.id).execution_options(yield_per=YIELD_PER)
+    ):
+        gallery.setdefault(product_id, []).append(base + url_for('main.get_gallery_image', image_id=image_id))
+
+    entries, lastmod = [], None
+    for product_id, updated_at, has_main_image in db.session.execute(
+        db.select(Product.id, Product.updated_at, Product.main_image.isnot(None)).where(
+            Product.status == True, Product.id >= low, Product.id < high
+        ).order_by(Product.id).execution_options(yield_per=YIELD_PER)
+    ):
+        images = [base + url_for('main.get_product_image', product_id=product_id)] if has_main_image else []
+        images += gallery.get(product_id, ())
+        entries.append(_url_entry(base + url_for('main.product_detail', product_id=product_id), updated_at, images))
+        lastmod = _latest(lastmod, updated_at)
+    return Part(''.join(entries).encode('utf-8'), len(entries), lastmod)
+
+
+def _cached(key, build):
+    """
+    读取缓存，未命中时生成（同一个键只生成一次）
+
+    Args:
+        key: 缓存键
+        build: 生成函数，返回 (值, 标签列表)
+    """
+    value = _cache.get(key)
+    if value is not None:
+        return value
+
+    def run():
+        # 使用主库：副本的复制延迟可能让刚失效的旧数据被重新缓存
+        with db_routing.primary():
+            result, tags = build()
+        _cache.set(key, result, tags=tags)
+        return result
+
+    return _flight.do(key, run, timeout=current_app.config.get('SINGLE_FLIGHT_TIMEOUT', 10))
+
+
+def _part(name, base):
+    """分片（pages 或 products-<n>）"""
+    if name == PAGES:
+        return _cached(('part', name, base), lambda: (_build_pages(base), (name,)))
+    shard = int(name[len(PRODUCTS_PREFIX):])
+    return _cached(('part', name, base), lambda: (_build_products(base, shard), (name,)))
+
+
+def shards():
+    """
+    有已上架产品的产品分片（一条分组查询）
+
+    Returns:
+        list: [(分片名称, 产品数量, 最新的 updated_at)]，按ID区间排序
+    """
+    def build():
+        shard = Product.id // _shard_size()
+        rows = db.session.execute(
+            db.select(shard, func.count(), func.max(Product.updated_at)).where(Product.status == True)
+            .group_by(shard).order_by(shard)
+        )
+        return [(f'{PRODUCTS_PREFIX}{number}', count, updated_at) for number, count, updated_at in rows], \
+            (SHARDS_TAG,)
+
+    return _cached(('shards',), build)
+
+
+def document(name=None):
+    """
+    站点地图文档
+
+    Args:
+        name: 分片名称（pages、products-<n>），为None时返回 /sitemap.xml
+
+    Returns:
+        Document: 文档，分片不存在时返回None
+    """
+    base = _base_url()
+    if name is None:
+        return _cached(('document', None, base), lambda: _build_root(base))
+    if name != PAGES:
+        if name not in {shard for shard, _, _ in shards()}:
+            return None
+
+    def build():
+        part = _part(name, base)
+        data = URLSET_HEADER.encode('utf-8') + part.body + URLSET_FOOTER.encode('utf-8')
+        return Document(data, part.lastmod), (name,)
+
+    return _cached(('document', name, base), build)
+
+
+def _build_root(base):
+    """/sitemap.xml：条目不多时直接拼接所有分片，超过 SITEMAP_MAX_URLS 时生成分片索引"""
+    pages = _part(PAGES, base)
+    products = shards()
+    total = pages.count + sum(count for _, count, _ in products)
+    lastmod = pages.lastmod
+    for _, _, updated_at in products:
+        lastmod = _latest(lastmod, updated_at)
+
+    if total <= current_app.config.get('SITEMAP_MAX_URLS', 50000):
+        bodies = [pages.body] + [_part(name, base).body for name, _, _ in products]
+        data = URLSET_HEADER.encode('utf-8') + b''.join(bodies) + URLSET_FOOTER.encode('utf-8')
+        return Document(data, lastmod), (SHARDS_TAG, PAGES) + tuple(name for name, _, _ in products)
+
+    entries = [INDEX_HEADER]
+    for name, updated_at in [(PAGES, pages.lastmod)] + [(name, updated_at) for name, _, updated_at in products]:
+        loc = base + url_for('main.sitemap_part', name=name)
+        entries.append(f'<sitemap><loc>{escape(loc)}</loc>')
+        if updated_at is not None:
+            entries.append(f'<lastmod>{_w3c_datetime(updated_at)}</lastmod>')
+        entries.append('</sitemap>\n')
+    entries.append(INDEX_FOOTER)
+    return Document(''.join(entries).encode('utf-8'), lastmod), (SHARDS_TAG, PAGES)
+
+
+def make_response(doc):
+    """生成XML响应，支持条件请求"""
+    response = current_app.response_class(doc.data, mimetype='application/xml')
+    response.set_etag(doc.etag)
+    if doc.last_modified is not None:
+        response.last_modified = doc.last_modified.replace(tzinfo=CHINA_TZ)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config.get('SITEMAP_CACHE_MAX_AGE', 3600)
+    return response.make_conditional(request)
+
+
+def invalidate(*names):
+    """
+    使分片失效（在事务提交后调用），同时通知其他工作进程
+
+    Args:
+        names: 分片名称（以及 SHARDS_TAG），不传时全部失效
+    """
+    _evict(names or None)
+    invalidation.publish('sitemap', *names)
+
+
+def invalidate_products(product_ids):
+    """产品的上架状态或内容变化（批量操作提交后调用）"""
+    invalidate(SHARDS_TAG, *sorted({shard_name(product_id) for product_id in product_ids}))
+
+
+def _evict(names):
+    """清理本进程的缓存（也是失效消息总线的处理函数），names 为None时清空全部"""
+    if names is None:
+        _cache.clear()
+        return
+    _cache.invalidate_tags(*names)
+
+
+def _mark(target, *names):
+    """记录变化的分片（记在执行 flush 的会话上），提交后统一处理"""
+    object_session(target).info.setdefault('sitemap_changed', set()).update(names)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+@event.listens_for(Product, 'after_delete')
+def _on_product_changed(mapper, connection, target):
+    _mark(target, SHARDS_TAG, shard_name(target.id))
+
+
+@event.listens_for(ProductImage, 'after_insert')
+@event.listens_for(ProductImage, 'after_update')
+@event.listens_for(ProductImage, 'after_delete')
+def _on_product_image_changed(mapper, connection, target):
+    if target.product_id is not None:
+        _mark(target, shard_name(target.product_id))
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _on_category_changed(mapper, connection, target):
+    _mark(target, PAGES)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _on_commit(session):
+    names = session.info.pop('sitemap_changed', None)
+    if names:
+        invalidate(*sorted(names))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop('sitemap_changed', None)
+
+
+invalidation.register('sitemap', _evict)
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+页面数据快照模块
+访问量最大的页面每次请求都要执行多次查询并重新组装同样的数据。这里把页面渲染所需的数据
+预先组装成快照（不含图片数据的JSON），保存在 view_snapshots 表中供所有工作进程共享，
+同时在进程内 LRU 中缓存 SNAPSHOT_LOCAL_TTL 秒：
+
+- 进程内命中时不执行任何查询，未命中时只读取一行快照
+- 快照只在其依赖的数据被修改并提交后失效（见文件末尾的映射事件），下一次访问时重新生成；
+  批量操作不触发ORM事件，由调用方在提交后调用 invalidate()
+- 其他工作进程中的进程内缓存通过失效消息总线清理（见 app/invalidation.py），
+  SNAPSHOT_LOCAL_TTL 只是消息丢失时的兜底
+- 进程内未命中时同一个快照只由一个线程读取或生成，其他线程等待结果（见 app/single_flight.py）；
+  进程内缓存只是过期时，重新读取期间其他线程继续使用旧值
+- 失效时快照的代数（generation）加1，生成快照时只有代数未变才写入，
+  避免失效前开始生成的快照在失效后写回过期数据
+
+快照包括首页内容和产品详情；分类、产品卡片、产品列表和相关产品由进程内的目录（app/catalog.py）提供
+
+快照中的模型数据使用 ModelSummary 表示，模板中可以像模型对象一样按属性访问，
+也可以直接作为 {% cache %} 片段缓存的键
+"""
+import json
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+
+from app import db, db_routing, invalidation
+from app.cache import LRUCache
+from app.single_flight import SingleFlight
+from app.models import Category, PageContent, Product, ProductImage, ViewSnapshot, china_now
+
+# 快照格式版本：修改快照内容的结构时加1，旧格式的快照视为不存在并重新生成
+FORMAT_VERSION = 2
+
+# 首页快照的标识（首页内容；分类和产品卡片来自 app/catalog.py）
+HOME = 'home'
+# 首页的文本内容
+HOME_TEXT_KEYS = (
+    'home_hero_title', 'home_hero_description', 'home_hero_image',
+    'home_about_title', 'home_about_subtitle', 'home_about_description', 'home_about_image',
+    'home_about_intro_title', 'home_about_intro_text',
+    'home_services_title', 'home_services_subtitle',
+    'home_services_results_title', 'home_services_results_subtitle',
+    'home_contact_title', 'home_contact_subtitle',
+)
+# 首页的JSON内容及解析失败时的默认值
+HOME_JSON_KEYS = {
+    'home_hero_stats': '[]',
+    'home_about_features': '[]',
+    'home_services_list': '[]',
+    'home_services_results_images': '[]',
+    'home_contact_info': '{}',
+}
+# 进程内缓存：{快照标识: 快照内容}
+_local = LRUCache(maxsize=1024)
+# 合并同一个快照的并发读取和生成
+_flight = SingleFlight('snapshots')
+
+
+class ModelSummary(dict):
+    """
+    模型对象的只读摘要
+    以字典形式保存（可序列化为JSON），模板中按属性访问；带有表名，可作为片段缓存的键
+
+    Args:
+        tablename: 对应的表名，如 products
+        fields: 字段字典，需要包含 id
+    """
+
+    def __init__(self, tablename, fields):
+        super().__init__(fields)
+        self.__tablename__ = tablename
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def get(key, build, load=None):
+    """
+    读取快照：依次查找进程内缓存、快照表，都没有时生成并写入快照表
+
+    Args:
+        key: 快照标识
+        build: 生成快照的函数，返回可序列化为JSON的数据
+        load: 将JSON数据转换为模板使用的对象的函数
+
+    Returns:
+        快照内容
+    """
+    value, fresh = _local.lookup(key)
+    if fresh:
+        return value
+    # 同一个快照同时只有一个线程读取或生成，其他线程等待结果；进程内缓存过期（未被显式失效）时直接返回旧值
+    return _flight.do(key, lambda: _fetch(key, build, load),
+                      timeout=current_app.config.get('SINGLE_FLIGHT_TIMEOUT', 10), stale=value)
+
+
+def _fetch(key, build, load):
+    """从快照表读取快照，没有时生成并写入，结果放入进程内缓存"""
+    # 快照表和生成快照的查询都使用主库：副本的复制延迟可能让刚失效的旧快照被重新缓存
+    table = ViewSnapshot.__table__
+    with db_routing.primary():
+        row = db.session.execute(
+            db.select(table.c.generation, table.c.data).where(table.c.key == key)
+        ).first()
+        stored = json.loads(row.data) if row is not None and row.data is not None else None
+        if stored is not None and stored.get('format') == FORMAT_VERSION:
+            data = stored['data']
+        else:
+            data = build()
+            if data is not None:
+                data = json.loads(_dumps(data))
+                _store(key, row.generation if row is not None else None, data)
+
+    if data is None:
+        # 对象不存在，不缓存
+        return None
+    value = load(data) if load else data
+    ttl = current_app.config.get('SNAPSHOT_LOCAL_TTL', 5)
+    if ttl > 0:
+        _local.set(key, value, ttl=ttl, tags=(key.partition(':')[0],))
+    return value
+
+
+def _dumps(data):
+    """紧凑的JSON序列化，时间转换为ISO格式字符串"""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'),
+                      default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value))
+
+
+def _store(key, generation, data):
+    """
+    写入快照（使用独立连接，不影响请求中的会话）
+
+    Args:
+        key: 快照标识
+        generation: 读取时的代数，为None表示快照表中还没有这一行
+        data: 快照内容
+    """
+    table = ViewSnapshot.__table__
+    values = {'data': _dumps({'format': FORMAT_VERSION, 'data': data}), 'built_at': china_now()}
+    try:
+        with db.engine.begin() as connection:
+            if generation is None:
+                connection.execute(table.insert().values(key=key, generation=0, **values))
+            else:
+                # 代数变化说明生成期间已经失效，丢弃本次结果
+                connection.execute(table.update().where(
+                    table.c.key == key, table.c.generation == generation
+                ).values(**values))
+    except IntegrityError:
+        # 其他进程已经写入或已经失效
+        pass
+
+
+def invalidate(*keys):
+    """
+    使快照失效（在事务提交后调用），下一次访问时重新生成
+
+    Args:
+        keys: 快照标识；以 :* 结尾时使该类型的所有快照失效，如 product:*
+    """
+    prefixes = [key[:-1] for key in keys if key.endswith(':*')]
+    keys = [key for key in keys if not key.endswith(':*')]
+    if not keys and not prefixes:
+        return
+    table = ViewSnapshot.__table__
+    with db.engine.begin() as connection:
+        for prefix in prefixes:
+            connection.execute(table.update().where(table.c.key.startswith(prefix, autoescape=True)).values(
+                generation=table.c.generation + 1, data=None))
+        result = connection.execute(table.update().where(table.c.key.in_(keys)).values(
+            generation=table.c.generation + 1, data=None)) if keys else None
+        if keys and result.rowcount < len(keys):
+            # 还没有快照的标识也写入一行已失效的记录，正在生成的快照不会被写入
+            existing = set(connection.execute(db.select(table.c.key).where(table.c.key.in_(keys))).scalars())
+            for key in set(keys) - existing:
+                try:
+                    with connection.begin_nested():
+                        connection.execute(table.insert().values(key=key, generation=1, data=None))
+                except IntegrityError:
+                    pass
+    _evict_local(keys + [prefix + '*' for prefix in prefixes])
+    invalidation.publish('snapshot', *keys, *(prefix + '*' for prefix in prefixes))
+
+
+def _evict_local(keys):
+    """
+    清理本进程缓存中的快照（也是失效消息总线的处理函数）
+
+    Args:
+        keys: 快照标识列表，为None时清空全部
+    """
+    if keys is None:
+        _local.clear()
+        return
+    for key in keys:
+        if key.endswith(':*'):
+            _local.invalidate_tags(key[:-2])
+        else:
+            _local.delete(key)
+
+
+def clear_local():
+    """清空进程内缓存"""
+    _local.clear()
+
+
+def _build_home():
+    """生成首页快照：首页内容"""
+    # 一次查询取出所有首页内容（不读取图片数据）
+    contents = {
+        row.page_key: row for row in db.session.query(
+            PageContent.id, PageContent.page_key, PageContent.content_type, PageContent.content_value,
+            PageContent.image_data.isnot(None).label('has_image')
+        ).filter(PageContent.page_key.in_(HOME_TEXT_KEYS + tuple(HOME_JSON_KEYS)))
+    }
+    page_content = {}
+    for key in HOME_TEXT_KEYS:
+        row = contents.get(key)
+        page_content[key] = _content_value(row, '')
+    for key, default in HOME_JSON_KEYS.items():
+        page_content[key] = _content_value(contents.get(key), default)
+    for key in ('home_hero_image', 'home_about_image'):
+        row = contents.get(key)
+        page_content[f'{key}_id'] = row.id if row is not None and row.has_image else None
+
+    return {'page_content': page_content}
+
+
+def _content_value(row, default):
+    """与 PageContent.get_content 相同的取值规则"""
+    if row is None:
+        return default
+    if row.content_type == 'json':
+        try:
+            return json.loads(row.content_value)
+        except (TypeError, ValueError):
+            return default
+    return row.content_value or default
+
+
+def home_snapshot():
+    """
+    首页快照
+
+    Returns:
+        dict: {'page_content': {...}}
+    """
+    return get(HOME, _build_home)
+
+
+def product_key(product_id):
+    """产品详情快照的标识（传入 * 时表示所有产品详情快照，用于 invalidate）"""
+    return f'product:{product_id}'
+
+
+def _number(value):
+    """Decimal 转换为 float（JSON 中保存为数字）"""
+    return float(value) if value is not None else None
+
+
+def _build_product(product_id):
+    """
+    生成产品详情快照：产品的列数据（不含图片数据）、分类、已解析的JSON字段和图库图片ID
+    （导航栏的分类列表和相关产品来自 app/catalog.py）
+
+    Returns:
+        dict: 快照内容，产品不存在时返回None
+    """
+    columns = [column for column in Product.__table__.columns if column.key != 'main_image']
+    row = db.session.query(*columns, Product.main_image.isnot(None).label('has_image')).filter(
+        Product.id == product_id).first()
+    if row is None:
+        return None
+    # 复用模型中的解析方法，与直接渲染模型对象的结果一致
+    product = Product(**{column.key: getattr(row, column.key) for column in columns})
+    fields = {column.key: getattr(row, column.key) for column in columns}
+    for key in ('price', 'price_min', 'price_max', 'rating'):
+        fields[key] = _number(fields[key])
+    fields.update(
+        main_image=bool(row.has_image),
+        advantages_list=product.get_advantages_list(),
+        service_tags_list=product.get_service_tags_list(),
+        technical_specs_dict=product.get_technical_specs_dict(),
+        tab_contents_dict=product.get_tab_contents_dict(),
+    )
+
+    category = db.session.query(Category.id, Category.name).filter(Category.id == row.category_id).first()
+    images = db.session.query(ProductImage.id).filter(ProductImage.product_id == product_id).order_by(
+        ProductImage.order).all()
+    return {
+        'product': fields,
+        'category': {'id': category.id, 'name': category.name} if category is not None else None,
+        'images': [{'id': image.id} for image in images],
+    }
+
+
+def _load_product(data):
+    product = ModelSummary('products', data['product'])
+    product['category'] = ModelSummary('categories', data['category']) if data['category'] else None
+    return {
+        'product': product,
+        'product_images': [ModelSummary('product_images', image) for image in data['images']],
+    }
+
+
+def product_snapshot(product_id):
+    """
+    产品详情快照
+
+    Returns:
+        dict: {'product': ..., 'product_images': [...]}，产品不存在时返回None
+    """
+    return get(product_key(product_id), lambda: _build_product(product_id), _load_product)
+
+
+def init_app(app):
+    """按配置设置进程内缓存容量"""
+    _local.maxsize = app.config.get('SNAPSHOT_CACHE_SIZE', 1024)
+
+
+def _mark(target, *keys):
+    """记录需要失效的快照（记在执行 flush 的会话上），提交后统一处理"""
+    object_session(target).info.setdefault('snapshot_invalidate', set()).update(keys)
+
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _on_category_changed(mapper, connection, target):
+    """分类变化时所有产品详情快照失效（面包屑和分类标签，分类很少修改）"""
+    _mark(target, product_key('*'))
+
+
+@event.listens_for(Product, 'after_update')
+def _on_product_updated(mapper, connection, target):
+    """产品被修改时详情快照失效（产品卡片和首页产品由 app/catalog.py 重新生成）"""
+    _mark(target, product_key(target.id))
+
+
+@event.listens_for(Product, 'after_delete')
+def _on_product_deleted(mapper, connection, target):
+    """产品被删除时详情快照失效"""
+    _mark(target, product_key(target.id))
+
+
+@event.listens_for(ProductImage, 'after_insert')
+@event.listens_for(ProductImage, 'after_update')
+@event.listens_for(ProductImage, 'after_delete')
+def _on_product_image_changed(mapper, connection, target):
+    """图库图片变化时所属产品的详情快照失效"""
+    _mark(target, product_key(target.product_id))
+
+
+@event.listens_for(PageContent, 'after_insert')
+@event.listens_for(PageContent, 'after_update')
+@event.listens_for(PageContent, 'after_delete')
+def _on_page_content_changed(mapper, connection, target):
+    """首页内容被修改时首页快照失效"""
+    if (target.page_key or '').startswith('home_'):
+        _mark(target, HOME)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _on_commit(session):
+    keys = session.info.pop('snapshot_invalidate', None)
+    if keys:
+        invalidate(*keys)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _on_rollback(session):
+    session.info.pop('snapshot_invalidate', None)
+
+
+invalidation.register('snapshot', _evict_local)
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+静态站点导出模块
+flask export-static 将前台的所有公开页面和图片渲染为静态文件（STATIC_EXPORT_DIR），
+由 Nginx 直接提供，访问高峰时不经过 Python 和数据库，未导出的地址再转发给应用
+
+目录结构（Nginx 配置示例见 启动指南.md）：
+    index.html                                  首页
+    products/category-<分类ID或all>/page-<页码>.html 产品列表（对应 ?category=&page=）
+    product/<产品ID>/index.html                  产品详情
+    contact/index.html                          联系我们（GET）
+    image/product/<产品ID>/index.<扩展名>        产品主图（图库、页面内容图片同理）
+    assets/、static/                            构建后的样式脚本和静态文件
+
+增量导出：每个页面根据它依赖的数据（产品、分类、页面内容的ID和 updated_at 等元数据，不读取图片）
+计算指纹，只重新渲染指纹发生变化的页面，删除已不存在的页面；模板或构建资源变化时全量导出
+页面通过测试客户端在进程池中渲染，输出与线上访问完全一致
+"""
+import gzip
+import hashlib
+import json
+import math
+import mimetypes
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from flask import current_app
+
+from app import db
+from app.catalog import HOME_PRODUCT_COUNT, PRODUCTS_PER_PAGE
+from app.models import Category, PageContent, Product, ProductImage, ProductRelation
+from app.rate_limit import EXEMPT_ENVIRON_KEY
+
+# 导出状态文件：记录每个页面的指纹
+STATE_FILE = '.export-state.json'
+
+# 进程池中每个工作进程的测试客户端
+_worker_client = None
+
+
+def export_dir(app=None):
+    """导出目录（绝对路径）"""
+    app = app or current_app
+    return os.path.abspath(app.config['STATIC_EXPORT_DIR'])
+
+
+def _fingerprint(*parts):
+    """计算依赖数据的指纹"""
+    data = json.dumps(parts, default=str, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def code_version(app=None):
+    """模板和构建资源清单的指纹，任一变化时全量导出"""
+    app = app or current_app
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, 'templates', 'frontend')
+    for name in sorted(os.listdir(template_dir)):
+        with open(os.path.join(template_dir, name), 'rb') as f:
+            digest.update(name.encode('utf-8'))
+            digest.update(f.read())
+    from app.asset_pipeline import MANIFEST_NAME, output_dir
+    manifest = os.path.join(output_dir(app), MANIFEST_NAME)
+    if os.path.exists(manifest):
+        with open(manifest, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def plan_pages():
+    """
+    列出所有需要导出的地址及其指纹
+    只查询元数据列，页面内容的选取规则与前台路由保持一致
+
+    Returns:
+        dict: {地址: 指纹}
+    """
+    categories = db.session.query(Category.id, Category.name, Category.updated_at).order_by(Category.created_at).all()
+    categories_fp = _fingerprint([tuple(row) for row in categories])
+
+    products = db.session.query(
+        Product.id, Product.category_id, Product.status, Product.is_featured,
+        Product.created_at, Product.updated_at, Product.main_image.isnot(None).label('has_image')
+    ).all()
+    active = sorted((p for p in products if p.status), key=lambda p: (p.created_at, p.id), reverse=True)
+
+    def card(product):
+        # 产品卡片：名称、价格等变化都会更新 updated_at
+        return product.id, product.updated_at, product.has_image
+
+    contents = db.session.query(
+        PageContent.id, PageContent.page_key, PageContent.updated_at,
+        PageContent.image_data.isnot(None).label('has_image')
+    ).all()
+    gallery = db.session.query(ProductImage.id, ProductImage.product_id, ProductImage.order).all()
+    relations = db.session.query(ProductRelation.product_id, ProductRelation.related_id).order_by(
+        ProductRelation.product_id, ProductRelation.rank).all()
+
+    pages = {}
+
+    # 首页：推荐产品，不足时用最新产品补充
+    featured = [p for p in active if p.is_featured][:HOME_PRODUCT_COUNT]
+    featured += [p for p in active if p not in featured][:HOME_PRODUCT_COUNT - len(featured)]
+    home_contents = [(c.page_key, c.id, c.updated_at, c[3]) for c in contents if c.page_key.startswith('home_')]
+    pages['/'] = _fingerprint(categories_fp, [card(p) for p in featured], sorted(home_contents))
+
+    # 产品列表：全部分类和每个分类的每一页
+    for category in [None] + list(categories):
+        items = [p for p in active if category is None or p.category_id == category.id]
+        page_count = max(1, math.ceil(len(items) / PRODUCTS_PER_PAGE))
+        for page in range(1, page_count + 1):
+            chunk = items[(page - 1) * PRODUCTS_PER_PAGE:page * PRODUCTS_PER_PAGE]
+            args = {}
+            if category is not None:
+                args['category'] = category.id
+            if page > 1:
+                args['page'] = page
+            url = '/products' + ('?' + urlencode(args) if args else '')
+            pages[url] = _fingerprint(categories_fp, tuple(category) if category else None,
+                                      [card(p) for p in chunk], page_count)
+
+    # 产品详情：产品本身、相关产品（与 catalog.Catalog.related 一致）和图库图片
+    images_by_product = {}
+    for image in gallery:
+        images_by_product.setdefault(image.product_id, []).append((image.id, image.order))
+    active_by_id = {p.id: p for p in active}
+    related_by_product = {}
+    for product_id, related_id in relations:
+        if related_id in active_by_id:
+            related_by_product.setdefault(product_id, []).append(active_by_id[related_id])
+    for product in active:
+        related = related_by_product.get(product.id, [])[:4] or \
+            [p for p in active if p.category_id == product.category_id and p.id != product.id][:4]
+        pages[f'/product/{product.id}'] = _fingerprint(
+            categories_fp, card(product), product.category_id,
+            [card(p) for p in related], sorted(images_by_product.get(product.id, []))
+        )
+
+    pages['/contact'] = _fingerprint(categories_fp)
+
+    # 图片：只导出已上架产品的图片和页面内容图片
+    for product in active:
+        if product.has_image:
+            pages[f'/image/product/{product.id}'] = _fingerprint(product.updated_at)
+        for image_id, _ in images_by_product.get(product.id, []):
+            pages[f'/image/gallery/{image_id}'] = _fingerprint(image_id)
+    for content in contents:
+        if content.has_image:
+            pages[f'/image/page-content/{content.id}'] = _fingerprint(content.updated_at)
+
+    return pages
+
+
+def output_path(url, mimetype=None):
+    """
+    地址对应的导出文件（相对路径）
+
+    Args:
+        url: 页面地址
+        mimetype: 图片类型，用于确定扩展名
+    """
+    path, _, query = url.partition('?')
+    if path == '/products':
+        args = dict(parse_qsl(query))
+        return os.path.join('products', f"category-{args.get('category', 'all')}", f"page-{args.get('page', '1')}.html")
+    if path.startswith('/image/'):
+        extension = mimetypes.guess_extension(mimetype or 'image/jpeg') or '.img'
+        if extension == '.jpe':
+            extension = '.jpg'
+        return os.path.join(path.strip('/'), 'index' + extension)
+    if path == '/':
+        return 'index.html'
+    return os.path.join(path.strip('/'), 'index.html')
+
+
+def _remove_output(root, url):
+    """删除地址对应的导出文件（图片所在的整个目录）"""
+    path = url.partition('?')[0]
+    if path.startswith('/image/'):
+        shutil.rmtree(os.path.join(root, path.strip('/')), ignore_errors=True)
+        return
+    target = os.path.join(root, output_path(url))
+    for candidate in (target, target + '.gz'):
+        if os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def _init_worker(config_name):
+    """进程池初始化：每个工作进程创建自己的应用和数据库连接"""
+    global _worker_client
+    from app import create_app
+    app = create_app(config_name)
+    _worker_client = app.test_client()
+    # 导出时所有图片都从同一个客户端请求，不做限流
+    _worker_client.environ_base[EXEMPT_ENVIRON_KEY] = True
+
+
+def _render_batch(root, urls):
+    """
+    在工作进程中渲染一批地址并写入导出目录
+
+    Returns:
+        list: [(地址, 状态码)]
+    """
+    results = []
+    for url in urls:
+        response = _worker_client.get(url)
+        if response.status_code == 200:
+            _remove_output(root, url)
+            target = os.path.join(root, output_path(url, response.mimetype))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            data = response.get_data()
+            tmp_path = target + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, target)
+            if response.mimetype == 'text/html':
+                # 供 Nginx gzip_static 直接使用
+                with open(target + '.gz', 'wb') as f:
+                    f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        results.append((url, response.status_code))
+    return results
+
+
+def _copy_tree(source, target, exclude=None):
+    """复制目录中新增或修改过的文件，跳过 exclude 目录"""
+    if not os.path.isdir(source):
+        return
+    for directory, subdirs, files in os.walk(source):
+        subdirs[:] = [d for d in subdirs if os.path.join(directory, d) != exclude]
+        relative = os.path.relpath(directory, source)
+        os.makedirs(os.path.join(target, relative), exist_ok=True)
+        for name in files:
+            src = os.path.join(directory, name)
+            dst = os.path.join(target, relative, name)
+            if not os.path.exists(dst) or os.path.getmtime(dst) < os.path.getmtime(src):
+                shutil.copy2(src, dst)
+
+
+def export_site(app=None, workers=None, full=False):
+    """
+    导出静态站点
+
+    Args:
+        app: Flask应用实例
+        workers: 渲染进程数，默认为CPU核数
+        full: 是否忽略上次导出的状态，全部重新渲染
+
+    Returns:
+        dict: {'rendered': [...], 'removed': [...], 'skipped': 未变化的页面数, 'failed': [(地址, 状态码)]}
+    """
+    app = app or current_app
+    root = export_dir(app)
+    os.makedirs(root, exist_ok=True)
+
+    state_path = os.path.join(root, STATE_FILE)
+    state = {}
+    if not full and os.path.exists(state_path):
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    version = code_version(app)
+    previous = state.get('pages', {}) if state.get('version') == version else {}
+
+    pages = plan_pages()
+    # 规划完成后释放连接，渲染在其他进程中进行
+    db.session.remove()
+
+    changed = [url for url, fp in pages.items() if previous.get(url) != fp]
+    removed = [url for url in state.get('pages', {}) if url not in pages]
+    for url in removed:
+        _remove_output(root, url)
+
+    failed = []
+    if changed:
+        workers = workers or os.cpu_count() or 1
+        batches = [changed[i::workers] for i in range(workers) if changed[i::workers]]
+        # 使用 spawn 启动工作进程，不继承父进程的数据库连接
+        with ProcessPoolExecutor(max_workers=len(batches), mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(app.config.get('CONFIG_NAME'),)) as pool:
+            for results in pool.map(_render_batch, [root] * len(batches), batches):
+                failed.extend((url, status) for url, status in results if status != 200)
+
+    # 渲染失败的页面不记录指纹，下次导出时重试
+    failed_urls = {url for url, _ in failed}
+    exported = {url: fp for url, fp in pages.items() if url not in failed_urls}
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'pages': exported}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, state_path)
+
+    # 构建后的样式脚本和静态文件
+    from app.asset_pipeline import output_dir
+    assets = output_dir(app)
+    _copy_tree(assets, os.path.join(root, 'assets'))
+    _copy_tree(app.static_folder, os.path.join(root, 'static'), exclude=assets)
+
+    return {
+        'rendered': [url for url in changed if url not in failed_urls],
+        'removed': removed,
+        'skipped': len(pages) - len(changed),
+        'failed': failed,
+    }
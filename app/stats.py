@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+站点统计模块
+维护后台仪表盘使用的计数器（产品总数、已上架产品数、分类数、未读消息数）
+
+- 写操作在同一事务中调用 bump() 增量更新计数器，随业务数据一起提交或回滚
+- reconcile() 用 COUNT(*) 重新核对计数器，由定时任务或 flask reconcile-stats 执行；
+  先用 SELECT ... FOR UPDATE 锁住计数器行再统计，不会覆盖并发提交的 bump()
+- get_counters() 只读取 site_statistics 表的几行数据，不扫描业务表
+"""
+import logging
+import threading
+import time
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Category, Product, Contact, SiteStatistic, china_now
+
+# 计数器名称及对应的实际统计查询
+COUNTER_QUERIES = {
+    'product_count': lambda: db.session.query(func.count(Product.id)),
+    'active_product_count': lambda: db.session.query(func.count(Product.id)).filter(Product.status == True),
+    'category_count': lambda: db.session.query(func.count(Category.id)),
+    'unread_contact_count': lambda: db.session.query(func.count(Contact.id)).filter(Contact.is_read == False),
+}
+
+
+def bump(**deltas):
+    """
+    在当前事务中增量更新计数器，例如 bump(product_count=1, active_product_count=1)
+    使用 UPDATE ... SET value = value + :delta，多个进程并发写入也不会丢失更新
+    计数器行不存在时跳过，等待下次核对时创建
+    """
+    for key, delta in deltas.items():
+        if key not in COUNTER_QUERIES:
+            raise KeyError(f'未知的计数器: {key}')
+        if not delta:
+            continue
+        db.session.query(SiteStatistic).filter(SiteStatistic.key == key).update(
+            {SiteStatistic.value: SiteStatistic.value + delta,
+             SiteStatistic.updated_at: china_now()},
+            synchronize_session=False
+        )
+
+
+def get_counters():
+    """
+    读取所有计数器
+
+    Returns:
+        dict: {计数器名称: 数值}
+    """
+    rows = db.session.query(SiteStatistic.key, SiteStatistic.value).all()
+    counters = {key: value for key, value in rows}
+    if any(key not in counters for key in COUNTER_QUERIES):
+        # 首次使用或计数器被清空，核对一次后再返回
+        try:
+            reconcile()
+        except IntegrityError:
+            # 其他进程同时创建了计数器行，直接读取即可
+            db.session.rollback()
+        rows = db.session.query(SiteStatistic.key, SiteStatistic.value).all()
+        counters = {key: value for key, value in rows}
+    return {key: counters.get(key, 0) for key in COUNTER_QUERIES}
+
+
+def reconcile():
+    """
+    用实际数据核对所有计数器并修正偏差
+    先 COUNT 再写入绝对值时，两步之间提交的 bump() 会被覆盖。这里先锁住计数器行（SELECT ... FOR UPDATE）：
+    之前已经更新该行的事务提交后才能拿到锁，之后的 UPDATE 在新的快照中统计，能看到这些事务的数据；
+    拿到锁之后的 bump() 等待本事务提交后再增量更新。只在一条 UPDATE 中统计不够：READ COMMITTED 下
+    子查询的快照在等待行锁之前取得，仍会写入过时的数值
+
+    Returns:
+        dict: {计数器名称: 偏差值}，只包含存在偏差（或新创建）的计数器（偏差只用于日志，可能包含核对期间的并发更新）
+    """
+    drift = {}
+    now = china_now()
+    for key, query in COUNTER_QUERIES.items():
+        counter = db.session.query(SiteStatistic.value).filter(SiteStatistic.key == key)
+        before = counter.with_for_update().scalar()
+        if before is None:
+            actual = query().scalar() or 0
+            db.session.add(SiteStatistic(key=key, value=actual, reconciled_at=now))
+            drift[key] = actual
+            continue
+        db.session.query(SiteStatistic).filter(SiteStatistic.key == key).update(
+            {SiteStatistic.value: query().scalar_subquery(),
+             SiteStatistic.reconciled_at: now},
+            synchronize_session=False
+        )
+        after = counter.scalar()
+        if after != before:
+            drift[key] = after - before
+    db.session.commit()
+    if drift:
+        logging.info(f'统计计数器核对完成，修正偏差: {drift}')
+    return drift
+
+
+def start_reconciler(app, interval):
+    """
+    启动后台线程，每隔 interval 秒核对一次计数器
+
+    Args:
+        app: Flask应用实例
+        interval: 核对间隔（秒）
+    """
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    reconcile()
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f'统计计数器核对失败: {str(e)}')
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='stats-reconciler', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+登录用户缓存模块
+Flask-Login 的 user_loader 在每个已登录请求中都会执行一次用户查询，
+后台页面的每张缩略图请求也会重复这次查询。这里在进程内缓存用户的列数据（TTL 较短），
+命中时通过 session.merge(load=False) 还原为当前会话中的对象，不发出任何SQL
+
+修改密码、管理员权限或激活状态时立即失效（见文件末尾的映射事件），
+提交后通过失效消息总线通知其他工作进程（见 app/invalidation.py），消息丢失时最多在 USER_CACHE_TTL 秒后过期
+"""
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from app import db, invalidation
+from app.models import User
+
+# 缓存内容：{user_id: (过期时间, 分离状态的用户快照)}
+_cache = {}
+_lock = threading.Lock()
+
+# 变更后需要让缓存失效的用户属性
+INVALIDATING_ATTRIBUTES = ('password_hash', 'is_admin', 'is_active')
+
+
+def _snapshot(user):
+    """复制用户的列数据，生成一个不属于任何会话的分离对象"""
+    columns = {column.key: getattr(user, column.key) for column in User.__mapper__.column_attrs}
+    snapshot = User(**columns)
+    make_transient_to_detached(snapshot)
+    return snapshot
+
+
+def load_cached_user(user_id):
+    """
+    按ID加载用户，优先使用进程内缓存
+
+    Args:
+        user_id: 用户ID
+
+    Returns:
+        User: 绑定到当前会话的用户对象，不存在时返回None
+    """
+    ttl = current_app.config.get('USER_CACHE_TTL', 0)
+    if ttl <= 0:
+        return db.session.get(User, user_id)
+
+    now = time.monotonic()
+    entry = _cache.get(user_id)
+    if entry is not None and entry[0] > now:
+        return db.session.merge(entry[1], load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None:
+        snapshot = _snapshot(user)
+        with _lock:
+            _cache[user_id] = (now + ttl, snapshot)
+    return user
+
+
+def invalidate(user_id=None):
+    """
+    使缓存失效
+
+    Args:
+        user_id: 用户ID，为None时清空全部缓存
+    """
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+@event.listens_for(User, 'after_update')
+def _on_user_updated(mapper, connection, target):
+    """密码、权限或激活状态被修改并写入数据库时立即失效"""
+    state = inspect(target)
+    if any(state.attrs[key].history.has_changes() for key in INVALIDATING_ATTRIBUTES):
+        invalidate(target.id)
+        invalidation.publish_on_commit(target, 'user', target.id)
+
+
+@event.listens_for(User, 'after_delete')
+def _on_user_deleted(mapper, connection, target):
+    """用户被删除时失效"""
+    invalidate(target.id)
+    invalidation.publish_on_commit(target, 'user', target.id)
+
+
+def _on_message(user_ids):
+    """其他工作进程发布的失效消息"""
+    if user_ids is None:
+        invalidate()
+        return
+    for user_id in user_ids:
+        invalidate(int(user_id))
+
+
+invalidation.register('user', _on_message)
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+缓存预热模块
+部署或工作进程重启后，最先访问首页、产品列表和热门产品的用户要承担所有冷缓存的开销：
+快照和片段缓存未命中、模板未编译、压缩结果未缓存、图片在数据库缓冲区之外、外部存储中还没有落盘的图片副本。
+这里在进程内依次请求最热门的地址，把这些缓存提前填满：
+
+- 地址来源（按优先级）：命令行 --url / CACHE_WARM_URLS 配置的列表；CACHE_WARM_ACCESS_LOG 指定的
+  访问日志（Nginx combined 格式）中请求次数最多的前台页面和图片；都没有时使用首页、产品列表、
+  各分类第一页、推荐和最新产品的详情页及其图片
+- 页面按浏览器的 Accept-Encoding 请求，压缩结果进入缓存；IMAGE_OFFLOAD=auto 时图片请求带上
+  X-Sendfile-Type，外部存储中的图片副本随之落盘
+- 请求在有上限的线程池（CACHE_WARM_WORKERS）中并发执行，不做图片限流，结果包含每个地址的状态和耗时
+
+进程内的缓存属于每个工作进程，flask warm-cache 只能预热数据库、外部存储等共享的部分；
+CACHE_WARM_ON_BOOT=true 时 gunicorn.conf.py 在每个工作进程启动后、接受请求之前预热该进程
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from app.rate_limit import EXEMPT_ENVIRON_KEY
+
+# 预热页面时使用的 Accept-Encoding（与常见浏览器一致）
+BROWSER_ACCEPT_ENCODING = 'gzip, deflate, br'
+# 访问日志只读取末尾的字节数
+ACCESS_LOG_TAIL_BYTES = 32 * 1024 * 1024
+# combined 格式中的请求行和状态码
+ACCESS_LOG_PATTERN = re.compile(r'"(?:GET|HEAD) (\S+) HTTP/[\d.]+" (\d{3}) ')
+# 可以预热的前台地址
+WARMABLE_PATTERN = re.compile(r'^/(?:products|product/\d+|image/(?:product|gallery|page-content)/\d+)?$')
+# 产品列表保留的查询参数，其他参数（跟踪参数等）去掉后合并计数
+PRODUCTS_QUERY_KEYS = ('category', 'page')
+# 默认列表中的产品数量
+DEFAULT_PRODUCT_COUNT = 20
+
+
+def normalize_url(url):
+    """
+    把访问日志中的地址转换为预热地址
+
+    Returns:
+        str: 不是可以预热的前台地址时返回None
+    """
+    path, _, query = url.partition('?')
+    if not WARMABLE_PATTERN.match(path):
+        return None
+    if path != '/products':
+        return path
+    args = [(key, value) for key, value in parse_qsl(query) if key in PRODUCTS_QUERY_KEYS and value.isdigit()]
+    args = [(key, value) for key, value in args if not (key == 'page' and value == '1')]
+    return path + ('?' + urlencode(sorted(args)) if args else '')
+
+
+def urls_from_access_log(path, limit):
+    """
+    访问日志末尾中请求次数最多的地址（只统计成功的 GET/HEAD 请求）
+
+    Returns:
+        list: 按请求次数从多到少排列的地址
+    """
+    counts = Counter()
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - ACCESS_LOG_TAIL_BYTES))
+        for line in f:
+            match = ACCESS_LOG_PATTERN.search(line.decode('utf-8', 'replace'))
+            if match is None or match.group(2) not in ('200', '304'):
+                continue
+            url = normalize_url(match.group(1))
+            if url is not None:
+                counts[url] += 1
+    return [url for url, _ in counts.most_common(limit)]
+
+
+def default_urls(limit):
+    """
+    没有配置列表和访问日志时的地址：首页、产品列表、各分类第一页，推荐和最新产品的详情页及图片
+    需要在应用上下文中调用
+    """
+    from app import db
+    from app.models import Category, PageContent, Product, ProductImage
+
+    urls = ['/', '/products']
+    urls += [f'/products?category={row.id}' for row in db.session.query(Category.id).order_by(Category.created_at)]
+    products = db.session.query(Product.id, Product.main_image.isnot(None)).filter(Product.status == True).order_by(
+        Product.is_featured.desc(), Product.created_at.desc()).limit(DEFAULT_PRODUCT_COUNT).all()
+    product_ids = [row[0] for row in products]
+    urls += [f'/product/{product_id}' for product_id in product_ids]
+    urls += [f'/image/product/{product_id}' for product_id, has_image in products if has_image]
+    if product_ids:
+        gallery = db.session.query(ProductImage.id).filter(ProductImage.product_id.in_(product_ids)).order_by(
+            ProductImage.product_id, ProductImage.order)
+        urls += [f'/image/gallery/{row.id}' for row in gallery]
+    contents = db.session.query(PageContent.id).filter(
+        PageContent.page_key.like('home_%'), PageContent.image_data.isnot(None))
+    urls += [f'/image/page-content/{row.id}' for row in contents]
+    return urls[:limit]
+
+
+def warm_urls(app, urls=None, limit=None):
+    """
+    确定要预热的地址：参数或 CACHE_WARM_URLS、访问日志、默认列表
+
+    Returns:
+        tuple: (地址列表, 来源说明)
+    """
+    limit = limit or app.config.get('CACHE_WARM_LIMIT', 100)
+    configured = urls or [url.strip() for url in (app.config.get('CACHE_WARM_URLS') or '').split(',') if url.strip()]
+    if configured:
+        return list(dict.fromkeys(configured))[:limit], '配置的列表'
+    log_path = app.config.get('CACHE_WARM_ACCESS_LOG')
+    if log_path:
+        try:
+            found = urls_from_access_log(log_path, limit)
+        except OSError as e:
+            logging.warning(f'读取访问日志失败，使用默认地址预热: {str(e)}')
+        else:
+            if found:
+                return found, f'访问日志 {log_path}'
+    with app.app_context():
+        return default_urls(limit), '默认列表'
+
+
+def warm(app, urls=None, workers=None, limit=None):
+    """
+    并发请求预热地址
+
+    Args:
+        app: Flask应用实例
+        urls: 地址列表，默认按 warm_urls() 确定
+        workers: 并发线程数，默认 CACHE_WARM_WORKERS
+        limit: 最多预热的地址数，默认 CACHE_WARM_LIMIT
+
+    Returns:
+        dict: {'source': 地址来源, 'results': [(地址, 状态码, 耗时秒, 字节数)]（按地址顺序）, 'elapsed': 总耗时}
+    """
+    urls, source = warm_urls(app, urls, limit)
+    workers = max(1, workers or app.config.get('CACHE_WARM_WORKERS', 4))
+    headers = {'Accept-Encoding': BROWSER_ACCEPT_ENCODING}
+    offload = (app.config.get('IMAGE_OFFLOAD') or 'off').lower()
+    image_headers = {'X-Sendfile-Type': 'X-Accel-Redirect'} if offload == 'auto' else {}
+    local = threading.local()
+
+    def fetch(url):
+        client = getattr(local, 'client', None)
+        if client is None:
+            # 每个线程一个测试客户端（不带会话 Cookie，按匿名用户渲染），预热请求不做限流
+            client = local.client = app.test_client()
+            client.environ_base[EXEMPT_ENVIRON_KEY] = True
+        start = time.perf_counter()
+        response = client.get(url, headers=image_headers if url.startswith('/image/') else headers)
+        try:
+            size = len(response.get_data())
+        finally:
+            response.close()
+        return url, response.status_code, time.perf_counter() - start, size
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='cache-warm') as executor:
+        results = list(executor.map(fetch, urls))
+    return {'source': source, 'results': results, 'elapsed': time.perf_counter() - start}
+
+
+def summarize(report):
+    """预热结果的统计：地址数、失败数、耗时分位数（秒）"""
+    durations = sorted(result[2] for result in report['results'])
+
+    def pick(fraction):
+        if not durations:
+            return 0.0
+        return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+    return {
+        'count': len(durations),
+        'failed': sum(1 for result in report['results'] if result[1] >= 400),
+        'elapsed': report['elapsed'],
+        'p50': pick(0.5),
+        'p95': pick(0.95),
+        'max': durations[-1] if durations else 0.0,
+    }
+
+
+def warm_on_boot(app):
+    """
+    工作进程启动后的预热（由 gunicorn.conf.py 的 post_worker_init 调用），CACHE_WARM_ON_BOOT 未开启时不做处理
+    预热失败只记录日志，不影响工作进程启动
+    """
+    if not app.config.get('CACHE_WARM_ON_BOOT'):
+        return None
+    try:
+        report = warm(app)
+    except Exception as e:
+        logging.error(f'工作进程 {os.getpid()} 缓存预热失败: {str(e)}')
+        return None
+    stats = summarize(report)
+    logging.info(f"工作进程 {os.getpid()} 缓存预热完成（{report['source']}）：{stats['count']} 个地址，"
+                 f"失败 {stats['failed']} 个，耗时 {stats['elapsed']:.2f}s，p95 {stats['p95'] * 1000:.0f}ms")
+    return report
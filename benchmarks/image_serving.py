@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+图片服务基准测试
+对比完整 Flask 应用中的 main.get_product_image 与轻量图片服务（app/image_server.py）的每秒请求数
+
+用法（使用临时 SQLite 数据库，不影响现有数据）：
+    python benchmarks/image_serving.py [--requests 2000] [--size 65536]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(client, urls, headers=None):
+    """依次请求所有地址，返回每秒请求数"""
+    start = time.perf_counter()
+    for url in urls:
+        response = client.get(url, headers=headers)
+        assert response.status_code in (200, 304), (url, response.status_code)
+        response.close()
+    return len(urls) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='图片服务基准测试')
+    parser.add_argument('--requests', type=int, default=2000, help='每组测试的请求数')
+    parser.add_argument('--products', type=int, default=50, help='产品数量')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='每张图片的字节数')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='image-bench-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ['BLOB_STORE_PATH'] = os.path.join(workdir, 'blobs')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['STATS_RECONCILE_INTERVAL'] = '0'
+    # 不包装并发限制中间件，wsgi_app 直接是 DispatcherMiddleware
+    os.environ['LOAD_SHEDDING_ENABLED'] = 'false'
+    # 所有请求来自同一个客户端，不做图片限流
+    os.environ['IMAGE_RATE_LIMIT_ENABLED'] = 'false'
+
+    from werkzeug.test import Client
+    from app import create_app, db
+    from app.models import Category, Product
+    from app.image_server import create_image_app
+
+    app = create_app('production')
+    with app.app_context():
+        db.create_all()
+        category = Category(name='基准测试')
+        db.session.add(category)
+        db.session.flush()
+        for i in range(args.products):
+            db.session.add(Product(name=f'产品{i}', category_id=category.id, status=True,
+                                   main_image=os.urandom(args.size), main_image_mimetype='image/jpeg'))
+        db.session.commit()
+    urls = [f'/image/product/{i % args.products + 1}' for i in range(args.requests)]
+
+    # 完整 Flask 应用（关闭轻量图片服务，请求由 main.get_product_image 处理）
+    flask_app = create_app('production')
+    if app.config['IMAGE_APP_ENABLED']:
+        # 去掉 DispatcherMiddleware，恢复原来的 wsgi_app
+        flask_app.wsgi_app = flask_app.wsgi_app.app
+    flask_client = flask_app.test_client()
+
+    # 挂载在 Flask 应用上的轻量图片服务
+    mounted_client = app.test_client()
+
+    # 独立运行的轻量图片服务
+    standalone_client = Client(create_image_app('production'))
+
+    results = [
+        ('Flask main.get_product_image', run(flask_client, urls)),
+        ('挂载在 /image/ 的图片服务', run(mounted_client, urls)),
+        ('独立运行的图片服务', run(standalone_client, [url[len('/image'):] for url in urls])),
+    ]
+    etag = mounted_client.get(urls[0]).headers['ETag']
+    results.append(('图片服务条件请求（304）', run(mounted_client, [urls[0]] * args.requests, {'If-None-Match': etag})))
+
+    baseline = results[0][1]
+    print(f'{args.requests} 个请求，图片大小 {args.size} 字节')
+    for name, rps in results:
+        print(f'{name:<32} {rps:10.1f} 请求/秒  ({rps / baseline:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+过载模拟
+模拟数据库饱和（每条语句固定耗时，同时执行的语句数量有上限）时大量并发的图片和页面请求，
+分别在关闭和开启并发限制（app/load_shedding.py）时统计延迟分布、503 比例和返回缓存页面的次数
+
+用法（使用临时 SQLite 数据库，不影响现有数据）：
+    python benchmarks/overload.py [--clients 200] [--duration 5] [--max-p99 1.5]
+
+开启并发限制时 p99 超过 --max-p99 秒则以非零状态退出
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, fraction):
+    """分位数（values 已排序）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def prepare(workdir, products=20, image_size=32 * 1024):
+    """创建临时数据库和示例数据，返回产品ID列表"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'overload.db')}"
+    os.environ['BLOB_STORE_PATH'] = os.path.join(workdir, 'blobs')
+    os.environ.setdefault('SECRET_KEY', 'overload')
+    os.environ['STATS_RECONCILE_INTERVAL'] = '0'
+    os.environ['CACHE_BUS_ENABLED'] = 'false'
+    os.environ['RELATED_PRODUCTS_AUTO_REFRESH'] = 'false'
+    # 每个请求都读取快照表，页面请求同样需要数据库
+    os.environ['SNAPSHOT_LOCAL_TTL'] = '0'
+    # 所有请求来自同一个客户端，不做图片限流
+    os.environ['IMAGE_RATE_LIMIT_ENABLED'] = 'false'
+
+    from app import create_app, db
+    from app.models import Category, Product
+
+    app = create_app('production')
+    with app.app_context():
+        db.create_all()
+        category = Category(name='过载测试')
+        db.session.add(category)
+        db.session.flush()
+        for i in range(products):
+            db.session.add(Product(name=f'产品{i}', category_id=category.id, status=True,
+                                   main_image=os.urandom(image_size), main_image_mimetype='image/jpeg'))
+        db.session.commit()
+        return [row[0] for row in db.session.query(Product.id)]
+
+
+def slow_database(delay, capacity):
+    """
+    让所有引擎的每条语句耗时 delay 秒，同时最多执行 capacity 条，模拟饱和的数据库
+
+    Returns:
+        function: 取消模拟的函数
+    """
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    slots = threading.BoundedSemaphore(capacity)
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        with slots:
+            time.sleep(delay)
+
+    event.listen(Engine, 'before_cursor_execute', before_execute)
+    return lambda: event.remove(Engine, 'before_cursor_execute', before_execute)
+
+
+def simulate(app, urls, clients=200, duration=5.0, backoff=0.1):
+    """
+    多个线程在 duration 秒内不断请求 urls 中的随机地址，收到 503 后等待 backoff 秒再发下一个请求
+
+    Returns:
+        dict: latencies（所有请求的耗时，已排序）、statuses（{状态码: 数量}）、stale（返回缓存页面的次数）
+    """
+    from werkzeug.test import Client
+
+    latencies, statuses, stale = [], {}, [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(seed):
+        client = Client(app.wsgi_app)
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            url = rng.choice(urls)
+            start = time.monotonic()
+            response = client.get(url)
+            response.get_data()
+            response.close()
+            elapsed = time.monotonic() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.headers.get('X-Load-Shed') == 'stale':
+                    stale[0] += 1
+            if response.status_code == 503:
+                time.sleep(backoff)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+    return {'latencies': latencies, 'statuses': statuses, 'stale': stale[0]}
+
+
+def report(name, result):
+    latencies = result['latencies']
+    total = len(latencies) or 1
+    shed = result['statuses'].get(503, 0)
+    print(f'{name}: {len(latencies)} 个请求  p50 {percentile(latencies, 0.5):.3f}s  '
+          f'p99 {percentile(latencies, 0.99):.3f}s  max {latencies[-1] if latencies else 0:.3f}s  '
+          f'503 {shed / total:.1%}  缓存页面 {result["stale"]}  状态 {result["statuses"]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='过载模拟')
+    parser.add_argument('--clients', type=int, default=200, help='并发客户端数量')
+    parser.add_argument('--duration', type=float, default=5.0, help='每组模拟的秒数')
+    parser.add_argument('--delay', type=float, default=0.02, help='每条语句的耗时（秒）')
+    parser.add_argument('--capacity', type=int, default=4, help='数据库同时执行的语句数量')
+    parser.add_argument('--max-p99', type=float, default=1.5, help='开启并发限制时允许的 p99（秒）')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='overload-')
+    product_ids = prepare(workdir)
+    urls = [f'/image/product/{i}' for i in product_ids] * 3 + ['/', '/products'] + \
+        [f'/product/{i}' for i in product_ids[:5]]
+
+    from app import create_app
+
+    limited = create_app('production')
+    unlimited = create_app('production')
+    # 去掉并发限制中间件
+    unlimited.wsgi_app = unlimited.extensions['load_shedding'].wsgi_app
+
+    # 预热：页面进入缓存
+    for app in (unlimited, limited):
+        client = app.test_client()
+        for url in set(urls):
+            client.get(url).close()
+
+    restore = slow_database(args.delay, args.capacity)
+    try:
+        report('关闭并发限制', simulate(unlimited, urls, args.clients, args.duration))
+        result = simulate(limited, urls, args.clients, args.duration)
+        report('开启并发限制', result)
+    finally:
+        restore()
+    print('各分组状态:', limited.extensions['load_shedding'].snapshot())
+    p99 = percentile(result['latencies'], 0.99)
+    if p99 > args.max_p99:
+        print(f'p99 {p99:.3f}s 超过 {args.max_p99}s')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置文件（在项目根目录启动 gunicorn 时自动读取）
+其余参数仍在命令行中指定，例如: gunicorn -w 4 -b 0.0.0.0:5000 app:app
+"""
+
+
+def post_worker_init(worker):
+    """
+    工作进程加载应用之后、开始接受请求之前预热进程内缓存（CACHE_WARM_ON_BOOT=true 时）
+    预热完成前该进程不处理请求，负载均衡的健康检查也就不会把请求发给冷进程
+    """
+    from flask import Flask
+    from app.warmup import warm_on_boot
+
+    if isinstance(worker.wsgi, Flask):
+        warm_on_boot(worker.wsgi)
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+测试公共夹具
+每个测试使用临时目录中的 SQLite 文件数据库（create_app('testing')），不需要 PostgreSQL：
+
+- app / client：空数据库的应用和测试客户端
+- catalog：写入一份有代表性的产品目录（分类、产品、主图、图库、首页内容、联系表单、管理员）
+- admin_client：已登录管理员的测试客户端
+- queries：记录执行的 SQL 语句数量和从图片列读取的字节数
+
+测试可以用 @pytest.mark.config(名称=值) 覆盖应用配置
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+from sqlalchemy import event, types
+from sqlalchemy.engine import Engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import TestingConfig  # noqa: E402
+
+# 目录规模：分类数、每个分类的产品数、每个产品的图库图片数
+CATEGORY_COUNT = 4
+PRODUCTS_PER_CATEGORY = 15
+GALLERY_PER_PRODUCT = 2
+# 每张图片的字节数
+IMAGE_SIZE = 16 * 1024
+# 首页推荐产品数量
+FEATURED_COUNT = 6
+# 联系表单数量（其中一半未读）
+CONTACT_COUNT = 20
+ADMIN_USERNAME = 'admin'
+ADMIN_PASSWORD = 'admin123'
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'config(**settings): 覆盖测试应用的配置')
+
+
+def image_bytes(seed, size=IMAGE_SIZE):
+    """确定性的图片数据（内容随 seed 变化）"""
+    start = seed % 251
+    return (bytes(range(251)) * (size // 251 + 2))[start:start + size]
+
+
+class QueryRecorder:
+    """
+    统计一段代码执行的 SQL 语句和从 LargeBinary 列读取的字节数
+    只统计进入 with 的线程（测试客户端在当前线程中处理请求），后台线程（如图片回收）的语句不计入
+
+    用法:
+        with queries:
+            client.get('/')
+        queries.count, queries.blob_bytes
+    """
+
+    def __init__(self):
+        self.statements = []
+        self.blob_bytes = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.reset()
+        self._thread = threading.get_ident()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.statements = []
+            self.blob_bytes = 0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def record_statement(self, statement):
+        if self._thread == threading.get_ident():
+            with self._lock:
+                self.statements.append(statement)
+
+    def record_blob(self, size):
+        if self._thread == threading.get_ident():
+            with self._lock:
+                self.blob_bytes += size
+
+    def report(self):
+        """失败信息中列出的语句"""
+        return '\n'.join(f'  {i + 1}. {" ".join(s.split())[:200]}' for i, s in enumerate(self.statements))
+
+
+@pytest.fixture
+def queries(monkeypatch):
+    """
+    语句计数和图片字节计数
+    LargeBinary 的结果处理函数按方言缓存，需要在创建应用（引擎）之前替换，因此 app 夹具依赖本夹具
+    """
+    recorder = QueryRecorder()
+    original = types.LargeBinary.result_processor
+
+    def result_processor(self, dialect, coltype):
+        process = original(self, dialect, coltype)
+
+        def counted(value):
+            if process is not None:
+                value = process(value)
+            if value is not None:
+                recorder.record_blob(len(value))
+            return value
+        return counted
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        recorder.record_statement(statement)
+
+    monkeypatch.setattr(types.LargeBinary, 'result_processor', result_processor)
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    yield recorder
+    event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+
+@pytest.fixture
+def app(request, tmp_path, monkeypatch, queries):
+    """临时 SQLite 数据库上的测试应用（已建表）"""
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'BLOB_STORE_PATH': str(tmp_path / 'blobs'),
+        'STATIC_EXPORT_DIR': str(tmp_path / 'export'),
+        'PROFILER_DIR': str(tmp_path / 'profiles'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': '',
+    }
+    marker = request.node.get_closest_marker('config')
+    if marker is not None:
+        settings.update(marker.kwargs)
+    for key, value in settings.items():
+        monkeypatch.setattr(TestingConfig, key, value)
+
+    from app import create_app, db, invalidation
+
+    app = create_app('testing')
+    with app.app_context():
+        # 只在默认引擎上建表：db.metadatas 是进程级的，其他测试配置过的绑定（如只读副本）也在其中
+        db.create_all(bind_key=None)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    # 进程内缓存（页面快照、模板片段、登录用户）不能带到下一个测试的新数据库
+    invalidation._clear_all()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def seed_catalog(app, categories=CATEGORY_COUNT, per_category=PRODUCTS_PER_CATEGORY, gallery=GALLERY_PER_PRODUCT,
+                 with_admin=True):
+    """
+    写入产品目录（可以多次调用，追加新的分类和产品）和管理员账户，并计算相关产品推荐
+
+    Returns:
+        dict: 各类记录的ID
+    """
+    from app import db, stats
+    from app.models import Category, Contact, PageContent, Product, ProductImage, User
+    from app.recommendations import refresh
+
+    with app.app_context():
+        admin = None
+        if with_admin:
+            admin = User(username=ADMIN_USERNAME, email='admin@example.com', is_admin=True)
+            admin.password = ADMIN_PASSWORD
+            db.session.add(admin)
+        category_offset = db.session.query(db.func.count(Category.id)).scalar()
+        product_offset = db.session.query(db.func.count(Product.id)).scalar()
+
+        category_ids, product_ids, image_ids = [], [], []
+        for c in range(category_offset, category_offset + categories):
+            category = Category(name=f'分类{c}', description=f'第{c}类设备')
+            db.session.add(category)
+            db.session.flush()
+            category_ids.append(category.id)
+            for p in range(per_category):
+                n = product_offset + (c - category_offset) * per_category + p
+                product = Product(
+                    name=f'数控机床 {n}', description=f'高精度加工设备 {n}', brand=f'品牌{n % 3}',
+                    category_id=category.id, status=n % 10 != 9, is_featured=n < FEATURED_COUNT,
+                    price=1000 + n, advantages='精度高\n效率高', service_tags='["一年质保服务"]',
+                    technical_specs='{"功率": "5kW"}', tab_contents='{"详细参数": "内容"}',
+                    main_image=image_bytes(n), main_image_filename=f'p{n}.jpg', main_image_mimetype='image/jpeg',
+                )
+                db.session.add(product)
+                db.session.flush()
+                product_ids.append(product.id)
+                for g in range(gallery):
+                    image = ProductImage(product_id=product.id, image_data=image_bytes(n + g + 1),
+                                         filename=f'p{n}-{g}.jpg', mimetype='image/jpeg', order=g)
+                    db.session.add(image)
+                    db.session.flush()
+                    image_ids.append(image.id)
+
+        hero = PageContent.query.filter_by(page_key='home_hero_image').first()
+        if hero is None:
+            hero = PageContent(page_key='home_hero_image', content_type='image', image_data=image_bytes(7),
+                               image_filename='hero.jpg', image_mimetype='image/jpeg')
+            db.session.add(hero)
+            db.session.add(PageContent(page_key='home_hero_title', content_type='text', content_value='精密机械'))
+        contact_ids = []
+        for i in range(CONTACT_COUNT):
+            contact = Contact(name=f'客户{i}', email=f'c{i}@example.com', phone='13800000000',
+                              subject=f'询价{i}', message='请报价', is_read=i % 2 == 0)
+            db.session.add(contact)
+            db.session.flush()
+            contact_ids.append(contact.id)
+        db.session.commit()
+        stats.reconcile()
+        db.session.commit()
+        refresh()
+        return {
+            'categories': category_ids,
+            'products': product_ids,
+            'images': image_ids,
+            'contacts': contact_ids,
+            'page_content': hero.id,
+            'admin': admin.id if admin is not None else None,
+        }
+
+
+@pytest.fixture
+def catalog(app):
+    """有代表性的产品目录"""
+    return seed_catalog(app)
+
+
+def login(client, username=ADMIN_USERNAME, password=ADMIN_PASSWORD):
+    response = client.post('/auth/login', data={'username': username, 'password': password}, buffered=True)
+    assert response.status_code == 302, response.status_code
+    return client
+
+
+@pytest.fixture
+def admin_client(app, catalog):
+    """已登录管理员的测试客户端"""
+    return login(app.test_client())
+
+
+def timed(client, method, url, **kwargs):
+    """
+    发送请求并读取完整响应（buffered：响应结束时释放并发限制的名额）
+
+    Returns:
+        tuple: (响应, 耗时秒)
+    """
+    start = time.perf_counter()
+    response = client.open(url, method=method, buffered=True, **kwargs)
+    response.get_data()
+    return response, time.perf_counter() - start
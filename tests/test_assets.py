@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+静态资源构建（app/asset_pipeline.py）：重新构建后上一次构建的带哈希文件仍可访问（滚动发布期间的旧页面），
+更早的构建被删除
+"""
+import pytest
+
+
+@pytest.fixture
+def build(app, tmp_path, monkeypatch):
+    """用给定的样式内容代替 Tailwind 编译结果构建资源，返回 site.css 的带哈希文件名"""
+    from app import asset_pipeline
+
+    app.config['ASSET_OUTPUT_DIR'] = str(tmp_path / 'dist')
+
+    def run(css):
+        monkeypatch.setattr(asset_pipeline, '_compile_tailwind', lambda *args: css)
+        with app.app_context():
+            return asset_pipeline.build_assets(app, tailwind=['tailwindcss'])['site.css']
+    return run
+
+
+def test_previous_build_stays_servable(app, client, build):
+    first = build('.a{color:red}')
+    second = build('.a{color:blue}')
+    assert first != second
+    for filename in (first, second):
+        response = client.get(f'/assets/{filename}', buffered=True)
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+
+    third = build('.a{color:green}')
+    assert client.get(f'/assets/{second}', buffered=True).status_code == 200
+    assert client.get(f'/assets/{third}', buffered=True).status_code == 200
+    assert client.get(f'/assets/{first}', buffered=True).status_code == 404
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+跨进程缓存失效：多个工作进程共用一个 SQLite 文件数据库（轮询方式的消息总线），
+一个进程修改产品后，其他进程的进程内快照缓存在几个轮询周期内更新
+"""
+import multiprocessing
+import time
+
+import pytest
+
+from conftest import seed_catalog
+
+POLL_INTERVAL = 0.1
+WORKERS = 3
+# 等待其他进程更新的最长时间（秒）
+CONVERGE_TIMEOUT = 10
+
+
+def _worker(settings, product_id, old_name, new_name, ready, results):
+    """工作进程：缓存产品详情页，启动监听线程，等待页面显示新名称"""
+    from config import TestingConfig
+
+    for key, value in settings.items():
+        setattr(TestingConfig, key, value)
+    from app import create_app, invalidation
+
+    app = create_app('testing')
+    client = app.test_client()
+    url = f'/product/{product_id}'
+    assert old_name in client.get(url, buffered=True).get_data(as_text=True)
+    invalidation.start_listener(app)
+    ready.put(True)
+    deadline = time.monotonic() + CONVERGE_TIMEOUT
+    while time.monotonic() < deadline:
+        if new_name in client.get(url, buffered=True).get_data(as_text=True):
+            results.put(True)
+            return
+        time.sleep(POLL_INTERVAL / 2)
+    results.put(False)
+
+
+@pytest.mark.config(CACHE_BUS_ENABLED=True, CACHE_BUS_POLL_INTERVAL=POLL_INTERVAL, SNAPSHOT_LOCAL_TTL=3600)
+def test_invalidation_reaches_other_processes(app):
+    from app import db
+    from app.models import Product
+
+    catalog = seed_catalog(app, categories=1, per_category=2, gallery=0)
+    product_id = catalog['products'][0]
+    with app.app_context():
+        old_name = db.session.get(Product, product_id).name
+    settings = {key: app.config[key] for key in (
+        'SQLALCHEMY_DATABASE_URI', 'BLOB_STORE_PATH', 'STATIC_EXPORT_DIR', 'PROFILER_DIR',
+        'TEMPLATE_BYTECODE_CACHE_DIR', 'CACHE_BUS_ENABLED', 'CACHE_BUS_POLL_INTERVAL', 'SNAPSHOT_LOCAL_TTL')}
+
+    context = multiprocessing.get_context('spawn')
+    ready, results = context.Queue(), context.Queue()
+    processes = [context.Process(target=_worker, args=(settings, product_id, old_name, '改名产品', ready, results))
+                 for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    try:
+        for _ in processes:
+            ready.get(timeout=60)
+        with app.app_context():
+            db.session.get(Product, product_id).name = '改名产品'
+            db.session.commit()
+        converged = [results.get(timeout=CONVERGE_TIMEOUT + 30) for _ in processes]
+    finally:
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+    assert converged == [True] * WORKERS
+
+
+def test_publish_on_commit_uses_flushing_session(app, monkeypatch):
+    """映射事件的消息记在执行 flush 的会话上，由该会话提交后发布；不带键时清空整个命名空间"""
+    from app import db, invalidation
+    from app.models import Category
+
+    published = []
+    monkeypatch.setattr(invalidation, 'publish', lambda namespace, *keys: published.append((namespace, keys)))
+    with app.app_context():
+        other = db.session.session_factory()
+        try:
+            category = Category(name='其他会话')
+            other.add(category)
+            other.flush()
+            category_id = category.id
+            invalidation.publish_on_commit(category, 'test')
+            assert 'invalidation_messages' not in db.session.info
+            other.commit()
+        finally:
+            other.close()
+    assert ('fragment', ('categories', f'categories:{category_id}')) in published
+    assert ('test', ()) in published
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+进程内产品目录（app/catalog.py）：前台页面在目录生成后不查询数据库，结果与数据库查询一致，
+修改后重新生成
+"""
+import time
+
+import pytest
+
+from conftest import FEATURED_COUNT, PRODUCTS_PER_CATEGORY, timed
+
+
+def test_warm_pages_do_not_query(app, catalog, queries):
+    urls = ['/', '/products', f"/products?category={catalog['categories'][1]}&page=2",
+            f"/product/{catalog['products'][0]}", '/contact']
+    client = app.test_client()
+    for url in urls:
+        timed(client, 'GET', url)
+    for url in urls:
+        with queries:
+            response, _ = timed(client, 'GET', url)
+        assert response.status_code == 200
+        assert queries.count == 0, f'{url}:\n{queries.report()}'
+
+
+def test_listing_matches_database(app, catalog):
+    from app import catalog as catalog_module, db
+    from app.models import Product
+
+    with app.app_context():
+        current = catalog_module.current()
+        for category_id in [None] + catalog['categories']:
+            query = Product.query.filter_by(status=True)
+            if category_id:
+                query = query.filter_by(category_id=category_id)
+            expected = [p.id for p in query.order_by(Product.created_at.desc(), Product.id.desc())]
+            assert [p.id for p in current.listing(category_id)] == expected
+            pagination = current.paginate(category_id, page=2)
+            assert [p.id for p in pagination.items] == expected[9:18]
+            assert pagination.total == len(expected)
+        assert all(p in current.listing() for p in current.home_products())
+        assert sum(1 for p in current.home_products() if p.is_featured) == FEATURED_COUNT
+        inactive = db.session.query(Product.id).filter_by(status=False).first()[0]
+        assert current.product(inactive) is None
+
+
+def test_related_products_exclude_unpublished(app, catalog):
+    from app import catalog as catalog_module
+
+    with app.app_context():
+        current = catalog_module.current()
+        for product in current.products:
+            related = current.related(product.id, product.category_id)
+            assert related
+            assert product not in related
+            assert all(current.product(p.id) is p for p in related)
+
+
+def test_admin_change_rebuilds_catalog(admin_client, catalog):
+    # 第一个分类中最新的产品（列表第一页）
+    product_id = catalog['products'][PRODUCTS_PER_CATEGORY - 1]
+    category_id = catalog['categories'][0]
+    assert '改名产品' not in admin_client.get(f'/products?category={category_id}', buffered=True).get_data(as_text=True)
+    response = admin_client.post(f'/admin/products/{product_id}/edit', data={
+        'name': '改名产品', 'description': '描述', 'category_id': category_id, 'status': 'y', 'stock': '1'},
+        buffered=True)
+    assert response.status_code == 302
+    assert '改名产品' in admin_client.get(f'/products?category={category_id}', buffered=True).get_data(as_text=True)
+
+    # 批量下架不触发ORM事件，由视图调用 catalog.invalidate()
+    admin_client.post('/admin/products/bulk', data={'action': 'unpublish', 'ids': [product_id]}, buffered=True)
+    assert '改名产品' not in admin_client.get(f'/products?category={category_id}', buffered=True).get_data(as_text=True)
+
+
+@pytest.mark.config(CATALOG_BACKGROUND_REBUILD=True, CATALOG_REBUILD_DELAY=0)
+def test_background_rebuild_swaps_reference(app, catalog):
+    from app import catalog as catalog_module, db
+    from app.models import Product
+
+    product_id = catalog['products'][0]
+    with app.test_request_context():
+        old = catalog_module.current()
+        product = db.session.get(Product, product_id)
+        product.name = '后台重新生成'
+        db.session.commit()
+        # 新目录生成之前仍然使用旧目录，旧目录本身不变
+        deadline = time.monotonic() + 5
+        while catalog_module.current() is old and time.monotonic() < deadline:
+            time.sleep(0.01)
+        new = catalog_module.current()
+    assert new is not old
+    assert old.product(product_id).name != '后台重新生成'
+    assert new.product(product_id).name == '后台重新生成'
+
+
+@pytest.mark.config(CATALOG_BACKGROUND_REBUILD=True, CATALOG_REBUILD_DELAY=0.5)
+def test_footer_fragment_follows_background_rebuild(app, catalog):
+    """重新生成目录之前渲染的页脚分类导航（旧名称）在新目录替换后失效"""
+    from app import catalog as catalog_module, db
+    from app.models import Category
+
+    def footer():
+        html = client.get('/products', buffered=True).get_data(as_text=True)
+        return html[html.index('产品系列'):]
+
+    client = app.test_client()
+    footer()
+    with app.app_context():
+        old = catalog_module.current()
+        db.session.get(Category, catalog['categories'][0]).name = '改名分类'
+        db.session.commit()
+    # 新目录生成之前，页脚按旧目录重新缓存
+    assert '改名分类' not in footer()
+    deadline = time.monotonic() + 5
+    while catalog_module.current() is old and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert '改名分类' in footer()
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+图片服务：卸载给代理发送（X-Accel-Redirect）、限流和防盗链
+"""
+import os
+
+import pytest
+
+from conftest import image_bytes
+
+ACCEL_PREFIX = '/_blobs/'
+
+
+def proxy_get(client, url, store_root, **kwargs):
+    """
+    模拟 Nginx：声明支持 X-Accel-Redirect，收到卸载响应后从 internal location（外部存储目录）读取文件
+
+    Returns:
+        tuple: (应用的响应, 代理返回给浏览器的内容)
+    """
+    headers = dict(kwargs.pop('headers', {}), **{'X-Sendfile-Type': 'X-Accel-Redirect'})
+    response = client.get(url, headers=headers, buffered=True, **kwargs)
+    redirect = response.headers.get('X-Accel-Redirect')
+    if redirect is None:
+        return response, response.get_data()
+    assert redirect.startswith(ACCEL_PREFIX)
+    with open(os.path.join(store_root, redirect[len(ACCEL_PREFIX):]), 'rb') as f:
+        return response, f.read()
+
+
+@pytest.mark.config(IMAGE_OFFLOAD='auto', IMAGE_OFFLOAD_ACCEL_PREFIX=ACCEL_PREFIX)
+@pytest.mark.parametrize('kind', ['product', 'gallery'])
+def test_offload_writes_variant_and_redirects(app, client, catalog, kind):
+    store_root = app.config['BLOB_STORE_PATH']
+    if kind == 'product':
+        url, expected = f"/image/product/{catalog['products'][0]}", image_bytes(0)
+    else:
+        url, expected = f"/image/gallery/{catalog['images'][0]}", image_bytes(1)
+
+    response, body = proxy_get(client, url, store_root)
+    assert response.status_code == 200
+    assert response.get_data() == b''
+    assert body == expected
+    assert os.path.isdir(os.path.join(store_root, kind))
+
+    # 第二次请求直接使用已经落盘的副本
+    again, body = proxy_get(client, url, store_root)
+    assert again.headers['X-Accel-Redirect'] == response.headers['X-Accel-Redirect']
+    assert body == expected
+
+
+@pytest.mark.config(IMAGE_OFFLOAD='auto')
+def test_offload_needs_proxy_declaration(app, client, catalog):
+    """直接访问应用（没有 X-Sendfile-Type）时由应用发送图片数据"""
+    response = client.get(f"/image/product/{catalog['products'][0]}", buffered=True)
+    assert response.status_code == 200
+    assert 'X-Accel-Redirect' not in response.headers
+    assert response.get_data() == image_bytes(0)
+
+
+def test_offload_is_off_by_default(app, client, catalog):
+    """默认不信任客户端发送的 X-Sendfile-Type：不返回文件路径，也不把图片写入磁盘"""
+    response = client.get(f"/image/product/{catalog['products'][0]}", headers={'X-Sendfile-Type': 'X-Sendfile'},
+                          buffered=True)
+    assert response.status_code == 200
+    assert 'X-Sendfile' not in response.headers
+    assert response.get_data() == image_bytes(0)
+    assert not os.path.isdir(os.path.join(app.config['BLOB_STORE_PATH'], 'product'))
+
+
+@pytest.mark.config(IMAGE_RATE_LIMIT_IP_BURST=3, IMAGE_RATE_LIMIT_IP_RATE=0.01)
+def test_rate_limit_per_ip(client, catalog):
+    url = f"/image/product/{catalog['products'][0]}"
+    statuses = [client.get(url, buffered=True).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+    response = client.get(url, buffered=True)
+    assert int(response.headers['Retry-After']) >= 1
+    # 其他 IP 不受影响
+    assert client.get(url, environ_base={'REMOTE_ADDR': '10.0.0.2'}, buffered=True).status_code == 200
+
+
+@pytest.mark.config(IMAGE_HOTLINK_POLICY='block')
+def test_hotlink_block(client, catalog):
+    url = f"/image/product/{catalog['products'][0]}"
+    assert client.get(url, headers={'Referer': 'https://other.example.com/page'}, buffered=True).status_code == 403
+    assert client.get(url, headers={'Referer': 'http://localhost/products'}, buffered=True).status_code == 200
+    assert client.get(url, buffered=True).status_code == 200
+
+
+def test_memory_prune_keeps_buckets_that_are_still_refilling(monkeypatch):
+    """清理时按每个桶自己的容量和速度判断，IP 桶的清理不会让慢速补充的引用域名桶回满"""
+    from app import rate_limit
+
+    backend = rate_limit.MemoryBackend()
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limit.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(rate_limit, 'MEMORY_PRUNE_SIZE', 1)
+    # 引用域名桶：容量 2，每秒补充 0.1 个，20 秒回满
+    assert backend.take('ref:other.example.com', 2, 0.1, cost=2) == 0.0
+    clock[0] += 7
+    # IP 桶：容量 60，每秒补充 10 个，6 秒回满；超过清理阈值时触发清理
+    assert backend.take('ip:10.0.0.1', 60, 10) == 0.0
+    assert backend.take('ref:other.example.com', 2, 0.1) > 0
+
+
+@pytest.mark.config(IMAGE_RATE_LIMIT_IP_BURST=3, IMAGE_RATE_LIMIT_IP_RATE=0.01)
+def test_admin_thumbnails_are_not_rate_limited(admin_client, catalog):
+    """后台产品列表的缩略图远多于 IP 桶的容量"""
+    statuses = {admin_client.get(f'/image/product/{product_id}', headers={'Referer': 'http://localhost/admin/products'},
+                                 buffered=True).status_code for product_id in catalog['products']}
+    assert statuses == {200}
+    # 登出后恢复限流
+    admin_client.get('/auth/logout', buffered=True)
+    url = f"/image/product/{catalog['products'][0]}"
+    assert {admin_client.get(url, buffered=True).status_code for _ in range(4)} == {200, 429}
+
+
+@pytest.mark.config(IMAGE_RATE_LIMIT_IP_BURST=3, IMAGE_RATE_LIMIT_IP_RATE=0.01,
+                    IMAGE_RATE_LIMIT_PAGE_BURST=20, IMAGE_RATE_LIMIT_PAGE_RATE=0.01)
+def test_same_site_page_uses_page_bucket(client, catalog):
+    page = {'Referer': 'http://localhost/products'}
+    urls = [f'/image/product/{product_id}' for product_id in catalog['products'][:20]]
+    assert {client.get(url, headers=page, buffered=True).status_code for url in urls} == {200}
+    assert client.get(urls[0], headers=page, buffered=True).status_code == 429
+    # 直接访问（没有 Referer）使用 IP 桶
+    assert client.get(urls[0], buffered=True).status_code == 200
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+过载：数据库饱和时大量并发的页面和图片请求，开启并发限制后 p99 仍在预算内，
+超出容量的请求返回 503（或缓存页面），不会排队等待到超时（模拟方法见 benchmarks/overload.py）
+"""
+import os
+
+import pytest
+
+from benchmarks.overload import percentile, simulate, slow_database
+
+CLIENTS = 50
+DURATION = 2.0
+# 每条语句的耗时（秒）和数据库同时执行的语句数量
+STATEMENT_DELAY = 0.02
+DATABASE_CAPACITY = 4
+MAX_P99 = 1.5 * float(os.environ.get('QUERY_BUDGET_TIME_SCALE') or 1)
+
+
+@pytest.mark.config(IMAGE_RATE_LIMIT_ENABLED=False, SNAPSHOT_LOCAL_TTL=0)
+def test_p99_under_saturation(app, catalog):
+    urls = [f'/image/product/{i}' for i in catalog['products'][:20]] * 3 + ['/', '/products'] + \
+        [f'/product/{i}' for i in catalog['products'][:5]]
+    client = app.test_client()
+    for url in set(urls):
+        client.get(url, buffered=True)
+
+    restore = slow_database(STATEMENT_DELAY, DATABASE_CAPACITY)
+    try:
+        result = simulate(app, urls, clients=CLIENTS, duration=DURATION)
+    finally:
+        restore()
+    p99 = percentile(result['latencies'], 0.99)
+    assert set(result['statuses']) <= {200, 503}, result['statuses']
+    assert result['statuses'].get(200), result['statuses']
+    assert p99 <= MAX_P99, f"p99 {p99:.3f}s 超过 {MAX_P99}s，状态 {result['statuses']}"
+    # 模拟结束后所有名额都已释放
+    assert all(group['in_flight'] == 0 for group in app.extensions['load_shedding'].snapshot().values())
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+按路由的查询预算
+每个 main、auth、admin 路由在冷缓存（新应用、新数据库）下的一次请求不能超过：
+
+- SQL 语句数量：重新引入 N+1 查询（列表中逐个加载关联对象）时超出
+- 从图片列（LargeBinary）读取的字节数：页面和列表加载了图片数据时超出
+- 响应时间：QUERY_BUDGET_TIME_SCALE 环境变量可以在较慢的机器上按比例放宽
+
+新增路由时需要在 BUDGETS 中添加对应的预算，否则 test_every_route_has_a_budget 失败
+"""
+import io
+import os
+
+import pytest
+
+from conftest import GALLERY_PER_PRODUCT, IMAGE_SIZE, image_bytes, login, seed_catalog, timed
+
+# 响应时间预算（秒）
+PAGE_TIME = 0.5
+IMAGE_TIME = 0.1
+TIME_SCALE = float(os.environ.get('QUERY_BUDGET_TIME_SCALE') or 1)
+
+
+def _product_form(ids, **extra):
+    data = {'name': '新产品', 'description': '描述', 'category_id': ids['category'], 'status': 'y', 'stock': '1'}
+    data.update(extra)
+    return data
+
+
+# (端点, 方法): (地址, 是否以管理员登录, 预期状态码, 语句上限, 图片字节上限, 时间上限, 请求数据)
+# 地址中的 {product} 等占位符为示例目录中的记录ID；请求数据为函数时按记录ID生成
+# 管理员请求都包含一条加载登录用户的查询；写操作还包括统计计数、快照失效和缓存失效消息
+BUDGETS = {
+    # 前台页面：首次访问时生成进程内的产品目录（3条语句）和快照，之后由进程内缓存提供（见 test_catalog.py）
+    ('main.index', 'GET'): ('/', False, 200, 6, 0, PAGE_TIME, None),
+    ('main.about', 'GET'): ('/about', False, 302, 0, 0, PAGE_TIME, None),
+    ('main.products', 'GET'): ('/products?category={category}&page=2', False, 200, 3, 0, PAGE_TIME, None),
+    ('main.product_detail', 'GET'): ('/product/{product}', False, 200, 8, 0, PAGE_TIME, None),
+    ('main.contact', 'GET'): ('/contact', False, 200, 3, 0, PAGE_TIME, None),
+    ('main.contact', 'POST'): ('/contact', False, 302, 5, 0, PAGE_TIME, lambda ids: {
+        'name': '客户', 'email': 'c@example.com', 'phone': '13800000000', 'subject': '询价', 'message': '请报价'}),
+    # 图片：一条查询，只读取请求的那一张图片
+    ('main.get_product_image', 'GET'): ('/image/product/{product}', False, 200, 1, IMAGE_SIZE, IMAGE_TIME, None),
+    ('main.get_gallery_image', 'GET'): ('/image/gallery/{image}', False, 200, 1, IMAGE_SIZE, IMAGE_TIME, None),
+    ('main.get_page_content_image', 'GET'): ('/image/page-content/{page_content}', False, 200, 1, IMAGE_SIZE,
+                                             IMAGE_TIME, None),
+    # 站点地图：分片列表、分类、每个产品分片的图库图片和产品（流式查询，不读取图片数据）
+    ('main.sitemap_index', 'GET'): ('/sitemap.xml', False, 200, 4, 0, PAGE_TIME, None),
+    ('main.sitemap_part', 'GET'): ('/sitemap-products-0.xml', False, 200, 3, 0, PAGE_TIME, None),
+    ('main.robots_txt', 'GET'): ('/robots.txt', False, 200, 0, 0, PAGE_TIME, None),
+
+    ('auth.login', 'GET'): ('/auth/login', False, 200, 0, 0, PAGE_TIME, None),
+    # 登录：查询用户、更新最后登录时间（密码哈希本身较慢，时间预算放宽）
+    ('auth.login', 'POST'): ('/auth/login', False, 302, 3, 0, PAGE_TIME * 2, lambda ids: {
+        'username': 'admin', 'password': 'admin123'}),
+    ('auth.logout', 'GET'): ('/auth/logout', True, 302, 1, 0, PAGE_TIME, None),
+
+    ('admin.admin_dashboard', 'GET'): ('/admin/dashboard', True, 200, 6, 0, PAGE_TIME, None),
+    ('admin.stats_json', 'GET'): ('/admin/stats.json', True, 200, 2, 0, PAGE_TIME, None),
+    ('admin.db_pools_json', 'GET'): ('/admin/db-pools.json', True, 200, 1, 0, PAGE_TIME, None),
+    ('admin.concurrency_json', 'GET'): ('/admin/concurrency.json', True, 200, 1, 0, PAGE_TIME, None),
+    ('admin.single_flight_json', 'GET'): ('/admin/single-flight.json', True, 200, 1, 0, PAGE_TIME, None),
+    ('admin.list_profiles', 'GET'): ('/admin/profiles', True, 200, 1, 0, PAGE_TIME, None),
+    ('admin.download_profile', 'GET'): ('/admin/profiles/20260101T000000000000_main.index_1ms_1.folded', True, 404,
+                                        1, 0, PAGE_TIME, None),
+    ('admin.manage_categories', 'GET'): ('/admin/categories', True, 200, 3, 0, PAGE_TIME, None),
+    ('admin.manage_categories', 'POST'): ('/admin/categories', True, 302, 11, 0, PAGE_TIME, lambda ids: {
+        'name': '新分类'}),
+    ('admin.edit_category', 'GET'): ('/admin/categories/{category}/edit', True, 200, 2, 0, PAGE_TIME, None),
+    ('admin.edit_category', 'POST'): ('/admin/categories/{category}/edit', True, 302, 9, 0, PAGE_TIME, lambda ids: {
+        'name': '改名分类'}),
+    ('admin.delete_category', 'POST'): ('/admin/categories/{category}/delete', True, 302, 4, 0, PAGE_TIME, None),
+    ('admin.manage_products', 'GET'): ('/admin/products', True, 200, 3, 0, PAGE_TIME, None),
+    ('admin.add_product', 'GET'): ('/admin/products/add', True, 200, 3, 0, PAGE_TIME, None),
+    ('admin.add_product', 'POST'): ('/admin/products/add', True, 302, 14 + GALLERY_PER_PRODUCT, 0, PAGE_TIME,
+                                    lambda ids: _product_form(ids, main_image=(io.BytesIO(image_bytes(1)), 'a.jpg'),
+                                                              gallery_images=[(io.BytesIO(image_bytes(i)), f'{i}.jpg')
+                                                                              for i in range(GALLERY_PER_PRODUCT)])),
+    # 编辑页按产品对象填充表单，表单的 main_image 字段会读取这一个产品的主图
+    ('admin.edit_product', 'GET'): ('/admin/products/{product}/edit', True, 200, 5, IMAGE_SIZE, PAGE_TIME, None),
+    ('admin.edit_product', 'POST'): ('/admin/products/{product}/edit', True, 302, 11, IMAGE_SIZE, PAGE_TIME,
+                                     lambda ids: _product_form(ids, name='改名产品')),
+    ('admin.toggle_featured', 'POST'): ('/admin/products/{product}/toggle-featured', True, 302, 8, 0, PAGE_TIME, None),
+    ('admin.delete_product', 'POST'): ('/admin/products/{product}/delete', True, 302, 9, 0, PAGE_TIME, None),
+    ('admin.bulk_products', 'POST'): ('/admin/products/bulk', True, 302, 8, 0, PAGE_TIME, lambda ids: {
+        'action': 'unpublish', 'ids': ids['products'][:20]}),
+    ('admin.list_contacts', 'GET'): ('/admin/contacts', True, 200, 3, 0, PAGE_TIME, None),
+    ('admin.view_contact', 'GET'): ('/admin/contacts/{unread_contact}', True, 200, 6, 0, PAGE_TIME, None),
+    ('admin.delete_contact', 'POST'): ('/admin/contacts/delete/{unread_contact}', True, 302, 4, 0, PAGE_TIME, None),
+    ('admin.mark_all_read', 'POST'): ('/admin/contacts/mark_all_read', True, 302, 4, 0, PAGE_TIME, None),
+    ('admin.bulk_contacts', 'POST'): ('/admin/contacts/bulk', True, 302, 4, 0, PAGE_TIME, lambda ids: {
+        'action': 'delete', 'ids': ids['contacts']}),
+    ('admin.manage_product_images', 'GET'): ('/admin/products/{product}/images', True, 200, 3, 0, PAGE_TIME, None),
+    ('admin.manage_product_images', 'POST'): ('/admin/products/{product}/images', True, 302, 5 + GALLERY_PER_PRODUCT,
+                                              0, PAGE_TIME, lambda ids: {
+        'image': [(io.BytesIO(image_bytes(i)), f'{i}.jpg') for i in range(GALLERY_PER_PRODUCT)]}),
+    ('admin.delete_product_image', 'POST'): ('/admin/products/{product}/images/{image}/delete', True, 302, 6, 0,
+                                             PAGE_TIME, None),
+    # 图库接口返回 base64 图片数据：一条查询读取该产品的全部图库图片
+    ('admin.get_product_gallery_images', 'GET'): ('/admin/products/{product}/gallery_images', True, 200, 2,
+                                                  IMAGE_SIZE * GALLERY_PER_PRODUCT, PAGE_TIME, None),
+    ('admin.manage_page_content', 'GET'): ('/admin/page-content', True, 200, 2, 0, PAGE_TIME, None),
+    ('admin.save_page_content', 'POST'): ('/admin/page-content/save', True, 302, 5, 0, PAGE_TIME, lambda ids: {
+        'page_key': 'home_hero_title', 'content_type': 'text', 'content_value': '新标题'}),
+    ('admin.get_page_content_image', 'GET'): ('/admin/page-content/image/{page_content}', True, 200, 2, IMAGE_SIZE,
+                                              IMAGE_TIME, None),
+}
+
+
+def _ids(catalog):
+    """占位符对应的记录ID"""
+    return dict(catalog, product=catalog['products'][0], image=catalog['images'][0],
+                category=catalog['categories'][0], unread_contact=catalog['contacts'][1])
+
+
+def test_every_route_has_a_budget(app):
+    routes = {
+        (rule.endpoint, method)
+        for rule in app.url_map.iter_rules()
+        if rule.endpoint.split('.')[0] in ('main', 'auth', 'admin')
+        for method in rule.methods - {'HEAD', 'OPTIONS'}
+    }
+    missing = sorted(routes - set(BUDGETS))
+    assert not missing, f'以下路由没有查询预算: {missing}'
+
+
+def _check_budget(app, catalog, queries, key):
+    url, as_admin, expected_status, max_statements, max_blob_bytes, max_seconds, data = BUDGETS[key]
+    ids = _ids(catalog)
+    client = login(app.test_client()) if as_admin else app.test_client()
+    with queries:
+        response, elapsed = timed(client, key[1], url.format(**ids), data=data(ids) if data else None)
+    assert response.status_code == expected_status
+    assert queries.count <= max_statements, \
+        f'{key} 执行了 {queries.count} 条语句（预算 {max_statements}）:\n{queries.report()}'
+    assert queries.blob_bytes <= max_blob_bytes, \
+        f'{key} 读取了 {queries.blob_bytes} 字节图片数据（预算 {max_blob_bytes}）'
+    assert elapsed <= max_seconds * TIME_SCALE, f'{key} 耗时 {elapsed:.3f}s（预算 {max_seconds * TIME_SCALE}s）'
+
+
+@pytest.mark.parametrize('key', sorted(BUDGETS), ids=lambda key: f'{key[1]} {key[0]}')
+def test_route_budget(app, catalog, queries, key):
+    _check_budget(app, catalog, queries, key)
+
+
+@pytest.mark.config(IMAGE_APP_ENABLED=False)
+@pytest.mark.parametrize('key', [key for key in sorted(BUDGETS) if key[0].startswith('main.get_')],
+                         ids=lambda key: key[0])
+def test_blueprint_image_route_budget(app, catalog, queries, key):
+    """关闭轻量图片服务时由蓝图中的图片路由处理，预算相同"""
+    _check_budget(app, catalog, queries, key)
+
+
+# 语句数量不能随目录规模增长的列表页面
+LIST_PAGES = [
+    ('/', False),
+    ('/products', False),
+    ('/products?category={category}', False),
+    ('/product/{product}', False),
+    ('/sitemap.xml', False),
+    ('/admin/dashboard', True),
+    ('/admin/products', True),
+    ('/admin/categories', True),
+    ('/admin/contacts', True),
+    ('/admin/products/{product}/images', True),
+]
+
+
+def _measure(app, catalog, queries, url, as_admin):
+    """进程内缓存为空、快照表中已有快照时一次请求的语句数和图片字节数"""
+    from app import invalidation
+
+    client = login(app.test_client()) if as_admin else app.test_client()
+    timed(client, 'GET', url.format(**_ids(catalog)))
+    invalidation._clear_all()
+    with queries:
+        response, _ = timed(client, 'GET', url.format(**_ids(catalog)))
+    assert response.status_code == 200
+    return queries.count, queries.blob_bytes
+
+
+@pytest.mark.parametrize('url,as_admin', LIST_PAGES)
+def test_list_pages_do_not_scale_with_catalog(app, catalog, queries, url, as_admin):
+    before = _measure(app, catalog, queries, url, as_admin)
+    # 目录扩大到原来的两倍多（新分类、产品、图库图片和联系表单）
+    seed_catalog(app, with_admin=False)
+    after = _measure(app, catalog, queries, url, as_admin)
+    assert after == before, f'{url}: 语句数/图片字节数从 {before} 变为 {after}'
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询的执行计划：flask check-query-plans 在示例目录上不报告全表扫描或临时排序
+"""
+from app.query_plans import check_query_plans, hot_queries
+
+
+def test_hot_queries_use_indexes(app, catalog):
+    with app.app_context():
+        report = check_query_plans()
+    assert set(report) == set(hot_queries())
+    problems = {name: result['problems'] for name, result in report.items() if result['problems']}
+    assert not problems, '\n'.join(f'{name}: {result}' for name, result in problems.items())
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+读写分离：两个 SQLite 文件分别作为主库和只读副本（副本是主库某一时刻的拷贝，之后的修改模拟复制延迟）
+"""
+import shutil
+import time
+
+import pytest
+from flask import g, session
+
+from config import TestingConfig, replica_binds
+from conftest import image_bytes, seed_catalog
+
+PRIMARY_IMAGE = image_bytes(999)
+
+
+@pytest.fixture
+def replica_app(app, tmp_path, monkeypatch):
+    """配置了一个只读副本的应用，副本中第一个产品的主图落后于主库"""
+    from app import create_app, db
+
+    catalog = seed_catalog(app, categories=1, per_category=3, gallery=0)
+    replica_path = tmp_path / 'replica.db'
+    with app.app_context():
+        db.engine.dispose()
+    shutil.copyfile(tmp_path / 'test.db', replica_path)
+    with app.app_context():
+        db.session.execute(db.text('UPDATE products SET main_image = :data WHERE id = :id'),
+                           {'data': PRIMARY_IMAGE, 'id': catalog['products'][0]})
+        db.session.commit()
+
+    monkeypatch.setattr(TestingConfig, 'SQLALCHEMY_BINDS', replica_binds(f'sqlite:///{replica_path}'))
+    routed = create_app('testing')
+    routed.catalog = catalog
+    yield routed
+    with routed.app_context():
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.mark.parametrize('image_app', [
+    pytest.param(True, id='image-app'),
+    pytest.param(False, id='blueprint', marks=pytest.mark.config(IMAGE_APP_ENABLED=False)),
+])
+def test_images_read_from_replica(replica_app, image_app):
+    assert replica_app.extensions['db_routing'].names == ['replica_1']
+    response = replica_app.test_client().get(f"/image/product/{replica_app.catalog['products'][0]}", buffered=True)
+    assert response.status_code == 200
+    assert response.get_data() == image_bytes(0)
+
+
+def test_client_reads_primary_after_write(replica_app):
+    """读己之写：提交过修改的客户端在 REPLICA_STICKY_SECONDS 内不使用副本"""
+    from app.db_routing import STICKY_SESSION_KEY, replica_reads
+
+    client = replica_app.test_client()
+    response = client.post('/contact', data={'name': '客户', 'email': 'c@example.com', 'phone': '13800000000',
+                                             'subject': '询价', 'message': '请报价'}, buffered=True)
+    assert response.status_code == 302
+    with client.session_transaction() as stored:
+        until = stored[STICKY_SESSION_KEY]
+    assert until > time.time()
+
+    route = replica_reads(lambda: g.get('db_route'))
+    with replica_app.test_request_context():
+        assert route() == 'replica'
+    with replica_app.test_request_context():
+        session[STICKY_SESSION_KEY] = until
+        assert route() is None
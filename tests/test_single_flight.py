@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+请求合并（app/single_flight.py）：大量并发请求同一个键时生成函数只执行一次，
+异常和结果共享给等待的线程；快照、图片落盘在并发未命中时只生成一次
+"""
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import image_bytes
+
+THREADS_PER_KEY = 16
+KEYS = 8
+# 生成函数的耗时（秒），保证其他线程在生成期间到达
+BUILD_DELAY = 0.1
+
+
+def run_concurrently(targets):
+    """所有线程在同一时刻开始执行，返回各线程的结果（异常作为结果返回）"""
+    barrier = threading.Barrier(len(targets))
+    results = [None] * len(targets)
+
+    def worker(index, target):
+        barrier.wait()
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i, target)) for i, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+    return results
+
+
+def test_one_call_per_key_under_concurrency():
+    from app.single_flight import SingleFlight
+
+    flight = SingleFlight('test-stress')
+    calls = {}
+    lock = threading.Lock()
+
+    def build(key):
+        with lock:
+            calls[key] = calls.get(key, 0) + 1
+        time.sleep(BUILD_DELAY)
+        return f'value-{key}'
+
+    targets = [lambda key=key: flight.do(key, lambda: build(key)) for key in range(KEYS)] * THREADS_PER_KEY
+    results = run_concurrently(targets)
+    assert calls == {key: 1 for key in range(KEYS)}
+    assert results == [f'value-{key}' for key in range(KEYS)] * THREADS_PER_KEY
+    assert flight.stats() == {'leaders': KEYS, 'shared': KEYS * (THREADS_PER_KEY - 1), 'stale': 0,
+                              'timeouts': 0, 'in_flight': 0}
+
+
+def test_error_is_shared_with_waiters():
+    from app.single_flight import SingleFlight
+
+    flight = SingleFlight('test-error')
+    calls = []
+
+    def build():
+        calls.append(1)
+        time.sleep(BUILD_DELAY)
+        raise RuntimeError('生成失败')
+
+    results = run_concurrently([lambda: flight.do('key', build)] * THREADS_PER_KEY)
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+    # 失败后不保留结果，下一次调用重新生成
+    assert flight.do('key', lambda: 'ok') == 'ok'
+
+
+def test_waiter_builds_itself_after_timeout():
+    from app.single_flight import SingleFlight
+
+    flight = SingleFlight('test-timeout')
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5)))
+    leader.start()
+    time.sleep(0.05)
+    try:
+        assert flight.do('key', lambda: 'own', timeout=0.05) == 'own'
+        assert flight.timeouts == 1
+    finally:
+        release.set()
+        leader.join()
+
+
+def test_stale_value_is_returned_while_refreshing():
+    from app.single_flight import SingleFlight
+
+    flight = SingleFlight('test-stale')
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', lambda: release.wait(5) and 'new'))
+    leader.start()
+    time.sleep(0.05)
+    try:
+        started = time.monotonic()
+        assert flight.do('key', lambda: 'unused', stale='old') == 'old'
+        assert time.monotonic() - started < BUILD_DELAY
+    finally:
+        release.set()
+        leader.join()
+    # 没有其他线程在生成时，持有旧值的线程自己生成
+    assert flight.do('key', lambda: 'new', stale='old') == 'new'
+
+
+@pytest.mark.skipif(os.name == 'nt', reason='Windows 没有 fcntl')
+def test_file_lock_is_exclusive(tmp_path):
+    """每个线程单独打开锁文件，flock 的行为与多个进程相同"""
+    from app.single_flight import file_lock
+
+    path = str(tmp_path / 'locks' / 'variant.lock')
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def critical():
+        with file_lock(path) as locked:
+            assert locked
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    run_concurrently([critical] * 8)
+    assert peak[0] == 1
+
+    # 其他持有者不释放时，超时后不加锁继续
+    with open(path, 'a') as holder:
+        import fcntl
+        fcntl.flock(holder, fcntl.LOCK_EX)
+        with file_lock(path, timeout=0.05) as locked:
+            assert not locked
+
+
+def test_cold_product_snapshot_is_built_once(app, catalog, monkeypatch):
+    from app import snapshots
+
+    product_id = catalog['products'][0]
+    app.test_client().get('/products', buffered=True)
+    builds = []
+    original = snapshots._build_product
+
+    def slow_build(pid):
+        builds.append(pid)
+        time.sleep(BUILD_DELAY)
+        return original(pid)
+
+    monkeypatch.setattr(snapshots, '_build_product', slow_build)
+    results = run_concurrently([lambda: app.test_client().get(f'/product/{product_id}', buffered=True)] * 12)
+    assert [response.status_code for response in results] == [200] * 12
+    assert builds == [product_id]
+
+
+@pytest.mark.config(IMAGE_OFFLOAD='x-accel-redirect', IMAGE_RATE_LIMIT_ENABLED=False)
+def test_image_variant_is_written_once(app, catalog, monkeypatch):
+    from app import blob_store
+
+    store_root = app.config['BLOB_STORE_PATH']
+    writes = []
+    original = blob_store.write_variant
+
+    def slow_write(root, rel_path, version, data):
+        writes.append(rel_path)
+        time.sleep(BUILD_DELAY)
+        return original(root, rel_path, version, data)
+
+    monkeypatch.setattr(blob_store, 'write_variant', slow_write)
+    url = f"/image/product/{catalog['products'][0]}"
+    results = run_concurrently([lambda: app.test_client().get(url, buffered=True)] * 12)
+    redirects = {response.headers['X-Accel-Redirect'] for response in results}
+    assert len(writes) == 1
+    assert len(redirects) == 1
+    with open(os.path.join(store_root, redirects.pop()[len('/_blobs/'):]), 'rb') as f:
+        assert f.read() == image_bytes(0)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+站点地图（app/sitemap.py）：包含全部已上架产品及其图片，超过 SITEMAP_MAX_URLS 时分片，
+产品修改后只有所在的分片重新生成，其他分片的条件请求仍返回 304
+"""
+import xml.etree.ElementTree as ElementTree
+from urllib.parse import urlsplit
+
+import pytest
+
+from conftest import GALLERY_PER_PRODUCT
+
+NS = {'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9', 'image': 'http://www.google.com/schemas/sitemap-image/1.1'}
+# 分片测试：每片16个产品ID，目录中的60个产品分为4片
+SHARD_SIZE = 16
+
+
+def parse(response):
+    assert response.status_code == 200
+    assert response.mimetype == 'application/xml'
+    return ElementTree.fromstring(response.get_data())
+
+
+def product_entries(root):
+    """{产品ID: (lastmod, [图片路径])}"""
+    entries = {}
+    for url in root.findall('sm:url', NS):
+        path = urlsplit(url.findtext('sm:loc', namespaces=NS)).path
+        if path.startswith('/product/'):
+            images = [urlsplit(loc.text).path for loc in url.findall('image:image/image:loc', NS)]
+            entries[int(path.rsplit('/', 1)[1])] = (url.findtext('sm:lastmod', namespaces=NS), images)
+    return entries
+
+
+def active_products(app):
+    """{产品ID: updated_at}（已上架）"""
+    from app import db
+    from app.models import Product
+
+    with app.app_context():
+        return dict(db.session.query(Product.id, Product.updated_at).filter(Product.status == True))
+
+
+def test_sitemap_lists_active_products_with_images(app, client, catalog):
+    root = parse(client.get('/sitemap.xml', buffered=True))
+    assert root.tag == f"{{{NS['sm']}}}urlset"
+    entries = product_entries(root)
+    expected = active_products(app)
+    assert set(entries) == set(expected)
+    for product_id, (lastmod, images) in entries.items():
+        assert lastmod.startswith(expected[product_id].isoformat(timespec='seconds'))
+        assert images[0] == f'/image/product/{product_id}'
+        assert len(images) == 1 + GALLERY_PER_PRODUCT
+    pages = {urlsplit(loc.text).path + ('?' + urlsplit(loc.text).query if urlsplit(loc.text).query else '')
+             for loc in root.findall('sm:url/sm:loc', NS)}
+    assert {'/', '/products', '/contact'} <= pages
+    assert {f'/products?category={category_id}' for category_id in catalog['categories']} <= pages
+
+
+def test_warm_sitemap_is_cached_and_conditional(app, client, catalog, queries):
+    response = client.get('/sitemap.xml', buffered=True)
+    with queries:
+        again = client.get('/sitemap.xml', buffered=True)
+        not_modified = client.get('/sitemap.xml', headers={'If-None-Match': response.headers['ETag']},
+                                  buffered=True)
+    assert queries.count == 0, queries.report()
+    assert again.get_data() == response.get_data()
+    assert not_modified.status_code == 304
+
+
+@pytest.mark.config(SITEMAP_MAX_URLS=20, SITEMAP_SHARD_SIZE=SHARD_SIZE)
+def test_index_shards_past_max_urls(app, client, catalog):
+    root = parse(client.get('/sitemap.xml', buffered=True))
+    assert root.tag == f"{{{NS['sm']}}}sitemapindex"
+    locations = [urlsplit(loc.text).path for loc in root.findall('sm:sitemap/sm:loc', NS)]
+    assert locations[0] == '/sitemap-pages.xml'
+    shard_count = max(catalog['products']) // SHARD_SIZE - min(catalog['products']) // SHARD_SIZE + 1
+    assert len(locations) == 1 + shard_count
+    assert all(sitemap.findtext('sm:lastmod', namespaces=NS) for sitemap in root.findall('sm:sitemap', NS))
+
+    entries = {}
+    for location in locations[1:]:
+        shard = product_entries(parse(client.get(location, buffered=True)))
+        assert 0 < len(shard) <= SHARD_SIZE
+        assert not set(shard) & set(entries)
+        entries.update(shard)
+    assert set(entries) == set(active_products(app))
+    assert client.get('/sitemap-products-999.xml', buffered=True).status_code == 404
+
+
+@pytest.mark.config(SITEMAP_MAX_URLS=20, SITEMAP_SHARD_SIZE=SHARD_SIZE)
+def test_product_change_regenerates_only_its_shard(admin_client, catalog, queries):
+    shards = [urlsplit(loc.text).path for loc in
+              parse(admin_client.get('/sitemap.xml', buffered=True)).findall('sm:sitemap/sm:loc', NS)][1:]
+    etags = {shard: admin_client.get(shard, buffered=True).headers['ETag'] for shard in shards}
+
+    product_id = catalog['products'][0]
+    changed = f'/sitemap-products-{product_id // SHARD_SIZE}.xml'
+    # 编辑时取消上架
+    response = admin_client.post(f'/admin/products/{product_id}/edit', data={
+        'name': '下架产品', 'description': '描述', 'category_id': catalog['categories'][0], 'stock': '1'},
+        buffered=True)
+    assert response.status_code == 302
+
+    # 变化的分片重新生成（图库图片、产品两条查询，另有一次重新读取分片列表）；
+    # 其他分片直接由缓存提供，条件请求返回 304
+    for shard in shards:
+        with queries:
+            response = admin_client.get(shard, headers={'If-None-Match': etags[shard]}, buffered=True)
+        if shard == changed:
+            assert response.status_code == 200
+            assert product_id not in product_entries(parse(response))
+            assert queries.count <= 3, queries.report()
+        else:
+            assert response.status_code == 304
+            assert queries.count <= 1, queries.report()
+
+    # 批量上架不触发ORM事件，由视图调用 sitemap.invalidate_products()
+    admin_client.post('/admin/products/bulk', data={'action': 'publish', 'ids': [product_id]}, buffered=True)
+    assert product_id in product_entries(parse(admin_client.get(changed, buffered=True)))
+
+
+def test_robots_points_to_sitemap(client):
+    response = client.get('/robots.txt', buffered=True)
+    assert response.status_code == 200
+    assert 'Sitemap: http://localhost/sitemap.xml' in response.get_data(as_text=True)
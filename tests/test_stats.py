@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+仪表盘计数器（app/stats.py）：核对修正偏差，统计作为子查询在 UPDATE 中执行（不会覆盖并发的 bump()）
+"""
+
+
+def test_reconcile_counts_inside_update(app, catalog, queries):
+    from app import db, stats
+    from app.models import Product, SiteStatistic
+
+    with app.app_context():
+        db.session.get(SiteStatistic, 'product_count').value = 0
+        db.session.commit()
+        with queries:
+            drift = stats.reconcile()
+        actual = db.session.query(db.func.count(Product.id)).scalar()
+        assert drift == {'product_count': actual}
+        assert stats.get_counters()['product_count'] == actual
+    updates = [' '.join(s.split()).lower() for s in queries.statements if s.lstrip().upper().startswith('UPDATE')]
+    assert len(updates) == len(stats.COUNTER_QUERIES)
+    assert all('(select count(' in statement for statement in updates), queries.report()